@@ -0,0 +1,59 @@
+import csv
+import random
+from pathlib import Path
+
+_STREETS: tuple[str, ...] = (
+    "Main", "Oak", "Pine", "Maple", "Cedar", "Elm", "Lake", "Hill", "Park", "River", "Church", "Mill", "Station",
+    "Bridge", "Castle", "Garden", "Forest", "Spring", "Meadow", "King", "Queen", "Market", "North", "South",
+)
+_SUFFIXES: tuple[str, ...] = ("St", "Ave", "Rd", "Blvd", "Ln", "Way")
+_CITIES: tuple[str, ...] = ("Springfield", "Riverton", "Lakeside", "Fairview", "Georgetown", "Ashford", "Milton")
+_FIRST: tuple[str, ...] = (
+    "Anna", "Boris", "Clara", "Dimitar", "Elena", "Felix", "Greta", "Hugo", "Ivana", "Jonas", "Katya", "Lukas",
+    "Maria", "Nikola", "Olga", "Petar", "Rosa", "Stefan", "Tanya", "Viktor",
+)
+_LAST: tuple[str, ...] = (
+    "Ivanov", "Schmidt", "Novak", "Petrova", "Weber", "Kovac", "Horvat", "Fischer", "Georgiev", "Wagner", "Popov",
+    "Becker", "Dimitrova", "Hoffmann", "Nikolov",
+)
+
+
+def raw_address(rng: random.Random, index: int) -> str:
+    street = f"{_STREETS[index % len(_STREETS)]} {_SUFFIXES[index // len(_STREETS) % len(_SUFFIXES)]}"
+    # The same address as it might be typed by different people
+    spelling = rng.choice((
+        "{n} {street}, {city}", "{n} {street} {city}", "{n}  {street},  {city}", "{n} {street_lower}, {city_lower}",
+    ))
+    city = _CITIES[index % len(_CITIES)]
+    number = index // (len(_STREETS) * len(_SUFFIXES)) + 1
+    return spelling.format(n=number, street=street, city=city, street_lower=street.lower(), city_lower=city.lower())
+
+
+def tenant_name(rng: random.Random) -> str:
+    return f"{rng.choice(_FIRST)} {rng.choice(_LAST)} {rng.randrange(10_000)}"
+
+
+def generate_csv(path: Path, rows: int, tenants_per_address: float = 3.0, bad_ratio: float = 0.001,
+                 seed: int = 1) -> dict[str, list[str]]:
+    """
+    Write a CSV in the upload format (`name,address` header) with `rows` tenants spread over roughly
+    `rows / tenants_per_address` addresses. About `bad_ratio` of the rows have an address the fake geocoder cannot
+    normalize. The output only depends on the arguments
+    :return: a sample of the tenant names and raw addresses written, to search for afterwards
+    """
+    rng = random.Random(seed)
+    addresses = max(1, int(rows / tenants_per_address))
+    sample: dict[str, list[str]] = {"names": [], "addresses": []}
+    sample_every = max(1, rows // 10_000)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "address"])
+        for i in range(rows):
+            name = tenant_name(rng)
+            address = f"{rng.randrange(1000)} Unknown Rd" if rng.random() < bad_ratio else \
+                raw_address(rng, rng.randrange(addresses))
+            writer.writerow([name, address])
+            if i % sample_every == 0:
+                sample["names"].append(name)
+                sample["addresses"].append(address)
+    return sample
@@ -0,0 +1,40 @@
+import hashlib
+import time
+
+from src.geo.normalization import AddressParser, register_backend
+from src.util.logging import Logger
+from src.web.model import Address
+
+ENGINE: str = "fake"
+
+
+class FakeAddressParser(AddressParser):
+    """
+    Deterministic, in-process stand-in for a geocoding provider. The same input (up to case and whitespace) always
+    normalizes to the same address and coordinates, and inputs containing `unknown` cannot be normalized, like an
+    address the provider does not know
+    """
+
+    def __init__(self, logger: Logger, max_qps: float | None = None, latency: float = 0.0, **_kwargs):
+        """
+        :param latency: seconds every call sleeps for, to simulate the round trip to a real provider
+        """
+        AddressParser.__init__(self, logger, max_qps=max_qps)
+        self._latency: float = latency
+
+    def normalize(self, address: str) -> Address | None:
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire()
+        if self._latency:
+            time.sleep(self._latency)
+        full_address = " ".join(address.replace(",", " , ").split()).replace(" ,", ",").title()
+        if "Unknown" in full_address:
+            return None
+        digest = int.from_bytes(hashlib.blake2b(full_address.encode(), digest_size=8).digest(), "big")
+        lat = (digest % 180_000_000) / 1_000_000 - 90
+        lon = (digest // 180_000_000 % 360_000_000) / 1_000_000 - 180
+        return Address(full_address=full_address, lat=round(lat, 6), lon=round(lon, 6))
+
+
+def register(latency: float = 0.0) -> None:
+    register_backend(ENGINE, lambda **kwargs: FakeAddressParser(latency=latency, **kwargs))
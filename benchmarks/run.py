@@ -0,0 +1,219 @@
+"""
+Import and search benchmarks against the real Flask endpoints, with a deterministic in-process geocoder (see
+`fake_geocoder`) instead of a paid provider. Every scenario (database backend x number of rows) runs in a fresh
+process so that peak RSS is measured per scenario, and the results are written as JSON so that runs of two versions
+can be diffed.
+
+    python -m benchmarks.run --db sqlite postgres --rows 10000 100000 1000000 --out bench.json
+"""
+import argparse
+import dataclasses
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+_ROOT: Path = Path(__file__).resolve().parent.parent
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from benchmarks import datagen, fake_geocoder  # noqa: E402
+from config import DatabaseConfig  # noqa: E402
+
+
+@dataclasses.dataclass
+class Scenario:
+
+    db: str
+    rows: int
+    searches: int = 1000
+    import_workers: int = 8
+    geocoder_latency: float = 0.0
+    result_cache: bool = False
+    seed: int = 1
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'Scenario':
+        return cls(**data)
+
+    def to_dict(self) -> dict[str, Any]:
+        return dataclasses.asdict(self)
+
+
+def _latency_summary(samples: list[float]) -> dict[str, float]:
+    if len(samples) < 2:
+        return {"count": len(samples)}
+    q = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": q[49] * 1000,
+        "p95_ms": q[94] * 1000,
+        "p99_ms": q[98] * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _database_config(scenario: Scenario, workdir: Path) -> DatabaseConfig:
+    if scenario.db == "sqlite":
+        return DatabaseConfig(db_type="sqlite", db_name=str(workdir / "bench"))
+    return DatabaseConfig(
+        db_type="postgres",
+        username=os.getenv("DATABASE_USER", "postgres"),
+        password=os.getenv("DATABASE_PASSWORD", "postgres"),
+        host=os.getenv("DATABASE_HOST", "localhost"),
+        port=os.getenv("DATABASE_PORT", 5432),
+        db_name=os.getenv("BENCHMARK_DATABASE_NAME", "resonanz_bench"),
+    )
+
+
+def run_scenario(scenario: Scenario) -> dict[str, Any]:
+    """
+    Run one scenario in this process. The application is a singleton, so this can only be called once per process
+    """
+    from src.db.base import Base
+    from src.db.conn import Database
+    from src.util.logging import Logger
+    from src.web.app import Application
+
+    fake_geocoder.register(latency=scenario.geocoder_latency)
+    logger = Logger("BENCHMARK", level=logging.ERROR)
+    with tempfile.TemporaryDirectory(prefix="resonanz-bench-") as tmp:
+        workdir = Path(tmp)
+        db = Database(_database_config(scenario, workdir), logger=logger.new_from("DB"))
+        if scenario.db == "postgres":
+            # Start from empty tables, the database itself is reused between runs
+            Base.metadata.drop_all(db.engine)
+            db.create_tables()
+        app = Application(
+            logger.new_from("APP"), db, parser_engine=fake_geocoder.ENGINE, import_workers=scenario.import_workers,
+            import_spool_dir=workdir / "spool", result_cache_size=1024 if scenario.result_cache else 0,
+        )
+        client = app._app.test_client()
+
+        csv_path = workdir / "tenants.csv"
+        started = time.perf_counter()
+        sample = datagen.generate_csv(csv_path, scenario.rows, seed=scenario.seed)
+        generate_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        with open(csv_path, "rb") as f:
+            response = client.post("/insert/_batch", data={"file": (f, "tenants.csv")},
+                                   content_type="multipart/form-data")
+        if response.status_code != 202:
+            raise RuntimeError(f"Upload failed ({response.status_code}): {response.get_data(as_text=True)}")
+        status_url = response.json["status_url"]
+        while (job := client.get(status_url, query_string={"failures_limit": 0}).json)["status"] not in (
+                "completed", "failed"):
+            time.sleep(0.05)
+        import_seconds = time.perf_counter() - started
+        if job["status"] != "completed":
+            raise RuntimeError(f"Import failed: {job.get('error')}")
+
+        rng = random.Random(scenario.seed)
+        searches = {
+            "tenants_by_address": ("/search/_tenants", "address", sample["addresses"]),
+            "addresses_by_tenant": ("/search/_addresses", "name", sample["names"]),
+        }
+        search_results = {}
+        for label, (path, param, values) in searches.items():
+            latencies = []
+            for _ in range(scenario.searches):
+                value = rng.choice(values)
+                started = time.perf_counter()
+                response = client.get(path, query_string={param: value})
+                latencies.append(time.perf_counter() - started)
+                if response.status_code not in (200, 400):
+                    raise RuntimeError(f"{path}?{param}={value} failed with {response.status_code}")
+            search_results[label] = _latency_summary(latencies)
+
+        return {
+            "scenario": scenario.to_dict(),
+            "generate_seconds": generate_seconds,
+            "import": {
+                "seconds": import_seconds,
+                "rows_per_sec": scenario.rows / import_seconds,
+                "success": job["success"],
+                "failed": job["failed"],
+            },
+            "search": search_results,
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Run the import and search benchmarks")
+    ap.add_argument("--db", nargs="+", choices=("sqlite", "postgres"), default=["sqlite"],
+                    help="database backends to run against. postgres uses the DATABASE_* env vars (see README)")
+    ap.add_argument("--rows", nargs="+", type=int, default=[10_000, 100_000], help="CSV sizes to import")
+    ap.add_argument("--searches", type=int, default=1000, help="requests per search endpoint")
+    ap.add_argument("--import-workers", type=int, default=8)
+    ap.add_argument("--geocoder-latency", type=float, default=0.0,
+                    help="seconds the fake geocoder sleeps per call, to simulate a remote provider")
+    ap.add_argument("--result-cache", action="store_true", help="leave the search result cache enabled")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", type=Path, default=Path("benchmark-results.json"))
+    ap.add_argument("--scenario", type=str, help=argparse.SUPPRESS)  # internal: run one scenario in this process
+    args = ap.parse_args()
+
+    if args.scenario:
+        json.dump(run_scenario(Scenario.from_dict(json.loads(args.scenario))), sys.stdout)
+        return
+
+    results = []
+    for db in args.db:
+        for rows in args.rows:
+            scenario = Scenario(db=db, rows=rows, searches=args.searches, import_workers=args.import_workers,
+                                geocoder_latency=args.geocoder_latency, result_cache=args.result_cache,
+                                seed=args.seed)
+            print(f"Running {db} with {rows} rows...", file=sys.stderr)
+            proc = subprocess.run([sys.executable, "-m", "benchmarks.run", "--scenario", json.dumps(scenario.to_dict())],
+                                  cwd=_ROOT, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(proc.stderr, file=sys.stderr)
+                results.append({"scenario": scenario.to_dict(), "error": proc.stderr.strip().splitlines()[-1:]})
+                continue
+            result = json.loads(proc.stdout)
+            print(f"  {result['import']['rows_per_sec']:.0f} rows/s, "
+                  f"p95 {result['search']['tenants_by_address'].get('p95_ms', 0):.1f}ms / "
+                  f"{result['search']['addresses_by_tenant'].get('p95_ms', 0):.1f}ms, "
+                  f"peak RSS {result['peak_rss_mb']:.0f}MB", file=sys.stderr)
+            results.append(result)
+
+    report = {
+        "revision": _git_revision(),
+        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    args.out.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+    print(f"Wrote {args.out}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
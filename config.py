@@ -5,6 +5,7 @@ import os
 from pathlib import Path
 from typing import Any
 
+from src.geo.breaker import FailoverPolicy
 from src.geo.normalization import AddressParser
 
 
@@ -27,6 +28,46 @@ class _LogLevelLookup:
         return cls._reverse_mapping.get(level, default)
 
 
+@dataclasses.dataclass
+class SqliteProfile:
+    """
+    PRAGMAs applied to every new SQLite connection
+    """
+
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    busy_timeout_ms: int = 5000
+    cache_size_kb: int = 64 * 1024
+    mmap_size: int = 256 * 1024 * 1024
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'SqliteProfile':
+        return cls(
+            journal_mode=data.get("journal_mode", cls.journal_mode),
+            synchronous=data.get("synchronous", cls.synchronous),
+            busy_timeout_ms=data.get("busy_timeout_ms", cls.busy_timeout_ms),
+            cache_size_kb=data.get("cache_size_kb", cls.cache_size_kb),
+            mmap_size=data.get("mmap_size", cls.mmap_size),
+        )
+
+
+@dataclasses.dataclass
+class PostgresProfile:
+    """
+    Session settings applied to every new PostgreSQL connection
+    """
+
+    statement_timeout_ms: int = 0
+    application_name: str = "resonanz"
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'PostgresProfile':
+        return cls(
+            statement_timeout_ms=data.get("statement_timeout_ms", cls.statement_timeout_ms),
+            application_name=data.get("application_name", cls.application_name),
+        )
+
+
 @dataclasses.dataclass
 class DatabaseConfig:
 
@@ -36,6 +77,20 @@ class DatabaseConfig:
     host: str | None = None
     port: int | None = None
     db_name: str | None = None
+    bulk_insert: bool = True
+    # defaults to server_threads + import_jobs * (import_workers + 1), see `main._default_pool_size`
+    pool_size: int | None = None
+    max_overflow: int = 10
+    pool_timeout: float = 30
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    sqlite: SqliteProfile = dataclasses.field(default_factory=SqliteProfile)
+    postgres: PostgresProfile = dataclasses.field(default_factory=PostgresProfile)
+    # SQLAlchemy URLs of read replicas, searches are spread over them (see `Database._read`)
+    replicas: list[str] = dataclasses.field(default_factory=list)
+    # how far the replicas may be behind: for this long after a write its client reads from the primary
+    replica_lag_seconds: float = 5.0
+    replica_retry_seconds: float = 10.0
 
     @classmethod
     def from_dict(cls, data: dict[str, Any]) -> 'DatabaseConfig':
@@ -46,6 +101,37 @@ class DatabaseConfig:
             host=data.get("host", os.getenv("DATABASE_HOST", "localhost")),
             port=data.get("port", os.getenv("DATABASE_PORT", -1)),
             db_name=data.get("name", os.getenv("DATABASE_NAME", "resonanz")),
+            bulk_insert=data.get("bulk_insert", True),
+            pool_size=data.get("pool_size"),
+            max_overflow=data.get("max_overflow", cls.max_overflow),
+            pool_timeout=data.get("pool_timeout", cls.pool_timeout),
+            pool_recycle=data.get("pool_recycle", cls.pool_recycle),
+            pool_pre_ping=data.get("pool_pre_ping", cls.pool_pre_ping),
+            sqlite=SqliteProfile.from_dict(data.get("sqlite") or {}),
+            postgres=PostgresProfile.from_dict(data.get("postgres") or {}),
+            replicas=data.get("replicas") or [],
+            replica_lag_seconds=data.get("replica_lag_seconds", cls.replica_lag_seconds),
+            replica_retry_seconds=data.get("replica_retry_seconds", cls.replica_retry_seconds),
+        )
+
+
+@dataclasses.dataclass
+class GeocodeCacheConfig:
+
+    enabled: bool = True
+    max_size: int = 10_000
+    ttl_seconds: int = 60 * 60 * 24 * 30
+    negative_ttl_seconds: int = 60 * 60
+    persistent: bool = True
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'GeocodeCacheConfig':
+        return cls(
+            enabled=data.get("enabled", cls.enabled),
+            max_size=data.get("max_size", cls.max_size),
+            ttl_seconds=data.get("ttl_seconds", cls.ttl_seconds),
+            negative_ttl_seconds=data.get("negative_ttl_seconds", cls.negative_ttl_seconds),
+            persistent=data.get("persistent", cls.persistent),
         )
 
 
@@ -56,7 +142,20 @@ class Config:
     log_level: int
     address_parser_backend: str | None
     address_parser_api_key: str | None
+    address_parser_max_qps: float | None = None
+    address_parser_gazetteer: str | None = None
+    address_parser_failover: FailoverPolicy = dataclasses.field(default_factory=FailoverPolicy)
+    import_workers: int = 8
+    import_jobs: int = 2
+    server_threads: int = 8
+    server: str = "waitress"
+    server_workers: int = 1
+    import_spool_dir: str = "spool"
+    result_cache_size: int = 1024
+    compression_min_size: int = 1024
+    compression_level: int = 6
     database: DatabaseConfig | None = None
+    geocode_cache: GeocodeCacheConfig = dataclasses.field(default_factory=GeocodeCacheConfig)
 
     @classmethod
     def from_file(cls, path: Path = Path("config.json")) -> 'Config':
@@ -72,5 +171,18 @@ class Config:
             ),
             address_parser_backend=data.get("address_parser_backend", AddressParser.GOOGLE_MAPS),
             address_parser_api_key=data.get("address_parser_api_key"),
+            address_parser_max_qps=data.get("address_parser_max_qps"),
+            address_parser_gazetteer=data.get("address_parser_gazetteer"),
+            address_parser_failover=FailoverPolicy.from_dict(data.get("address_parser_failover") or {}),
+            import_workers=data.get("import_workers", 8),
+            import_jobs=data.get("import_jobs", 2),
+            server_threads=data.get("server_threads", 8),
+            server=data.get("server", "waitress"),
+            server_workers=data.get("server_workers", 1),
+            import_spool_dir=data.get("import_spool_dir", "spool"),
+            result_cache_size=data.get("result_cache_size", 1024),
+            compression_min_size=data.get("compression_min_size", 1024),
+            compression_level=data.get("compression_level", 6),
             database=DatabaseConfig.from_dict(data.get("database")) if data.get("database") else None,
+            geocode_cache=GeocodeCacheConfig.from_dict(data.get("geocode_cache") or {}),
         )
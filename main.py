@@ -1,25 +1,113 @@
 import argparse
+import sys
+from datetime import timedelta
 from pathlib import Path
 
 from config import Config
 from src.db.conn import Database
+from src.geo.local import Gazetteer
+from src.geo.normalization import GeocodeCache, new_parser
+from src.ingest import BatchImporter, OfflineImport
 from src.util.logging import Logger
 from src.web.app import Application
+from src.web.model import Address
 
 
 def main(config_path: Path):
     cfg = Config.from_file(path=config_path)
     logger = Logger("MAIN", level=cfg.log_level)
 
+    if cfg.database.pool_size is None:
+        # the pool is per worker process
+        cfg.database.pool_size = _default_pool_size(cfg.server_threads, cfg.import_jobs, cfg.import_workers)
     db = Database(cfg.database, logger=logger.new_from("DB"))
 
     app = Application(port=cfg.port, logger=logger.new_from("APP"), db=db,
-                      parser_engine=cfg.address_parser_backend, parser_api_key=cfg.address_parser_api_key)
-    app.run(debug=cfg.debug_mode)
+                      parser_engine=cfg.address_parser_backend, parser_api_key=cfg.address_parser_api_key,
+                      geocode_cache=_geocode_cache(cfg, db, logger), parser_max_qps=cfg.address_parser_max_qps,
+                      import_workers=cfg.import_workers, import_jobs=cfg.import_jobs,
+                      import_spool_dir=Path(cfg.import_spool_dir), result_cache_size=cfg.result_cache_size,
+                      threads=cfg.server_threads, parser_gazetteer=_gazetteer(cfg, logger), workers=cfg.server_workers,
+                      compression_min_size=cfg.compression_min_size, compression_level=cfg.compression_level,
+                      parser_failover=cfg.address_parser_failover)
+    app.run(debug=cfg.debug_mode, server=cfg.server)
+
+
+def import_csv(config_path: Path, csv_path: Path, workers: int | None, batch_size: int,
+               checkpoint_path: Path | None, restart: bool):
+    """
+    Import a CSV (same layout as the upload) without going through the web server, see `OfflineImport`
+    """
+    cfg = Config.from_file(path=config_path)
+    logger = Logger("IMPORT", level=cfg.log_level)
+    workers = workers or cfg.import_workers
+
+    if cfg.database.pool_size is None:
+        cfg.database.pool_size = _default_pool_size(0, 1, workers)
+    db = Database(cfg.database, logger=logger.new_from("DB"))
+    parser = new_parser(
+        cfg.address_parser_backend, logger=logger.new_from("ADDRESS_PARSER"), cache=_geocode_cache(cfg, db, logger),
+        max_qps=cfg.address_parser_max_qps, api_key=cfg.address_parser_api_key, gazetteer=_gazetteer(cfg, logger),
+        failover=cfg.address_parser_failover
+    )
+
+    def normalize(raw_address: str) -> Address:
+        if not raw_address:
+            raise ValueError("No address specified")
+        if not (address := parser.normalize(raw_address)):
+            raise ValueError(f"Could not normalize address: `{raw_address}`")
+        return address
+
+    importer = BatchImporter(normalize, db, logger.new_from("IMPORTER"), workers=workers, batch_size=batch_size)
+    try:
+        OfflineImport(importer, logger, out=sys.stdout).run(
+            csv_path, checkpoint_path or csv_path.with_name(f"{csv_path.name}.checkpoint"), restart=restart
+        )
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+
+def _default_pool_size(request_threads: int, import_jobs: int, import_workers: int) -> int:
+    """
+    Connections a process may hold at once: one per request thread, and for every running import one for its writer
+    and one per geocoding worker (for the persistent geocode cache lookups)
+    """
+    return request_threads + import_jobs * (import_workers + 1)
+
+
+def _geocode_cache(cfg: Config, db: Database, logger: Logger) -> GeocodeCache | None:
+    if not cfg.geocode_cache.enabled:
+        return None
+    return GeocodeCache(
+        logger=logger.new_from("GEOCODE_CACHE"),
+        max_size=cfg.geocode_cache.max_size,
+        ttl=timedelta(seconds=cfg.geocode_cache.ttl_seconds),
+        negative_ttl=timedelta(seconds=cfg.geocode_cache.negative_ttl_seconds),
+        db=db if cfg.geocode_cache.persistent else None,
+    )
+
+
+def _gazetteer(cfg: Config, logger: Logger) -> Gazetteer | None:
+    if not cfg.address_parser_gazetteer:
+        return None
+    return Gazetteer.from_file(Path(cfg.address_parser_gazetteer), logger=logger.new_from("GAZETTEER"))
 
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
     ap.add_argument("--config", "-c", type=str, default="config.json", help="Path to config file")
+    commands = ap.add_subparsers(dest="command", help="Runs the web server when omitted")
+    import_ap = commands.add_parser("import", help="Import a CSV file straight into the database")
+    import_ap.add_argument("csv", type=str, help="Path to the CSV file, with a header")
+    import_ap.add_argument("--workers", "-w", type=int, default=None,
+                           help="Addresses normalized in parallel, defaults to `import_workers` of the config")
+    import_ap.add_argument("--batch-size", "-b", type=int, default=1024, help="Rows written per transaction")
+    import_ap.add_argument("--checkpoint", type=str, default=None,
+                           help="Path to the checkpoint file, defaults to the CSV path + `.checkpoint`")
+    import_ap.add_argument("--restart", action="store_true", help="Ignore the checkpoint and import the whole file")
     args = ap.parse_args()
-    main(Path(args.config))
+    if args.command == "import":
+        import_csv(Path(args.config), Path(args.csv), workers=args.workers, batch_size=args.batch_size,
+                   checkpoint_path=Path(args.checkpoint) if args.checkpoint else None, restart=args.restart)
+    else:
+        main(Path(args.config))
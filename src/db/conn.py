@@ -1,29 +1,122 @@
 import contextlib
-from typing import Any
+import contextvars
+import heapq
+import time
+from datetime import datetime
+from typing import Any, Callable, Iterator, TypeVar
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import sessionmaker as SessionFactory, relationship
 from sqlalchemy.engine.base import Engine
 
 from config import DatabaseConfig
 from src.db.base import Base
+from src.db.migrations import Migrator
 from src.db.model import AddressModel
-from src.web.model import Address, Tenant
+from src.db.pool import TimedQueuePool
+from src.db.replicas import Replica, ReplicaSet
+from src.geo import geohash
+from src.geo.normalization import raw_address_key
+from src.web.model import Address, ImportJob, Tenant
 from src.db.session import Session
+from src.util import metrics
 from src.util.logging import Logger
 
 
+# See `Database.read_from_primary`
+_primary_reads: contextvars.ContextVar[bool] = contextvars.ContextVar("primary_reads", default=False)
+
+T = TypeVar("T")
+
+
+class DatabaseReadError(RuntimeError):
+    """
+    Raised when a query of the search methods failed. Unlike an empty result this says nothing about the stored
+    tenants, so it must not be cached
+    """
+
+
 class Database:
     TYPE_SQLITE = 'sqlite'
     TYPE_POSTGRES = 'postgres'
 
+    SEARCH_EXACT = Session.SEARCH_EXACT
+    SEARCH_PREFIX = Session.SEARCH_PREFIX
+    SEARCH_SUBSTRING = Session.SEARCH_SUBSTRING
+    SEARCH_MODES = (SEARCH_EXACT, SEARCH_PREFIX, SEARCH_SUBSTRING)
+
+    # Batches at least this large are loaded through COPY on PostgreSQL
+    _copy_threshold: int = 10_000
+
+    # Used when `DatabaseConfig.pool_size` is not set
+    _default_pool_size: int = 10
+
     def __init__(self, config: DatabaseConfig, logger: Logger):
         self._logger: Logger = logger
         self._config: DatabaseConfig = config
         self.engine: Engine = self._create_engine()
         self._session_factory: SessionFactory = SessionFactory(bind=self.engine)
+        self._session_logger: Logger = self._logger.new_from("Session")
+        self._tenant_fts: bool = False
+        self._replicas: ReplicaSet | None = None
+        if config.replicas:
+            self._replicas = ReplicaSet([self._create_engine(url) for url in config.replicas],
+                                        logger=self._logger.new_from("REPLICAS"),
+                                        retry_after=config.replica_retry_seconds)
         self.create_tables()
 
+    @property
+    def config(self) -> DatabaseConfig:
+        return self._config
+
+    @property
+    def generation(self) -> int:
+        """
+        Incremented in the transaction of every write of tenants. Anything derived from query results can be tagged
+        with it and is stale as soon as it changes. It is stored in the database (`tenant_generation`), so writes of
+        other processes, eg forked workers (see `web.prefork`) or the command line import, count as well
+        """
+        return self._tenant_generation()[0]
+
+    def _tenant_generation(self) -> tuple[int, float]:
+        """
+        See `session.get_tenant_generation`, read from the primary
+        """
+        try:
+            with self._read_session(None) as session:
+                return session.get_tenant_generation()
+        except Exception as e:
+            self._logger.error(f"Could not read the tenant generation\nError: `{e}`")
+            raise DatabaseReadError("Could not read the tenant generation") from e
+
+    @property
+    def has_replicas(self) -> bool:
+        return self._replicas is not None
+
+    @property
+    def replica_lag_seconds(self) -> float:
+        return self._config.replica_lag_seconds
+
+    @property
+    def reads_may_lag(self) -> bool:
+        """
+        Whether reads in the current context go to replicas which may not have the latest tenant writes yet, ie
+        results must not be tagged with the current `generation`
+        """
+        if self._replicas is None or _primary_reads.get():
+            return False
+        return time.time() - self._tenant_generation()[1] < self._config.replica_lag_seconds
+
+    def dispose_after_fork(self) -> None:
+        """
+        Called in a forked worker: drop the pooled connections inherited from the parent (without closing them, they
+        are still the parent's) so that the worker opens its own
+        """
+        self.engine.dispose(close=False)
+        if self._replicas is not None:
+            self._replicas.dispose(close=False)
+
     def _instrument_postgres_db(self) -> None:
         default_engine = create_engine(
             f'postgresql://{self._config.username}:{self._config.password}@{self._config.host}:{self._config.port}/postgres')
@@ -34,41 +127,186 @@ class Database:
                 conn.execute(text(f'CREATE DATABASE {self._config.db_name}'))
             conn.execute(text('commit'))
 
-    def _create_engine(self) -> Engine:
+    def _primary_connstr(self) -> str:
         match self._config.db_type:
             case Database.TYPE_SQLITE:
-                connstr = f'sqlite:///{self._config.db_name}.db'
+                return f'sqlite:///{self._config.db_name}.db'
             case Database.TYPE_POSTGRES:
                 self._instrument_postgres_db()
-                connstr = f'postgresql://{self._config.username}:{self._config.password}@{self._config.host}:{self._config.port}/{self._config.db_name}'
+                return f'postgresql://{self._config.username}:{self._config.password}@{self._config.host}:{self._config.port}/{self._config.db_name}'
             case _:
                 raise ValueError(f"Unsupported database type: {self._config.db_type}")
-        return create_engine(connstr)
+
+    def _create_engine(self, connstr: str | None = None) -> Engine:
+        """
+        :param connstr: a read replica, by default the primary database described by the config
+        """
+        if connstr is None:
+            connstr = self._primary_connstr()
+        engine = create_engine(
+            connstr,
+            poolclass=TimedQueuePool,
+            pool_size=self._config.pool_size or self._default_pool_size,
+            max_overflow=self._config.max_overflow,
+            pool_timeout=self._config.pool_timeout,
+            pool_recycle=self._config.pool_recycle,
+            pool_pre_ping=self._config.pool_pre_ping,
+        )
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        return engine
+
+    @staticmethod
+    def _before_cursor_execute(_conn: Any, _cursor: Any, _statement: str, _parameters: Any, context: Any,
+                               _executemany: bool) -> None:
+        # Kept on the statement's execution context, which is dropped with it even if the statement fails. The
+        # dialect's own setup queries run without a context and are not timed
+        if context is not None:
+            context.resonanz_statement_started = time.perf_counter()
+
+    @staticmethod
+    def _after_cursor_execute(_conn: Any, _cursor: Any, statement: str, _parameters: Any, context: Any,
+                              _executemany: bool) -> None:
+        if (started := getattr(context, "resonanz_statement_started", None)) is None:
+            return
+        elapsed = time.perf_counter() - started
+        # Label by statement type only, the statements themselves would make far too many series
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        metrics.DB_STATEMENT_SECONDS.labels(operation).observe(elapsed)
+
+    def _on_connect(self, dbapi_connection: Any, _connection_record: Any) -> None:
+        """
+        Apply the backend's performance profile to every new DBAPI connection
+        """
+        cursor = dbapi_connection.cursor()
+        try:
+            match self._config.db_type:
+                case Database.TYPE_SQLITE:
+                    profile = self._config.sqlite
+                    # WAL lets readers run alongside the single writer, and with it `synchronous=NORMAL` is still
+                    # safe against corruption (only the last transactions may be lost on power failure)
+                    cursor.execute(f"PRAGMA journal_mode={profile.journal_mode}")
+                    cursor.execute(f"PRAGMA synchronous={profile.synchronous}")
+                    cursor.execute(f"PRAGMA busy_timeout={int(profile.busy_timeout_ms)}")
+                    cursor.execute(f"PRAGMA cache_size=-{int(profile.cache_size_kb)}")
+                    cursor.execute(f"PRAGMA mmap_size={int(profile.mmap_size)}")
+                case Database.TYPE_POSTGRES:
+                    profile = self._config.postgres
+                    cursor.execute("SET statement_timeout = %s", (int(profile.statement_timeout_ms),))
+                    cursor.execute("SET application_name = %s", (profile.application_name,))
+                    # psycopg2 opened a transaction for these, and the pool rolls back on checkin, which would undo them
+                    dbapi_connection.commit()
+        finally:
+            cursor.close()
+
+    def pool_stats(self) -> dict[str, Any]:
+        """
+        Connection pool occupancy and checkout wait times (see `pool.CheckoutWaitStats`)
+        """
+        return self.engine.pool.stats()
+
+    def replica_stats(self) -> list[dict[str, Any]]:
+        """
+        Health and connection pool of every read replica
+        """
+        return self._replicas.stats() if self._replicas is not None else []
 
     def create_tables(self):
         Base.metadata.create_all(self.engine)
+        fulltext = Migrator(self.engine, self._logger.new_from("MIGRATOR")).migrate()
+        self._tenant_fts = fulltext and self._config.db_type == Database.TYPE_SQLITE
 
         # This has to be done here because the relationship must be defined in both models
         # Since one model must always be written above the other, this is the only place where it can be done
-        AddressModel.tenants = relationship('TenantModel', order_by=Tenant.id, back_populates='address')
+        AddressModel.tenants = relationship('TenantModel', order_by='TenantModel.id', back_populates='address')
 
     @contextlib.contextmanager
     def in_session(self) -> Session:
         raw_session = self._session_factory()
-        sess = Session(raw_session, self._logger.new_from("Session"))
+        sess = Session(raw_session, self._session_logger)
         try:
             yield sess
             raw_session.commit()
         except Exception as e:
-            self._logger.debug(f"Exception in session: {e}, rolling back...")
+            self._logger.debug("Exception in session: %s, rolling back...", e)
             raw_session.rollback()
             raise
         finally:
             raw_session.close()
 
-    def new_tenant(self, address: Address, tenant_name: str) -> Tenant | None:
+    def _read(self, query: Callable[[Session], T]) -> T:
+        """
+        Run a query which only reads, in a session which is closed without a commit. It goes to a read replica (round
+        robin, see `ReplicaSet`) unless the current context reads from the primary (see `read_from_primary`) or no
+        replica is healthy. If it fails on a replica, that replica is marked down and the query is retried once on the
+        next healthy replica, then on the primary
+        :param query: called with the session, its result is returned
+        """
+        for replica in self._read_targets():
+            try:
+                with self._read_session(replica) as session:
+                    return query(session)
+            except DBAPIError:
+                if replica is None:
+                    raise
+
+    def _iter_read(self, query: Callable[[Session], Iterator[T]]) -> Iterator[T]:
+        """
+        Streaming counterpart of `_read`. The session stays open until the iterator is exhausted or closed, and a
+        query is only retried elsewhere if it failed before its first row
+        """
+        for replica in self._read_targets():
+            streaming = False
+            try:
+                with self._read_session(replica) as session:
+                    for item in query(session):
+                        streaming = True
+                        yield item
+                return
+            except DBAPIError:
+                if replica is None or streaming:
+                    raise
+
+    def _read_targets(self) -> Iterator[Replica | None]:
+        """
+        Where a read is tried, in order: up to two healthy replicas, then the primary (None)
+        """
+        if self._replicas is not None and not _primary_reads.get():
+            tried: list[Replica] = []
+            while len(tried) < 2 and (replica := self._replicas.pick()) is not None and replica not in tried:
+                tried.append(replica)
+                yield replica
+        yield None
+
+    @contextlib.contextmanager
+    def _read_session(self, replica: Replica | None) -> Iterator[Session]:
+        """
+        :param replica: None for the primary
+        """
+        raw_session = (replica.session_factory if replica else self._session_factory)()
+        try:
+            yield Session(raw_session, self._session_logger)
+        except DBAPIError as e:
+            if replica is not None:
+                self._replicas.mark_down(replica, e)
+            raise
+        finally:
+            raw_session.close()
+
+    @staticmethod
+    def read_from_primary() -> None:
+        """
+        Send the reads of the current context (see `contextvars`) to the primary, eg for a client which has just
+        written and must see its write while the replicas may still lag behind
+        """
+        _primary_reads.set(True)
+
+    def new_tenant(self, address: Address, tenant_name: str, raw_address: str | None = None) -> Tenant | None:
         """
         Insert a new tenant into the database. First, insert the address and upon success, insert the tenant
+        :param raw_address: the user input which was normalized to `address`. If given, it is stored as an alias so
+        later searches for the same input can skip the geocoder
         """
         try:
             with self.in_session() as session:
@@ -76,87 +314,332 @@ class Database:
                 if not address.id:
                     self._logger.error(f"Could not insert address into database\n{address}")
                     raise
+                if raw_address:
+                    session.save_address_alias(raw_address_key(raw_address), address.id)
 
                 tenant = Tenant(name=tenant_name, address=address)
                 session.insert_tenant(tenant)
                 if not tenant.id:
                     self._logger.error(f"Could not insert tenant into database\n{tenant}")
                     raise
-                return tenant
+                session.bump_tenant_generation()
+            return tenant
 
         except Exception as e:
             self._logger.error(f"Could not insert new entry for tenant {tenant_name}\n{address}\nError: `{e}`")
             raise
 
-    def batch_insert_tenants(self, batch: list[tuple[str, Address]]) -> int:
+    def batch_insert_tenants(self, batch: list[tuple[str, Address, str | None]],
+                             on_failure: Callable[[int, str], None] | None = None) -> int:
         """
         Insert a batch of tenants into the database. See `session.insert_tenant`
-        This does them one by one so that we can verify IDs are set correctly
-        :param batch: a list of pairs of tenant names and addresses to insert
+        Unless bulk inserts are disabled, the batch is written with a few set-based statements (see
+        `session.bulk_insert_tenants` and, for very large batches on PostgreSQL, `session.copy_insert_tenants`).
+        If that fails the batch is retried row by row, so a single bad row only fails itself
+        :param batch: a list of (tenant name, normalized address, raw address) to insert. See `new_tenant`
+        :param on_failure: called with the index into `batch` and a reason for every row which could not be inserted
         :return: the number of successfully inserted tenants
         """
+        if self._config.bulk_insert:
+            try:
+                with self.in_session() as session:
+                    if self._config.db_type == Database.TYPE_POSTGRES and len(batch) >= self._copy_threshold:
+                        success_count = session.copy_insert_tenants(batch, on_failure=on_failure)
+                    else:
+                        success_count = session.bulk_insert_tenants(batch, on_failure=on_failure)
+                    session.bump_tenant_generation()
+                return success_count
+            except Exception as e:
+                self._logger.error(f"Bulk insert of {len(batch)} tenants failed, retrying row by row\nError: `{e}`")
+        return self._batch_insert_tenants_row_by_row(batch, on_failure=on_failure)
+
+    def _batch_insert_tenants_row_by_row(self, batch: list[tuple[str, Address, str | None]],
+                                         on_failure: Callable[[int, str], None] | None = None) -> int:
+        """
+        This does them one by one so that we can verify IDs are set correctly
+        """
         success_count = 0
 
         with self.in_session() as session:
-            for tenant_name, address in batch:
+            for i, (tenant_name, address, raw_address) in enumerate(batch):
                 try:
                     session.insert_address(address)
                     if not address.id:
                         self._logger.error(f"Could not insert address into database\n{address}")
+                        if on_failure:
+                            on_failure(i, "Could not insert address into database")
                         continue
+                    if raw_address:
+                        session.save_address_alias(raw_address_key(raw_address), address.id)
 
                     tenant = Tenant(name=tenant_name, address=address)
                     session.insert_tenant(tenant)
                     if tenant.id:
                         success_count += 1
+                    elif on_failure:
+                        on_failure(i, "Could not insert tenant into database")
                 except Exception as e:
                     self._logger.error(
                         f"Error during batch insert\nTenant: {tenant_name}, Address: {address}\nError: `{e}`")
+                    if on_failure:
+                        on_failure(i, f"Database error: {e}")
                     continue
+            session.bump_tenant_generation()
 
         return success_count
 
-    def get_all_tenants(self) -> list[Tenant]:
+    def get_all_tenants(self, limit: int | None = None, after_id: int | None = None) -> list[Tenant]:
+        """
+        See `session.get_all_tenants`
+        """
         try:
-            with self.in_session() as session:
-                return session.get_all_tenants()
+            return self._read(lambda session: session.get_all_tenants(limit=limit, after_id=after_id))
         except Exception as e:
             self._logger.error(f"Could not get all tenants\nError: `{e}`")
-            return []
+            raise DatabaseReadError("Could not get all tenants") from e
 
-    def get_tenants_at_address(self, address: Address) -> list[Tenant]:
+    def iter_all_tenants(self, limit: int | None = None, after_id: int | None = None) -> Iterator[Tenant]:
         """
-        Get all tenants at an address. See `session.find_tenants_at_address`
+        See `session.iter_all_tenants`. The session stays open until the iterator is exhausted or closed
+        """
+        try:
+            yield from self._iter_read(lambda session: session.iter_all_tenants(limit=limit, after_id=after_id))
+        except Exception as e:
+            self._logger.error(f"Could not stream all tenants\nError: `{e}`")
+            raise DatabaseReadError("Could not stream all tenants") from e
+
+    def get_tenants_by_alias(self, raw_address: str) -> list[Tenant] | None:
+        """
+        Get all tenants at the address a raw input was previously normalized to
+        :return: None if the input has not been seen before (the caller has to geocode it)
         """
+        def query(session: Session) -> list[Tenant] | None:
+            if (address_id := session.get_address_id_by_alias(raw_address_key(raw_address))) is None:
+                return None
+            return session.find_tenants_at_address(address_id)
+
         try:
+            return self._read(query)
+        except Exception as e:
+            self._logger.error(f"Could not get tenants for alias `{raw_address}`\nError: `{e}`")
+            raise DatabaseReadError(f"Could not get tenants for alias `{raw_address}`") from e
+
+    def get_address_id(self, address: Address | None = None, raw_address: str | None = None) -> int | None:
+        """
+        Resolve an address to its ID. If only the raw input is given, it is looked up in the alias table.
+        If both are given and the address exists, the raw input is stored as an alias (see `new_tenant`)
+        """
+        try:
+            if address is None:
+                if not raw_address:
+                    return None
+                return self._read(lambda session: session.get_address_id_by_alias(raw_address_key(raw_address)))
             with self.in_session() as session:
                 if not (res := session.get_address(address.full_address)):
-                    self._logger.error(f"Could not find address in database\n{address}")
-                    return []
-                return session.find_tenants_at_address(res.id)
+                    return None
+                if raw_address:
+                    session.save_address_alias(raw_address_key(raw_address), res.id)
+                return res.id
+        except Exception as e:
+            self._logger.error(f"Could not resolve address ID\n{address or raw_address}\nError: `{e}`")
+            return None
+
+    def get_tenants_at_address(self, address: Address, raw_address: str | None = None) -> list[Tenant]:
+        """
+        Get all tenants at an address. See `session.find_tenants_at_address`
+        :param raw_address: if given and the address exists, it is stored as an alias (see `new_tenant`)
+        """
+        def query(session: Session) -> tuple[int, list[Tenant]] | None:
+            if not (res := session.get_address(address.full_address)):
+                return None
+            return res.id, session.find_tenants_at_address(res.id)
+
+        try:
+            if (found := self._read(query)) is None:
+                self._logger.error(f"Could not find address in database\n{address}")
+                return []
+            address_id, tenants = found
+            if raw_address:
+                with self.in_session() as session:
+                    session.save_address_alias(raw_address_key(raw_address), address_id)
+            return tenants
         except Exception as e:
             self._logger.error(f"Could not get tenants at address\n{address}\nError: `{e}`")
-            return []
+            raise DatabaseReadError(f"Could not get tenants at address {address.full_address}") from e
 
-    def get_addresses_for_tenant_name(self, tenant_name: str) -> list[Tenant]:
+    def get_addresses_for_tenant_name(self, tenant_name: str, mode: str = SEARCH_EXACT) -> list[Tenant]:
         """
-        See `session.search_addresses_by_tenant`
+        See `session.search_addresses_by_tenant` and its prefix/substring variants
+        :param mode: one of `SEARCH_MODES`
         """
+        def query(session: Session) -> list[Tenant]:
+            match mode:
+                case Database.SEARCH_PREFIX:
+                    return session.search_addresses_by_tenant_prefix(tenant_name)
+                case Database.SEARCH_SUBSTRING:
+                    return session.search_addresses_by_tenant_substring(tenant_name, fulltext=self._tenant_fts)
+                case _:
+                    return session.search_addresses_by_tenant(tenant_name)
+
         try:
-            with self.in_session() as session:
-                return session.search_addresses_by_tenant(tenant_name)
+            return self._read(query)
         except Exception as e:
             self._logger.error(f"Could not get addresses for tenant name {tenant_name}\nError: `{e}`")
-            return []
+            raise DatabaseReadError(f"Could not get addresses for tenant name {tenant_name}") from e
+
+    def iter_tenants_by_address(self, address_id: int | None = None, tenant_name: str | None = None,
+                                mode: str = SEARCH_EXACT) -> Iterator[Tenant]:
+        """
+        See `session.iter_tenants_by_address`. The session stays open until the iterator is exhausted or closed
+        """
+        try:
+            yield from self._iter_read(lambda session: session.iter_tenants_by_address(
+                address_id=address_id, tenant_name=tenant_name, mode=mode, fulltext=self._tenant_fts
+            ))
+        except Exception as e:
+            self._logger.error(f"Could not stream tenants by address\nError: `{e}`")
+            raise DatabaseReadError("Could not stream tenants by address") from e
+
+    def get_tenants_near(self, lat: float, lon: float, radius_m: float,
+                         limit: int = 100) -> list[tuple[Tenant, float]]:
+        """
+        Tenants whose address is at most `radius_m` metres from a point, nearest first
+        :return: up to `limit` (tenant, distance in metres) pairs
+        """
+        boxes = geohash.radius_boxes(lat, lon, radius_m)
+        return self._nearest_tenants(lat, lon, boxes, limit, max_distance=radius_m)
+
+    def get_tenants_in_box(self, box: geohash.BoundingBox, limit: int = 100) -> list[tuple[Tenant, float]]:
+        """
+        Tenants whose address is inside a (min lat, min lon, max lat, max lon) box, nearest to its centre first.
+        A box whose min longitude is greater than its max longitude crosses the antimeridian
+        :return: up to `limit` (tenant, distance from the centre in metres) pairs
+        """
+        min_lat, min_lon, max_lat, max_lon = box
+        centre_lon = min_lon + ((max_lon - min_lon) % 360) / 2
+        centre_lon = centre_lon - 360 if centre_lon > 180 else centre_lon
+        return self._nearest_tenants((min_lat + max_lat) / 2, centre_lon, geohash.split_box(box), limit)
+
+    def _nearest_tenants(self, lat: float, lon: float, boxes: list[geohash.BoundingBox], limit: int,
+                         max_distance: float | None = None) -> list[tuple[Tenant, float]]:
+        """
+        Candidates come from the geohash index (see `session.iter_tenants_in_boxes`) and are streamed through the
+        exact distance check, keeping only the `limit` nearest in memory
+        """
+        def query(session: Session) -> list[tuple[Tenant, float]]:
+            candidates = (
+                (geohash.haversine_m(lat, lon, t.address.lat, t.address.lon), t.id, t)
+                for t in session.iter_tenants_in_boxes(boxes, geohash.covering_prefixes(boxes))
+            )
+            if max_distance is not None:
+                candidates = (c for c in candidates if c[0] <= max_distance)
+            return [(t, distance) for distance, _, t in heapq.nsmallest(limit, candidates)]
+
+        try:
+            return self._read(query)
+        except Exception as e:
+            self._logger.error(f"Could not get tenants near ({lat}, {lon})\nError: `{e}`")
+            raise DatabaseReadError(f"Could not get tenants near ({lat}, {lon})") from e
 
     def get_address_location(self, address: Address) -> tuple[float, float] | None:
-        # Not used, was going to have a Google Maps integration on the Frontend, but it would have taken too long
+        """
+        The stored coordinates of an address, or None if it is not stored or has none
+        """
+        def query(session: Session) -> tuple[float | None, float | None] | None:
+            if not (res := session.get_address(address.full_address)):
+                return None
+            return res.lat, res.lon
+
         try:
-            with self.in_session() as session:
-                if not (res := session.get_address(address.full_address)):
-                    self._logger.error(f"Could not find address in database\n{address}")
-                    return
-                return res.lat, res.lon
+            if (location := self._read(query)) is None:
+                self._logger.error(f"Could not find address in database\n{address}")
+                return
+            if location[0] is None or location[1] is None:
+                return
+            return location
         except Exception as e:
             self._logger.error(f"Could not get address with ID {address}\nError: `{e}`")
-            return
+            raise DatabaseReadError(f"Could not get the location of address {address.full_address}") from e
+
+    def get_cached_geocode(self, raw_address_key: str) -> tuple[Address | None, datetime] | None:
+        """
+        See `session.get_geocode_cache_entry`. Errors are treated as a cache miss
+        """
+        try:
+            with self.in_session() as session:
+                return session.get_geocode_cache_entry(raw_address_key)
+        except Exception as e:
+            self._logger.error(f"Could not read geocode cache entry `{raw_address_key}`\nError: `{e}`")
+            return None
+
+    def save_cached_geocode(self, raw_address_key: str, address: Address | None, expires_at: datetime) -> None:
+        try:
+            with self.in_session() as session:
+                session.save_geocode_cache_entry(raw_address_key, address, expires_at)
+        except Exception as e:
+            self._logger.error(f"Could not save geocode cache entry `{raw_address_key}`\nError: `{e}`")
+
+    def create_import_job(self, job: ImportJob) -> None:
+        with self.in_session() as session:
+            session.insert_import_job(job)
+
+    def update_import_job(self, job_id: str, **fields) -> None:
+        try:
+            with self.in_session() as session:
+                session.update_import_job(job_id, **fields)
+        except Exception as e:
+            self._logger.error(f"Could not update import job {job_id}\nError: `{e}`")
+
+    def update_import_job_if(self, job_id: str, expected: dict, **fields) -> bool:
+        """
+        Update the job only if its columns still hold the `expected` values (eg to move it out of a status exactly once
+        across threads and worker processes)
+        :return: whether it was updated
+        """
+        try:
+            with self.in_session() as session:
+                return session.update_import_job_if(job_id, expected, **fields)
+        except Exception as e:
+            self._logger.error(f"Could not update import job {job_id}\nError: `{e}`")
+            return False
+
+    def advance_upload(self, job_id: str, offset: int, length: int, lines: int) -> bool:
+        """
+        Commit a chunk of a chunked upload which was written at `offset`
+        :return: False if the committed offset is not `offset` anymore (the chunk was committed by a concurrent request)
+        """
+        with self.in_session() as session:
+            return session.advance_upload(job_id, offset, length, lines)
+
+    def record_import_progress(self, job_id: str, checkpoint_row: int, success: int, failed: int,
+                               failures: list[tuple[int, str]]) -> None:
+        """
+        Store a job checkpoint together with the row failures since the previous one, in one transaction
+        """
+        with self.in_session() as session:
+            session.insert_import_failures(job_id, failures)
+            session.update_import_job(job_id, checkpoint_row=checkpoint_row, success=success, failed=failed)
+
+    def get_import_job(self, job_id: str) -> ImportJob | None:
+        try:
+            with self.in_session() as session:
+                return session.get_import_job(job_id)
+        except Exception as e:
+            self._logger.error(f"Could not get import job {job_id}\nError: `{e}`")
+            return None
+
+    def get_unfinished_import_jobs(self) -> list[ImportJob]:
+        try:
+            with self.in_session() as session:
+                return session.get_import_jobs_by_status(ImportJob.QUEUED, ImportJob.RUNNING)
+        except Exception as e:
+            self._logger.error(f"Could not get unfinished import jobs\nError: `{e}`")
+            return []
+
+    def get_import_failures(self, job_id: str, offset: int = 0, limit: int = 100) -> list[tuple[int, str]]:
+        try:
+            with self.in_session() as session:
+                return session.get_import_failures(job_id, offset=offset, limit=limit)
+        except Exception as e:
+            self._logger.error(f"Could not get failures for import job {job_id}\nError: `{e}`")
+            return []
@@ -0,0 +1,151 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine.base import Engine
+
+from src.db.base import Base
+from src.geo import geohash
+from src.util.logging import Logger
+
+
+class Migrator:
+    """
+    Schema changes which `Base.metadata.create_all` cannot apply to an existing database (it only creates missing
+    tables). Every step is idempotent, so this runs on each startup
+    """
+
+    _backfill_batch_size: int = 10_000
+
+    def __init__(self, engine: Engine, logger: Logger):
+        self._engine: Engine = engine
+        self._logger: Logger = logger
+
+    def migrate(self) -> bool:
+        """
+        :return: whether a full text (substring) index over tenant names is available
+        """
+        self._add_address_geohash()
+        self._add_import_job_upload_columns()
+        self._create_missing_indexes()
+        self._create_tenant_generation_row()
+        match self._engine.dialect.name:
+            case 'sqlite':
+                return self._create_tenant_fts_sqlite()
+            case 'postgresql':
+                self._create_tenant_prefix_index_postgres()
+                return self._create_tenant_trgm_postgres()
+        return False
+
+    def _add_address_geohash(self) -> None:
+        """
+        Add `addresses.geohash` to databases created before it existed and fill it in for every address with
+        coordinates which does not have one yet (the index is created afterwards, with the other missing indexes)
+        """
+        if 'geohash' not in {c['name'] for c in inspect(self._engine).get_columns('addresses')}:
+            with self._engine.begin() as conn:
+                conn.execute(text("ALTER TABLE addresses ADD COLUMN geohash VARCHAR(12)"))
+            self._logger.info("Added addresses.geohash")
+
+        backfilled = 0
+        while True:
+            with self._engine.begin() as conn:
+                rows = conn.execute(text(
+                    "SELECT id, lat, lon FROM addresses "
+                    "WHERE geohash IS NULL AND lat IS NOT NULL AND lon IS NOT NULL LIMIT :n"
+                ), {"n": self._backfill_batch_size}).all()
+                if not rows:
+                    break
+                conn.execute(text("UPDATE addresses SET geohash = :geohash WHERE id = :id"), [
+                    {"id": id_, "geohash": geohash.encode(lat, lon)} for id_, lat, lon in rows
+                ])
+            backfilled += len(rows)
+        if backfilled:
+            self._logger.info("Backfilled the geohash of %d addresses", backfilled)
+
+    def _add_import_job_upload_columns(self) -> None:
+        """
+        Add the chunked upload progress columns to `import_jobs` created before they existed
+        """
+        existing = {c['name'] for c in inspect(self._engine).get_columns('import_jobs')}
+        for column in ('upload_size', 'uploaded_bytes'):
+            if column not in existing:
+                with self._engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE import_jobs ADD COLUMN {column} BIGINT"))
+                self._logger.info("Added import_jobs.%s", column)
+
+    def _create_tenant_generation_row(self) -> None:
+        """
+        The single row of `tenant_generation`, which every write of tenants updates
+        """
+        try:
+            with self._engine.begin() as conn:
+                if conn.execute(text("SELECT 1 FROM tenant_generation WHERE id = 1")).first() is None:
+                    conn.execute(text("INSERT INTO tenant_generation (id, generation, written_at) VALUES (1, 0, 0)"))
+        except IntegrityError:
+            pass  # another process starting at the same time created it
+
+    def _create_missing_indexes(self) -> None:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self._engine, checkfirst=True)
+
+    def _create_tenant_fts_sqlite(self) -> bool:
+        """
+        External content FTS5 table over `tenants.name_lower` with the trigram tokenizer (which supports substring
+        queries), kept in sync by triggers. Existing rows are backfilled when the table is first created
+        """
+        if inspect(self._engine).has_table('tenants_fts'):
+            return True
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(text(
+                    "CREATE VIRTUAL TABLE tenants_fts USING fts5("
+                    "name_lower, content='tenants', content_rowid='id', tokenize='trigram')"
+                ))
+                conn.execute(text(
+                    "CREATE TRIGGER tenants_fts_ai AFTER INSERT ON tenants BEGIN "
+                    "INSERT INTO tenants_fts(rowid, name_lower) VALUES (new.id, new.name_lower); END"
+                ))
+                conn.execute(text(
+                    "CREATE TRIGGER tenants_fts_ad AFTER DELETE ON tenants BEGIN "
+                    "INSERT INTO tenants_fts(tenants_fts, rowid, name_lower) VALUES ('delete', old.id, old.name_lower); "
+                    "END"
+                ))
+                conn.execute(text(
+                    "CREATE TRIGGER tenants_fts_au AFTER UPDATE ON tenants BEGIN "
+                    "INSERT INTO tenants_fts(tenants_fts, rowid, name_lower) VALUES ('delete', old.id, old.name_lower); "
+                    "INSERT INTO tenants_fts(rowid, name_lower) VALUES (new.id, new.name_lower); END"
+                ))
+                conn.execute(text("INSERT INTO tenants_fts(tenants_fts) VALUES ('rebuild')"))
+        except Exception as e:
+            # FTS5 or the trigram tokenizer (SQLite 3.34+) is not compiled in
+            self._logger.warning(f"Could not create full text index, substring search will scan tenants\nError: `{e}`")
+            return False
+        self._logger.info("Created and backfilled tenants_fts")
+        return True
+
+    def _create_tenant_prefix_index_postgres(self) -> None:
+        """
+        B-tree index over `tenants.name_lower` in code point order (`text_pattern_ops`), which PostgreSQL uses for
+        `LIKE 'prefix%'` whatever the database's collation. The plain index follows the collation, so it only serves
+        prefix searches under the C collation
+        """
+        with self._engine.begin() as conn:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_tenants_name_lower_pattern ON tenants (name_lower text_pattern_ops)"
+            ))
+
+    def _create_tenant_trgm_postgres(self) -> bool:
+        """
+        Trigram GIN index over `tenants.name_lower`, which PostgreSQL uses for `LIKE '%...%'`. Creating the index
+        indexes the existing rows as well
+        """
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_tenants_name_lower_trgm ON tenants USING gin (name_lower gin_trgm_ops)"
+                ))
+        except Exception as e:
+            self._logger.warning(f"Could not create trigram index, substring search will scan tenants\nError: `{e}`")
+            return False
+        return True
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, UniqueConstraint
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Column, Integer, String, ForeignKey, Float, UniqueConstraint, DateTime, Index
 from sqlalchemy.orm import relationship
 
 from src.db.base import Base
@@ -11,6 +13,8 @@ class AddressModel(Base):
     full_address: str = Column(String, nullable=False, unique=True)
     lat: float = Column(Float, nullable=True)
     lon: float = Column(Float, nullable=True)
+    # derived from lat/lon (see `geo.geohash`), null without coordinates. Prefilters the radius searches
+    geohash: str = Column(String(12), nullable=True, index=True)
 
 
 class TenantModel(Base):
@@ -24,4 +28,63 @@ class TenantModel(Base):
 
     __table_args__ = (
         UniqueConstraint('name', 'address_id', name='_name_address_uc'),  # Enforce unique combination
+        # Serves both lookups by name and by (name, address), see `Session.get_tenant`
+        Index('ix_tenants_name_lower_address_id', 'name_lower', 'address_id'),
+        Index('ix_tenants_address_id', 'address_id'),
     )
+
+
+class AddressAliasModel(Base):
+    __tablename__ = 'address_aliases'
+
+    alias: str = Column(String, primary_key=True)  # raw user input, see `raw_address_key`
+    address_id: int = Column(Integer, ForeignKey('addresses.id'), nullable=False)
+
+
+class GeocodeCacheModel(Base):
+    __tablename__ = 'geocode_cache'
+
+    raw_address: str = Column(String, primary_key=True)  # see `raw_address_key`
+    full_address: str = Column(String, nullable=True)  # NULL marks a failed normalization
+    lat: float = Column(Float, nullable=True)
+    lon: float = Column(Float, nullable=True)
+    expires_at: datetime = Column(DateTime, nullable=False)
+
+
+class TenantGenerationModel(Base):
+    __tablename__ = 'tenant_generation'
+
+    # a single row (id 1), see `Database.generation`
+    id: int = Column(Integer, primary_key=True)
+    generation: int = Column(BigInteger, nullable=False, default=0)
+    written_at: float = Column(Float, nullable=False, default=0.0)  # unix time of the last write of tenants
+
+
+class ImportJobModel(Base):
+    __tablename__ = 'import_jobs'
+
+    id: str = Column(String, primary_key=True)
+    filename: str = Column(String, nullable=False)
+    spool_path: str = Column(String, nullable=False)
+    status: str = Column(String, nullable=False)
+    rows_total: int = Column(Integer, nullable=True)  # estimated from the line count of the spooled file
+    checkpoint_row: int = Column(Integer, nullable=False, default=0)  # every row up to this one is committed
+    resumed_from_row: int = Column(Integer, nullable=False, default=0)  # checkpoint when the current run started
+    success: int = Column(Integer, nullable=False, default=0)
+    failed: int = Column(Integer, nullable=False, default=0)
+    error: str = Column(String, nullable=True)
+    created_at: datetime = Column(DateTime, nullable=False)
+    started_at: datetime = Column(DateTime, nullable=True)
+    finished_at: datetime = Column(DateTime, nullable=True)
+    # chunked uploads only (null for single request uploads): declared size of the file, bytes committed so far
+    upload_size: int = Column(BigInteger, nullable=True)
+    uploaded_bytes: int = Column(BigInteger, nullable=True)
+
+
+class ImportFailureModel(Base):
+    __tablename__ = 'import_failures'
+
+    id: int = Column(Integer, primary_key=True)
+    job_id: str = Column(String, ForeignKey('import_jobs.id'), nullable=False, index=True)
+    row: int = Column(Integer, nullable=False)
+    reason: str = Column(String, nullable=False)
@@ -0,0 +1,83 @@
+import bisect
+import threading
+import time
+from typing import Any
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class CheckoutWaitStats:
+    """
+    Histogram of how long callers waited to check a connection out of the pool. A pool which is too small for the
+    number of threads using it shows up as a growing tail here, long before checkouts start timing out
+    """
+
+    # upper bounds of the histogram buckets, in seconds
+    BUCKETS: tuple[float, ...] = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self._lock: threading.Lock = threading.Lock()
+        self._counts: list[int] = [0] * (len(self.BUCKETS) + 1)
+        self._checkouts: int = 0
+        self._timeouts: int = 0
+        self._total_wait: float = 0.0
+        self._max_wait: float = 0.0
+
+    def observe(self, wait: float, timed_out: bool = False) -> None:
+        with self._lock:
+            self._counts[bisect.bisect_left(self.BUCKETS, wait)] += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            if timed_out:
+                self._timeouts += 1
+            else:
+                self._checkouts += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        with self._lock:
+            observed = self._checkouts + self._timeouts
+            buckets = {f"le_{bound}": count for bound, count in zip(self.BUCKETS, self._counts)}
+            buckets["le_inf"] = self._counts[-1]
+            return {
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "avg_wait_seconds": self._total_wait / observed if observed else 0.0,
+                "max_wait_seconds": self._max_wait,
+                "wait_seconds_buckets": buckets,
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """
+    `QueuePool` which records how long every checkout waited for a connection (see `CheckoutWaitStats`)
+    """
+
+    def __init__(self, *args, wait_stats: CheckoutWaitStats | None = None, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.wait_stats: CheckoutWaitStats = wait_stats or CheckoutWaitStats()
+
+    def _do_get(self) -> Any:
+        started = time.perf_counter()
+        try:
+            conn = QueuePool._do_get(self)
+        except PoolTimeoutError:
+            self.wait_stats.observe(time.perf_counter() - started, timed_out=True)
+            raise
+        self.wait_stats.observe(time.perf_counter() - started)
+        return conn
+
+    def recreate(self) -> 'TimedQueuePool':
+        # Keep the counters when the engine is disposed and the pool replaced
+        pool = QueuePool.recreate(self)
+        pool.wait_stats = self.wait_stats
+        return pool
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+            "idle": self.checkedin(),
+            **self.wait_stats.to_dict(),
+        }
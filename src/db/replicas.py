@@ -0,0 +1,77 @@
+import itertools
+import threading
+import time
+from typing import Any, Iterator
+
+from sqlalchemy import text
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import sessionmaker as SessionFactory
+
+from src.util.logging import Logger
+
+
+class Replica:
+
+    def __init__(self, engine: Engine):
+        self.engine: Engine = engine
+        self.session_factory: SessionFactory = SessionFactory(bind=engine)
+        self.name: str = engine.url.render_as_string(hide_password=True)
+        # monotonic time until which the replica gets no reads, 0 while it is healthy
+        self.down_until: float = 0.0
+
+
+class ReplicaSet:
+    """
+    Read replicas of the database, handed out round robin. A replica on which a statement failed is skipped for
+    `retry_after` seconds, then it has to answer a `SELECT 1` before it gets reads again
+    """
+
+    def __init__(self, engines: list[Engine], logger: Logger, retry_after: float = 10.0):
+        self._replicas: list[Replica] = [Replica(engine) for engine in engines]
+        self._logger: Logger = logger
+        self._retry_after: float = retry_after
+        self._lock: threading.Lock = threading.Lock()
+        self._next: Iterator[int] = itertools.count()
+
+    def pick(self) -> Replica | None:
+        """
+        :return: the next healthy replica, None if there is none
+        """
+        with self._lock:
+            start = next(self._next)
+        now = time.monotonic()
+        for i in range(len(self._replicas)):
+            replica = self._replicas[(start + i) % len(self._replicas)]
+            if not replica.down_until:
+                return replica
+            if now >= replica.down_until and self._check(replica):
+                return replica
+        return None
+
+    def mark_down(self, replica: Replica, error: Exception) -> None:
+        if not replica.down_until:
+            self._logger.error(f"Read replica {replica.name} failed, skipping it for {self._retry_after}s\n"
+                               f"Error: `{error}`")
+        replica.down_until = time.monotonic() + self._retry_after
+
+    def _check(self, replica: Replica) -> bool:
+        try:
+            with replica.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception as e:
+            replica.down_until = time.monotonic() + self._retry_after
+            self._logger.warning(f"Read replica {replica.name} is still down: `{e}`")
+            return False
+        replica.down_until = 0.0
+        self._logger.info("Read replica %s is back", replica.name)
+        return True
+
+    def dispose(self, close: bool = True) -> None:
+        for replica in self._replicas:
+            replica.engine.dispose(close=close)
+
+    def stats(self) -> list[dict[str, Any]]:
+        return [
+            {"replica": replica.name, "healthy": not replica.down_until, "pool": replica.engine.pool.stats()}
+            for replica in self._replicas
+        ]
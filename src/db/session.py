@@ -1,13 +1,42 @@
+import csv
+import io
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Iterator, TypeVar
+
+from sqlalchemy import ColumnElement, Integer, Select, and_, or_, select, text, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session as SQLAlchemySession
 
 from src.db.base import Base
-from src.web.model import Address, Tenant
-from src.db.model import AddressModel, TenantModel
+from src.web.model import Address, ImportJob, Tenant
+from src.db.model import (
+    AddressModel, TenantModel, AddressAliasModel, GeocodeCacheModel, ImportJobModel, ImportFailureModel,
+    TenantGenerationModel
+)
+from src.geo import geohash
+from src.geo.normalization import raw_address_key
 from src.util.logging import Logger
 
 
+_T = TypeVar('_T')
+
+
+def _chunks(items: list[_T], size: int) -> Iterator[list[_T]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 class Session:
 
+    SEARCH_EXACT = 'exact'
+    SEARCH_PREFIX = 'prefix'
+    SEARCH_SUBSTRING = 'substring'
+
+    # Keeps `IN (...)` lists and multi-row VALUES well below SQLite's bound parameter limit
+    _bulk_chunk_size: int = 500
+
     def __init__(self, session: SQLAlchemySession, logger: Logger):
         """
         Session wrapper for SQLAlchemy session. This is to allow for multiple DB queries within 1 transaction
@@ -19,10 +48,10 @@ class Session:
         """
         Insert an address into the database. Upon success, the input address ID is set to the ID of the inserted address
         """
-        self._logger.debug(f"Inserting address\n{address}")
+        self._logger.debug("Inserting address\n%s", address)
         try:
             if existing := self.get_address(address.full_address):
-                self._logger.debug(f"Address already exists with ID: {existing.id}")
+                self._logger.debug("Address already exists with ID: %s", existing.id)
                 address.id = existing.id
                 return
             addr_model = address.to_address_model()
@@ -37,10 +66,10 @@ class Session:
         Insert a tenant into the database. Upon success, the input tenant ID is set to the ID of the inserted tenant
         The tenant's address must already exist in the database
         """
-        self._logger.debug(f"Inserting tenant\n{tenant}")
+        self._logger.debug("Inserting tenant\n%s", tenant)
         try:
             if existing := self.get_tenant(tenant.name, tenant.address.id):
-                self._logger.debug(f"Tenant already exists with ID: {existing.id}")
+                self._logger.debug("Tenant already exists with ID: %s", existing.id)
                 tenant.id = existing.id
                 return
             tenant_model = tenant.to_tenant_model()
@@ -51,15 +80,192 @@ class Session:
             self._logger.error(f"Could not insert tenant\n{tenant}\nError: `{e}`")
             raise
 
+    def bulk_insert_tenants(self, batch: list[tuple[str, Address, str | None]],
+                            on_failure: Callable[[int, str], None] | None = None) -> int:
+        """
+        Set-based equivalent of calling `insert_address` + `insert_tenant` for every row of a batch.
+        The batch is deduplicated in memory, existing addresses and tenants are resolved with one `IN` query per chunk
+        and the missing ones are inserted with multi-row `INSERT ... ON CONFLICT DO NOTHING RETURNING`.
+        As with the row by row path, a tenant which already exists at the address (caseless) counts as a success
+        :param on_failure: called with the index into `batch` and a reason for every row which could not be inserted
+        :return: the number of rows whose tenant exists after the insert
+        """
+        insert = self._dialect_insert()
+
+        addresses: dict[str, Address] = {}
+        for _, address, _ in batch:
+            addresses.setdefault(address.full_address, address)
+
+        address_ids = self._resolve_address_ids(list(addresses))
+        if missing := [a for key, a in addresses.items() if key not in address_ids]:
+            for chunk in _chunks(missing, self._bulk_chunk_size):
+                stmt = insert(AddressModel).values(
+                    [{'full_address': a.full_address, 'lat': a.lat, 'lon': a.lon,
+                      'geohash': geohash.encode_or_none(a.lat, a.lon)} for a in chunk]
+                ).on_conflict_do_nothing(index_elements=['full_address']).returning(
+                    AddressModel.id, AddressModel.full_address
+                )
+                address_ids.update({full_address: id_ for id_, full_address in self._session.execute(stmt)})
+            # Rows skipped by ON CONFLICT were inserted concurrently, pick their IDs up as well
+            if unresolved := [a.full_address for a in missing if a.full_address not in address_ids]:
+                address_ids.update(self._resolve_address_ids(unresolved))
+        self._logger.debug("Bulk insert resolved %d addresses, %d new", len(address_ids), len(missing))
+
+        aliases: dict[str, int] = {}
+        tenants: dict[tuple[str, int], str] = {}
+        failed: list[int] = []
+        for i, (tenant_name, address, raw_address) in enumerate(batch):
+            if (address_id := address_ids.get(address.full_address)) is None:
+                self._logger.error(f"Could not insert address into database\n{address}")
+                failed.append(i)
+                continue
+            address.id = address_id
+            if raw_address:
+                aliases[raw_address_key(raw_address)] = address_id
+            tenants.setdefault((tenant_name.lower(), address_id), tenant_name)
+
+        for chunk in _chunks(list(aliases.items()), self._bulk_chunk_size):
+            stmt = insert(AddressAliasModel).values([{'alias': k, 'address_id': v} for k, v in chunk])
+            self._session.execute(stmt.on_conflict_do_update(
+                index_elements=['alias'], set_={'address_id': stmt.excluded.address_id}
+            ))
+
+        existing: set[tuple[str, int]] = set()
+        for chunk in _chunks(list(tenants), self._bulk_chunk_size):
+            existing.update(self._session.execute(
+                select(TenantModel.name_lower, TenantModel.address_id)
+                .where(tuple_(TenantModel.name_lower, TenantModel.address_id).in_(chunk))
+            ).tuples().all())
+        new_tenants = [
+            {'name': name, 'name_lower': key[0], 'address_id': key[1]}
+            for key, name in tenants.items() if key not in existing
+        ]
+        for chunk in _chunks(new_tenants, self._bulk_chunk_size):
+            self._session.execute(
+                insert(TenantModel).values(chunk).on_conflict_do_nothing(index_elements=['name', 'address_id'])
+            )
+        self._logger.debug("Bulk insert added %d tenants, %d already existed", len(new_tenants), len(existing))
+        # only report failures once nothing can raise anymore, the caller may retry the batch row by row
+        if on_failure:
+            for i in failed:
+                on_failure(i, "Could not insert address into database")
+        return len(batch) - len(failed)
+
+    def copy_insert_tenants(self, batch: list[tuple[str, Address, str | None]],
+                            on_failure: Callable[[int, str], None] | None = None) -> int:
+        """
+        PostgreSQL only: same semantics as `bulk_insert_tenants`, but the batch is streamed into a temporary staging
+        table with `COPY` and merged into the real tables with three set-based `INSERT ... SELECT` statements.
+        This is much cheaper than multi-row VALUES for very large batches
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+        for i, (tenant_name, address, raw_address) in enumerate(batch):
+            writer.writerow([i, tenant_name, tenant_name.lower(), address.full_address, address.lat, address.lon,
+                             geohash.encode_or_none(address.lat, address.lon),
+                             raw_address_key(raw_address) if raw_address else None])
+        buffer.seek(0)
+
+        self._session.execute(text(
+            "CREATE TEMPORARY TABLE _import_staging (ord integer, name text, name_lower text, full_address text, "
+            "lat double precision, lon double precision, geohash text, alias text) ON COMMIT DROP"
+        ))
+        with self._session.connection().connection.dbapi_connection.cursor() as cursor:
+            cursor.copy_expert(
+                "COPY _import_staging FROM STDIN WITH (FORMAT csv, FORCE_NULL (lat, lon, geohash, alias))", buffer
+            )
+
+        self._session.execute(text(
+            "INSERT INTO addresses (full_address, lat, lon, geohash) "
+            "SELECT DISTINCT ON (full_address) full_address, lat, lon, geohash FROM _import_staging "
+            "ORDER BY full_address, ord "
+            "ON CONFLICT (full_address) DO NOTHING"
+        ))
+        self._session.execute(text(
+            "INSERT INTO address_aliases (alias, address_id) "
+            "SELECT DISTINCT ON (s.alias) s.alias, a.id FROM _import_staging s JOIN addresses a USING (full_address) "
+            "WHERE s.alias IS NOT NULL ORDER BY s.alias, s.ord DESC "
+            "ON CONFLICT (alias) DO UPDATE SET address_id = EXCLUDED.address_id"
+        ))
+        self._session.execute(text(
+            "INSERT INTO tenants (name, name_lower, address_id) "
+            "SELECT DISTINCT ON (s.name_lower, a.id) s.name, s.name_lower, a.id "
+            "FROM _import_staging s JOIN addresses a USING (full_address) "
+            "WHERE NOT EXISTS (SELECT 1 FROM tenants t WHERE t.name_lower = s.name_lower AND t.address_id = a.id) "
+            "ORDER BY s.name_lower, a.id, s.ord "
+            "ON CONFLICT (name, address_id) DO NOTHING"
+        ))
+
+        address_ids = dict(self._session.execute(text(
+            "SELECT DISTINCT a.full_address, a.id FROM _import_staging s JOIN addresses a USING (full_address)"
+        )).tuples().all())
+        success_count = 0
+        for i, (_, address, _) in enumerate(batch):
+            if (address_id := address_ids.get(address.full_address)) is None:
+                self._logger.error(f"Could not insert address into database\n{address}")
+                if on_failure:
+                    on_failure(i, "Could not insert address into database")
+                continue
+            address.id = address_id
+            success_count += 1
+        return success_count
+
+    def _resolve_address_ids(self, full_addresses: list[str]) -> dict[str, int]:
+        address_ids = {}
+        for chunk in _chunks(full_addresses, self._bulk_chunk_size):
+            address_ids.update(self._session.execute(
+                select(AddressModel.full_address, AddressModel.id).where(AddressModel.full_address.in_(chunk))
+            ).tuples().all())
+        return address_ids
+
+    def _dialect_insert(self):
+        match self._session.get_bind().dialect.name:
+            case 'postgresql':
+                return postgresql.insert
+            case 'sqlite':
+                return sqlite.insert
+            case dialect:
+                raise NotImplementedError(f"Bulk insert is not supported on {dialect}")
+
     def _insert(self, what: Base) -> int:
         """
         Insert a model into the database. We flush changes immediately so we can take the ID before committing session
         """
         self._session.add(what)
         self._session.flush()
-        self._logger.debug(f"Inserted {what.__class__.__name__} with ID: {what.id}")
+        self._logger.debug("Inserted %s with ID: %s", what.__class__.__name__, what.id)
         return what.id
 
+    def bump_tenant_generation(self) -> None:
+        """
+        Count a write of tenants, in the transaction of the write (see `Database.generation`). This locks the counter
+        row until the commit, so it is done last
+        """
+        self._session.execute(
+            update(TenantGenerationModel).where(TenantGenerationModel.id == 1)
+            .values(generation=TenantGenerationModel.generation + 1, written_at=time.time())
+        )
+
+    def get_tenant_generation(self) -> tuple[int, float]:
+        """
+        :return: the generation and the unix time of the last write of tenants
+        """
+        row = self._session.execute(
+            select(TenantGenerationModel.generation, TenantGenerationModel.written_at)
+            .where(TenantGenerationModel.id == 1)
+        ).one()
+        return row.generation, row.written_at
+
+    def save_address_alias(self, alias: str, address_id: int):
+        """
+        Map a raw input key to an existing address, replacing any previous mapping for that key
+        """
+        self._session.merge(AddressAliasModel(alias=alias, address_id=address_id))
+
+    def get_address_id_by_alias(self, alias: str) -> int | None:
+        if res := self._session.get(AddressAliasModel, alias):
+            return res.address_id
+
     def get_address(self, full_address: str) -> Address | None:
         if res := self._session.query(AddressModel).filter_by(full_address=full_address).first():
             return Address.from_address_model(res)
@@ -68,23 +274,217 @@ class Session:
         """
         Get a tenant by name (caseless) and address ID. This is to ensure that the tenant name is unique for the address
         """
-        if res := self._session.query(TenantModel).filter_by(name_lower=tenant_name.lower(), address_id=address_id).first():
-            return Tenant.from_tenant_model(res)
+        stmt = self._tenant_rows().where(
+            TenantModel.name_lower == tenant_name.lower(), TenantModel.address_id == address_id
+        ).limit(1)
+        if row := self._session.execute(stmt).first():
+            return Tenant.from_row(row)
 
     def search_addresses_by_tenant(self, tenant_name: str) -> list[Tenant]:
         """
         Get all addresses for a tenant name (caseless)
         Multiple tenants can have the same name if they are at different addresses
         """
-        tenants = [Tenant.from_tenant_model(tm) for tm in
-                   self._session.query(TenantModel).filter_by(name_lower=tenant_name.lower()).all()]
+        return self._fetch_tenants(self._tenant_rows().where(self._name_exact(tenant_name)))
+
+    def search_addresses_by_tenant_prefix(self, prefix: str) -> list[Tenant]:
+        """
+        Get all addresses for tenants whose name starts with the prefix (caseless)
+        """
+        return self._fetch_tenants(self._tenant_rows().where(self._name_prefix(prefix)))
+
+    def search_addresses_by_tenant_substring(self, substring: str, fulltext: bool = False) -> list[Tenant]:
+        """
+        Get all addresses for tenants whose name contains the substring (caseless)
+        :param fulltext: look the substring up in the SQLite `tenants_fts` trigram index. On PostgreSQL the plain
+        `LIKE` is served by the trigram GIN index instead
+        """
+        return self._fetch_tenants(self._tenant_rows().where(self._name_substring(substring, fulltext)))
 
-        return tenants
+    def iter_tenants_by_address(self, address_id: int | None = None, tenant_name: str | None = None,
+                                mode: str = SEARCH_EXACT, fulltext: bool = False,
+                                chunk_size: int = 1000) -> Iterator[Tenant]:
+        """
+        Stream tenants ordered by address and then name, optionally restricted to one address or to a tenant name
+        search (see `search_addresses_by_tenant` and its variants). Used for exports, which group tenants by address
+        """
+        stmt = self._tenant_rows().order_by(AddressModel.full_address, TenantModel.name)
+        if address_id is not None:
+            stmt = stmt.where(TenantModel.address_id == address_id)
+        if tenant_name:
+            match mode:
+                case Session.SEARCH_PREFIX:
+                    stmt = stmt.where(self._name_prefix(tenant_name))
+                case Session.SEARCH_SUBSTRING:
+                    stmt = stmt.where(self._name_substring(tenant_name, fulltext))
+                case _:
+                    stmt = stmt.where(self._name_exact(tenant_name))
+        for row in self._session.execute(stmt.execution_options(yield_per=chunk_size)):
+            yield Tenant.from_row(row)
+
+    @staticmethod
+    def _name_exact(tenant_name: str) -> ColumnElement[bool]:
+        return TenantModel.name_lower == tenant_name.lower()
+
+    def _name_prefix(self, prefix: str) -> ColumnElement[bool]:
+        """
+        On PostgreSQL this is `LIKE 'prefix%'`, served by the `text_pattern_ops` index (see
+        `Migrator._create_tenant_prefix_index_postgres`): a range over the collation's order would miss names whenever
+        the collation is not the C one. SQLite compares in code point order, so there it is a range scan of the
+        `name_lower` index, which its (ASCII caseless) `LIKE` could not use
+        """
+        lower = prefix.lower()
+        if self._session.get_bind().dialect.name == 'postgresql':
+            return TenantModel.name_lower.like(self._like_escape(lower) + '%', escape='\\')
+        if (upper := self._next_prefix(lower)) is None:
+            return TenantModel.name_lower >= lower
+        return and_(TenantModel.name_lower >= lower, TenantModel.name_lower < upper)
+
+    @staticmethod
+    def _next_prefix(prefix: str) -> str | None:
+        """
+        The smallest string in code point order which is greater than every string starting with `prefix`
+        :return: None if there is none (the prefix only consists of U+10FFFF)
+        """
+        prefix = prefix.rstrip(chr(sys.maxunicode))
+        if not prefix:
+            return None
+        code_point = ord(prefix[-1]) + 1
+        if 0xD800 <= code_point <= 0xDFFF:
+            code_point = 0xE000  # surrogates cannot be encoded, so no stored name contains them
+        return prefix[:-1] + chr(code_point)
+
+    @staticmethod
+    def _name_substring(substring: str, fulltext: bool) -> ColumnElement[bool]:
+        lower = substring.lower()
+        # trigram indexes can only match patterns of at least 3 characters
+        if fulltext and len(lower) >= 3:
+            phrase = '"' + lower.replace('"', '""') + '"'
+            matches = text("SELECT rowid FROM tenants_fts WHERE tenants_fts MATCH :phrase").bindparams(phrase=phrase)
+            return TenantModel.id.in_(matches.columns(rowid=Integer))
+        return TenantModel.name_lower.like('%' + Session._like_escape(lower) + '%', escape='\\')
+
+    @staticmethod
+    def _like_escape(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
 
     def find_tenants_at_address(self, address_id: int) -> list[Tenant]:
-        return [Tenant.from_tenant_model(tm) for tm in
-                self._session.query(TenantModel).filter_by(address_id=address_id).all()]
+        return self._fetch_tenants(self._tenant_rows().where(TenantModel.address_id == address_id))
+
+    def iter_tenants_in_boxes(self, boxes: list[geohash.BoundingBox], prefixes: list[str],
+                              chunk_size: int = 1000) -> Iterator[Tenant]:
+        """
+        Tenants whose address lies in one of the (min lat, min lon, max lat, max lon) boxes. The geohash prefixes
+        (see `geohash.covering_prefixes`) must cover the boxes: they turn the search into range scans of
+        `addresses.geohash`, and the coordinates then drop the candidates outside the boxes
+        """
+        # `~` sorts after every geohash character, so [prefix, prefix~) is everything starting with the prefix
+        cells = or_(*[and_(AddressModel.geohash >= p, AddressModel.geohash < p + '~') for p in prefixes])
+        inside = or_(*[
+            and_(AddressModel.lat.between(min_lat, max_lat), AddressModel.lon.between(min_lon, max_lon))
+            for min_lat, min_lon, max_lat, max_lon in boxes
+        ])
+        # As a subquery, so that the addresses are found first and their tenants then looked up by `address_id`
+        candidates = select(AddressModel.id).where(cells, inside)
+        stmt = self._tenant_rows().where(TenantModel.address_id.in_(candidates))
+        for row in self._session.execute(stmt.execution_options(yield_per=chunk_size)):
+            yield Tenant.from_row(row)
+
+    def get_all_tenants(self, limit: int | None = None, after_id: int | None = None) -> list[Tenant]:
+        """
+        Get all tenants, or one page of them ordered by ID (keyset pagination: pass the last ID of the previous page)
+        """
+        return list(self.iter_all_tenants(limit=limit, after_id=after_id))
+
+    def iter_all_tenants(self, limit: int | None = None, after_id: int | None = None,
+                         chunk_size: int = 1000) -> Iterator[Tenant]:
+        """
+        Same as `get_all_tenants`, but rows are fetched from a server-side cursor `chunk_size` at a time, so memory use
+        does not depend on the number of tenants
+        """
+        stmt = self._tenant_rows().order_by(TenantModel.id)
+        if after_id is not None:
+            stmt = stmt.where(TenantModel.id > after_id)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        for row in self._session.execute(stmt.execution_options(yield_per=chunk_size)):
+            yield Tenant.from_row(row)
+
+    @staticmethod
+    def _tenant_rows() -> Select:
+        """
+        Tenants joined with their address as plain column tuples (see `Tenant.from_row`). This loads each result with
+        a single query and skips the ORM identity map, instead of lazy loading `TenantModel.address` once per tenant
+        """
+        return select(
+            TenantModel.id, TenantModel.name,
+            AddressModel.id, AddressModel.full_address, AddressModel.lat, AddressModel.lon,
+        ).join(AddressModel, TenantModel.address_id == AddressModel.id)
+
+    def _fetch_tenants(self, stmt: Select) -> list[Tenant]:
+        return [Tenant.from_row(row) for row in self._session.execute(stmt)]
+
+    def get_geocode_cache_entry(self, raw_address_key: str) -> tuple[Address | None, datetime] | None:
+        """
+        Get a persisted geocoding result. The address is None if the raw input previously failed to normalize
+        """
+        if not (res := self._session.get(GeocodeCacheModel, raw_address_key)):
+            return None
+        if res.full_address is None:
+            return None, res.expires_at
+        return Address(full_address=res.full_address, lat=res.lat, lon=res.lon), res.expires_at
+
+    def save_geocode_cache_entry(self, raw_address_key: str, address: Address | None, expires_at: datetime):
+        self._session.merge(GeocodeCacheModel(
+            raw_address=raw_address_key,
+            full_address=address.full_address if address else None,
+            lat=address.lat if address else None,
+            lon=address.lon if address else None,
+            expires_at=expires_at,
+        ))
+
+    def insert_import_job(self, job: ImportJob):
+        self._session.add(job.to_import_job_model())
+
+    def update_import_job(self, job_id: str, **fields):
+        self._session.query(ImportJobModel).filter_by(id=job_id).update(fields)
+
+    def update_import_job_if(self, job_id: str, expected: dict, **fields) -> bool:
+        """
+        Update the job only if its columns still hold the `expected` values
+        :return: whether it was updated
+        """
+        return self._session.query(ImportJobModel).filter_by(id=job_id, **expected).update(fields) == 1
+
+    def advance_upload(self, job_id: str, offset: int, length: int, lines: int) -> bool:
+        """
+        Move the committed offset of a chunked upload from `offset` to `offset + length`, unless another request
+        already moved it
+        :param lines: newlines in the chunk, added to the estimated row count
+        """
+        return self._session.query(ImportJobModel).filter_by(id=job_id, uploaded_bytes=offset).update({
+            ImportJobModel.uploaded_bytes: offset + length,
+            ImportJobModel.rows_total: ImportJobModel.rows_total + lines,
+        }) == 1
+
+    def get_import_job(self, job_id: str) -> ImportJob | None:
+        if res := self._session.get(ImportJobModel, job_id):
+            return ImportJob.from_import_job_model(res)
+
+    def get_import_jobs_by_status(self, *statuses: str) -> list[ImportJob]:
+        return [ImportJob.from_import_job_model(m) for m in
+                self._session.query(ImportJobModel).filter(ImportJobModel.status.in_(statuses))
+                .order_by(ImportJobModel.created_at).all()]
+
+    def insert_import_failures(self, job_id: str, failures: list[tuple[int, str]]):
+        if failures:
+            self._session.execute(
+                ImportFailureModel.__table__.insert(),
+                [{'job_id': job_id, 'row': row, 'reason': reason} for row, reason in failures]
+            )
 
-    def get_all_tenants(self) -> list[Tenant]:
-        return [Tenant.from_tenant_model(tm) for tm in
-                self._session.query(TenantModel).all()]
+    def get_import_failures(self, job_id: str, offset: int = 0, limit: int = 100) -> list[tuple[int, str]]:
+        return self._session.execute(
+            select(ImportFailureModel.row, ImportFailureModel.reason).where(ImportFailureModel.job_id == job_id)
+            .order_by(ImportFailureModel.row).offset(offset).limit(limit)
+        ).tuples().all()
@@ -0,0 +1,412 @@
+import abc
+import asyncio
+import collections
+import dataclasses
+import time
+from typing import Any, Callable
+
+try:
+    import httpx
+except ImportError:  # only needed for the ASGI server mode
+    httpx = None
+
+from src.geo.breaker import CircuitBreaker, FailoverPolicy
+from src.geo.local import Gazetteer
+from src.geo.normalization import (
+    _BACKENDS, AddressParser, GeocodeCache, GeocoderUnavailableError, _AddressParserLocal, _FailoverAttempt,
+    raw_address_key
+)
+from src.geo.ratelimit import TokenBucket, named_bucket
+from src.util import metrics
+from src.util.logging import Logger
+from src.web.model import Address
+
+
+class AsyncAddressParser(metaclass=abc.ABCMeta):
+    """
+    asyncio counterpart of `AddressParser`, used by the ASGI server mode. Waiting for the provider costs a suspended
+    coroutine instead of a blocked thread, so thousands of lookups can be in flight at once
+    """
+
+    # See `AddressParser.provider`, the blocking and async parsers of a provider share one budget
+    provider: str | None = None
+
+    def __init__(self, logger: Logger, max_qps: float | None = None, default_qps: float | None = None):
+        self._logger: Logger = logger
+        qps = max_qps or default_qps
+        self._rate_limiter: TokenBucket | None = None
+        if qps:
+            self._rate_limiter = named_bucket(self.provider, qps) if self.provider else TokenBucket(rate=qps)
+
+    @abc.abstractmethod
+    async def normalize(self, address: str) -> Address | None:
+        """
+        See `AddressParser.normalize`
+        """
+        raise NotImplementedError
+
+    def stats(self) -> dict[str, Any]:
+        return {}
+
+    async def aclose(self) -> None:
+        """
+        Release pooled connections
+        """
+
+
+class _AsyncHttpAddressParser(AsyncAddressParser):
+    """
+    Provider backends share one HTTP client per parser, which keeps connections to the provider alive between calls
+    """
+
+    _timeout: float = 10.0
+
+    def __init__(self, logger: Logger, max_qps: float | None = None, default_qps: float | None = None,
+                 max_connections: int = 32, headers: dict[str, str] | None = None):
+        if httpx is None:
+            raise RuntimeError("The ASGI server mode needs httpx, install the `asgi` extra")
+        AsyncAddressParser.__init__(self, logger, max_qps=max_qps, default_qps=default_qps)
+        self._client: httpx.AsyncClient = httpx.AsyncClient(
+            timeout=self._timeout, headers=headers,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def _get_json(self, url: str, params: dict[str, str]) -> Any:
+        if self._rate_limiter is not None:
+            await self._rate_limiter.acquire_async()
+        try:
+            with metrics.GEOCODER_CALL_SECONDS.labels(self.provider).time():
+                response = await self._client.get(url, params=params)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            metrics.GEOCODER_ERRORS.labels(self.provider).inc()
+            self._logger.error(f"An error occurred while normalizing address with {self.provider}: `{e}`")
+            raise GeocoderUnavailableError(f"{self.provider} error: `{e}`") from e
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+class _AsyncAddressParserNominatim(_AsyncHttpAddressParser):
+
+    provider = AddressParser.NOMINATIM
+    _url: str = "https://nominatim.openstreetmap.org/search"
+
+    def __init__(self, logger: Logger, max_qps: float | None = None, **_kwargs):
+        _AsyncHttpAddressParser.__init__(
+            self, logger, max_qps=max_qps, default_qps=1, headers={"User-Agent": "normalize_addresses"}
+        )
+
+    async def normalize(self, address: str) -> Address | None:
+        results = await self._get_json(self._url, {"q": address, "format": "jsonv2", "limit": "1"})
+        if not results:
+            return
+        return Address(full_address=results[0]["display_name"], lat=float(results[0]["lat"]),
+                       lon=float(results[0]["lon"]))
+
+
+class _AsyncAddressParserGoogleMaps(_AsyncHttpAddressParser):
+
+    provider = AddressParser.GOOGLE_MAPS
+    _url: str = "https://maps.googleapis.com/maps/api/geocode/json"
+
+    def __init__(self, api_key: str, logger: Logger, max_qps: float | None = None, **_kwargs):
+        _AsyncHttpAddressParser.__init__(self, logger, max_qps=max_qps, default_qps=5)
+        self._api_key: str = api_key
+
+    async def normalize(self, address: str) -> Address | None:
+        body = await self._get_json(self._url, {"address": address, "key": self._api_key, "language": "en-us"})
+        match body.get("status"):
+            case "OK":
+                return Address.from_google_maps_result(body["results"][0])
+            case "ZERO_RESULTS":
+                return
+        metrics.GEOCODER_ERRORS.labels(self.provider).inc()
+        message = f"Google Maps API error: `{body.get('status')}: {body.get('error_message', '')}`"
+        self._logger.error(message)
+        raise GeocoderUnavailableError(message)
+
+
+class _ThreadedAsyncAddressParser(AsyncAddressParser):
+    """
+    Runs a backend which only has a blocking implementation (eg one added with `register_backend`) in a worker thread
+    """
+
+    def __init__(self, parser: AddressParser, logger: Logger):
+        AsyncAddressParser.__init__(self, logger)
+        self._parser: AddressParser = parser
+
+    async def normalize(self, address: str) -> Address | None:
+        return await asyncio.to_thread(self._parser.normalize, address)
+
+    def stats(self) -> dict[str, Any]:
+        return self._parser.stats()
+
+
+class _AsyncFailoverAddressParser(AsyncAddressParser):
+    """
+    See `_FailoverAddressParser`. The calls are tasks on the event loop rather than threads: a hedge waits for the
+    first answer with `asyncio.wait`, and the calls still running when it returns are cancelled
+    """
+
+    def __init__(self, backends: list[tuple[str, AsyncAddressParser]], policy: FailoverPolicy, logger: Logger):
+        AsyncAddressParser.__init__(self, logger)
+        self._backends: list[tuple[str, AsyncAddressParser, CircuitBreaker]] = [
+            (name, parser, CircuitBreaker(policy)) for name, parser in backends
+        ]
+        self._policy: FailoverPolicy = policy
+        self._counters: collections.Counter[str] = collections.Counter()
+
+    async def normalize(self, address: str) -> Address | None:
+        candidates = iter(self._backends)
+        pending: dict[asyncio.Task, _FailoverAttempt] = {}
+        errors: list[str] = []
+
+        def call_next() -> bool:
+            for name, parser, breaker in candidates:
+                if breaker.allow():
+                    attempt = _FailoverAttempt(name, breaker)
+                    task = asyncio.create_task(parser.normalize(address))
+                    task.add_done_callback(lambda t, a=attempt: self._settle(
+                        a, failed=not t.cancelled() and t.exception() is not None
+                    ))
+                    pending[task] = attempt
+                    return True
+            return False
+
+        if not call_next():
+            self._counters["rejected"] += 1
+            raise GeocoderUnavailableError("Every geocoding backend is unavailable")
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=self._policy.hedge_after,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    for attempt in pending.values():
+                        if time.monotonic() - attempt.started > self._policy.hedge_after:
+                            self._settle(attempt, failed=False)
+                    if call_next():
+                        self._counters["hedged"] += 1
+                        metrics.GEOCODER_HEDGED_CALLS.labels(list(pending.values())[-1].backend).inc()
+                    continue
+                for task in done:
+                    attempt = pending.pop(task)
+                    try:
+                        return task.result()
+                    except GeocoderUnavailableError as e:
+                        errors.append(f"{attempt.backend}: {e}")
+                if not pending and call_next():
+                    self._counters["failed_over"] += 1
+        finally:
+            # the losers of a hedge, or every call if the caller was cancelled
+            for task in pending:
+                task.cancel()
+        self._counters["failed"] += 1
+        raise GeocoderUnavailableError(f"Every geocoding backend failed ({'; '.join(errors)})")
+
+    @staticmethod
+    def _settle(attempt: _FailoverAttempt, failed: bool) -> None:
+        """
+        Report the outcome of a call to its backend's breaker, once. A cancelled call counts by its duration so far
+        """
+        if attempt.settled:
+            return
+        attempt.settled = True
+        attempt.breaker.record(failed, time.monotonic() - attempt.started)
+
+    def stats(self) -> dict[str, Any]:
+        stats: dict[str, Any] = {}
+        for _, parser, _ in self._backends:
+            stats.update(parser.stats())
+        stats["failover"] = {**self._counters,
+                             "backends": {name: breaker.stats() for name, _, breaker in self._backends}}
+        return stats
+
+    async def aclose(self) -> None:
+        for _, parser, _ in self._backends:
+            await parser.aclose()
+
+
+class _AsyncCachingAddressParser(AsyncAddressParser):
+    """
+    See `_CachingAddressParser`. Lookups which may reach the persistent tier run in a worker thread
+    """
+
+    def __init__(self, parser: AsyncAddressParser, cache: GeocodeCache, logger: Logger,
+                 key: Callable[[str], str] = raw_address_key):
+        AsyncAddressParser.__init__(self, logger)
+        self._parser: AsyncAddressParser = parser
+        self._cache: GeocodeCache = cache
+        self._key: Callable[[str], str] = key
+
+    async def normalize(self, address: str) -> Address | None:
+        key = self._key(address)
+        if self._cache.persistent:
+            found, result = await asyncio.to_thread(self._cache.get, key)
+        else:
+            found, result = self._cache.get(key)
+        if found:
+            self._logger.debug("Geocode cache hit for `%s`", key)
+            return result
+        result = await self._parser.normalize(address)
+        if self._cache.persistent:
+            await asyncio.to_thread(self._cache.put, key, result)
+        else:
+            self._cache.put(key, result)
+        return result
+
+    def stats(self) -> dict[str, Any]:
+        return {**self._parser.stats(), "cache": self._cache.stats()}
+
+    async def aclose(self) -> None:
+        await self._parser.aclose()
+
+
+class _AsyncInFlightCall:
+
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: asyncio.Task):
+        self.task: asyncio.Task = task
+        self.waiters: int = 0
+
+
+class _AsyncCoalescingAddressParser(AsyncAddressParser):
+    """
+    See `_CoalescingAddressParser`. The call to the wrapped parser runs as a task of its own, which every coroutine
+    asking for the same raw address awaits (shielded, so that a cancelled caller leaves the others waiting). The task is
+    only cancelled once all of them are gone
+    """
+
+    def __init__(self, parser: AsyncAddressParser, logger: Logger, key: Callable[[str], str] = raw_address_key):
+        AsyncAddressParser.__init__(self, logger)
+        self._parser: AsyncAddressParser = parser
+        self._key: Callable[[str], str] = key
+        self._in_flight: dict[str, _AsyncInFlightCall] = {}
+        self._calls: int = 0
+        self._coalesced: int = 0
+
+    async def normalize(self, address: str) -> Address | None:
+        key = self._key(address)
+        if (call := self._in_flight.get(key)) is not None:
+            self._coalesced += 1
+            leader = False
+        else:
+            self._calls += 1
+            call = self._in_flight[key] = _AsyncInFlightCall(asyncio.create_task(self._parser.normalize(address)))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            leader = True
+
+        call.waiters += 1
+        try:
+            result = await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                self._forget(key, call)
+                call.task.cancel()
+        # Callers set the ID on the address they get back, so each of them gets its own copy
+        return dataclasses.replace(result) if result is not None and not leader else result
+
+    def _forget(self, key: str, call: _AsyncInFlightCall) -> None:
+        if self._in_flight.get(key) is call:
+            del self._in_flight[key]
+
+    def stats(self) -> dict[str, Any]:
+        coalescing = {"calls": self._calls, "coalesced": self._coalesced, "in_flight": len(self._in_flight)}
+        return {**self._parser.stats(), "coalescing": coalescing}
+
+    async def aclose(self) -> None:
+        await self._parser.aclose()
+
+
+class _AsyncLocalFirstAddressParser(AsyncAddressParser):
+    """
+    See `_LocalFirstAddressParser`. The local rules are cheap enough to run on the event loop
+    """
+
+    def __init__(self, local: _AddressParserLocal, parser: AsyncAddressParser, logger: Logger):
+        AsyncAddressParser.__init__(self, logger)
+        self._local: _AddressParserLocal = local
+        self._parser: AsyncAddressParser = parser
+
+    async def normalize(self, address: str) -> Address | None:
+        if not (canonical := self._local.canonicalize(address)):
+            return None
+        if (known := self._local.lookup(canonical)) is not None:
+            return known
+        return await self._parser.normalize(address)
+
+    def stats(self) -> dict[str, Any]:
+        return {**self._parser.stats(), **self._local.stats()}
+
+    async def aclose(self) -> None:
+        await self._parser.aclose()
+
+
+class _AsyncLocalAddressParser(AsyncAddressParser):
+
+    def __init__(self, local: _AddressParserLocal, logger: Logger):
+        AsyncAddressParser.__init__(self, logger)
+        self._local: _AddressParserLocal = local
+
+    async def normalize(self, address: str) -> Address | None:
+        return self._local.normalize(address)
+
+    def stats(self) -> dict[str, Any]:
+        return self._local.stats()
+
+
+# engine name -> factory(logger=..., max_qps=..., **kwargs). Other engines known to `new_parser` run in threads
+_ASYNC_BACKENDS: dict[str, Callable[..., AsyncAddressParser]] = {
+    AddressParser.NOMINATIM: _AsyncAddressParserNominatim,
+    AddressParser.GOOGLE_MAPS: _AsyncAddressParserGoogleMaps,
+}
+
+
+def new_async_parser(engine: str, *, logger: Logger, cache: GeocodeCache | None = None,
+                     max_qps: float | None = None, gazetteer: Gazetteer | None = None,
+                     failover: FailoverPolicy | None = None, **kwargs) -> AsyncAddressParser:
+    """
+    Same as `new_parser`, with the same engines and wrapping order
+    """
+    if engine == AddressParser.LOCAL:
+        local = _AddressParserLocal(logger=logger.new_from("PARSER_LOCAL"), gazetteer=gazetteer)
+        return _AsyncLocalAddressParser(local, logger=logger.new_from("ASYNC_PARSER_LOCAL"))
+
+    local = None
+    if engine.startswith(AddressParser.LOCAL_PREFIX):
+        engine = engine.removeprefix(AddressParser.LOCAL_PREFIX)
+        local = _AddressParserLocal(logger=logger.new_from("PARSER_LOCAL"), gazetteer=gazetteer)
+    parser = _new_async_backend(engine, logger=logger, max_qps=max_qps, failover=failover, **kwargs)
+    key = local.canonicalize if local is not None else raw_address_key
+    if cache is not None:
+        parser = _AsyncCachingAddressParser(parser, cache, logger=logger.new_from("ASYNC_PARSER_CACHE"), key=key)
+    parser = _AsyncCoalescingAddressParser(parser, logger=logger.new_from("ASYNC_PARSER_SINGLE_FLIGHT"), key=key)
+    if local is not None:
+        parser = _AsyncLocalFirstAddressParser(local, parser, logger=logger.new_from("ASYNC_PARSER_LOCAL_FIRST"))
+    return parser
+
+
+def _new_async_backend(engine: str, *, logger: Logger, max_qps: float | None = None,
+                       failover: FailoverPolicy | None = None, **kwargs) -> AsyncAddressParser:
+    """
+    See `normalization._new_backend`
+    """
+    if AddressParser.ENGINE_SEPARATOR in engine:
+        backends = [
+            (name, _new_async_backend(name, logger=logger, max_qps=max_qps, **kwargs))
+            for name in (e.strip() for e in engine.split(AddressParser.ENGINE_SEPARATOR)) if name
+        ]
+        return _AsyncFailoverAddressParser(backends, failover or FailoverPolicy(),
+                                           logger=logger.new_from("ASYNC_PARSER_FAILOVER"))
+    if engine == AddressParser.NOMINATIM:
+        kwargs.pop("api_key", None)
+    backend_logger = logger.new_from(f"ASYNC_PARSER_{engine.upper()}")
+    if (factory := _ASYNC_BACKENDS.get(engine)) is not None:
+        return factory(logger=backend_logger, max_qps=max_qps, **kwargs)
+    if (sync_factory := _BACKENDS.get(engine)) is not None:
+        return _ThreadedAsyncAddressParser(sync_factory(logger=backend_logger, max_qps=max_qps, **kwargs),
+                                           logger=backend_logger)
+    raise ValueError(f"Unknown engine {engine}")
@@ -0,0 +1,111 @@
+import collections
+import dataclasses
+import threading
+import time
+from typing import Any
+
+
+@dataclasses.dataclass(frozen=True)
+class FailoverPolicy:
+    """
+    How a parser with several backends (see `normalization._FailoverAddressParser`) spreads a call over them
+    """
+
+    # seconds a backend has to answer before the next one is asked as well. Slower calls count as slow for the breaker
+    hedge_after: float = 0.8
+    # the breaker judges a backend by its last `window` calls, once it has seen at least `min_calls`
+    window: int = 20
+    min_calls: int = 10
+    max_error_rate: float = 0.5
+    max_slow_rate: float = 0.5
+    # seconds an open circuit skips its backend before a trial call is let through
+    cooldown: float = 30.0
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'FailoverPolicy':
+        return cls(
+            hedge_after=data.get("hedge_after_ms", cls.hedge_after * 1000) / 1000,
+            window=data.get("window", cls.window),
+            min_calls=data.get("min_calls", cls.min_calls),
+            max_error_rate=data.get("max_error_rate", cls.max_error_rate),
+            max_slow_rate=data.get("max_slow_rate", cls.max_slow_rate),
+            cooldown=data.get("cooldown_seconds", cls.cooldown),
+        )
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker over the recent calls to one backend. While closed every call is allowed; when too
+    many of the recent calls failed or were slow it opens and allows nothing for `cooldown` seconds, then it is half
+    open: a single trial call is let through, which closes the circuit if it succeeds in time and opens it again
+    otherwise. The state is per process
+    """
+
+    CLOSED: str = "closed"
+    OPEN: str = "open"
+    HALF_OPEN: str = "half_open"
+
+    def __init__(self, policy: FailoverPolicy):
+        self._policy: FailoverPolicy = policy
+        self._lock: threading.Lock = threading.Lock()
+        # (failed, slow) of the recent calls
+        self._calls: collections.deque[tuple[bool, bool]] = collections.deque(maxlen=policy.window)
+        self._opened_at: float | None = None
+        self._trial_running: bool = False
+        self._times_opened: int = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go to the backend now. In the half open state this claims the trial call, so the caller
+        must `record` its outcome
+        """
+        with self._lock:
+            match self._state(time.monotonic()):
+                case self.CLOSED:
+                    return True
+                case self.HALF_OPEN if not self._trial_running:
+                    self._trial_running = True
+                    return True
+            return False
+
+    def record(self, failed: bool, seconds: float) -> None:
+        slow = seconds > self._policy.hedge_after
+        with self._lock:
+            if self._opened_at is not None:
+                if not self._trial_running:
+                    return  # a call from before the circuit opened
+                self._trial_running = False
+                if failed or slow:
+                    self._opened_at = time.monotonic()
+                else:
+                    self._opened_at = None
+                    self._calls.clear()
+                return
+            self._calls.append((failed, slow))
+            if len(self._calls) < self._policy.min_calls:
+                return
+            if (sum(f for f, _ in self._calls) / len(self._calls) > self._policy.max_error_rate
+                    or sum(s for _, s in self._calls) / len(self._calls) > self._policy.max_slow_rate):
+                self._opened_at = time.monotonic()
+                self._times_opened += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            calls = len(self._calls)
+            return {
+                "state": self._state(time.monotonic()),
+                "recent_calls": calls,
+                "error_rate": round(sum(f for f, _ in self._calls) / calls, 3) if calls else 0.0,
+                "slow_rate": round(sum(s for _, s in self._calls) / calls, 3) if calls else 0.0,
+                "times_opened": self._times_opened,
+            }
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        return self.OPEN if now - self._opened_at < self._policy.cooldown else self.HALF_OPEN
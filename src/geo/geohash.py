@@ -0,0 +1,112 @@
+import math
+
+_BASE32: str = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Mean Earth radius, as used by the haversine formula
+EARTH_RADIUS_M: float = 6_371_008.8
+_METRES_PER_DEGREE: float = math.pi * EARTH_RADIUS_M / 180
+
+PRECISION: int = 12
+
+BoundingBox = tuple[float, float, float, float]  # (min lat, min lon, max lat, max lon)
+
+
+def encode(lat: float, lon: float, precision: int = PRECISION) -> str:
+    """
+    Geohash of a point. Points in the same cell share a prefix, and the longer the shared prefix the smaller the cell,
+    so an index over geohashes answers "which points are in this cell" with a range scan
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bit, ch, even = 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            ch = ch << 1 | 1
+            rng[0] = mid
+        else:
+            ch <<= 1
+            rng[1] = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[ch])
+            bit, ch = 0, 0
+    return "".join(chars)
+
+
+def encode_or_none(lat: float | None, lon: float | None) -> str | None:
+    return encode(lat, lon) if lat is not None and lon is not None else None
+
+
+def cell_size(precision: int) -> tuple[float, float]:
+    """
+    :return: the (height, width) in degrees of a cell at this precision
+    """
+    bits = precision * 5
+    return 180 / 2 ** (bits // 2), 360 / 2 ** ((bits + 1) // 2)
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Great-circle distance between two points, in metres
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi, d_lambda = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_boxes(lat: float, lon: float, radius_m: float) -> list[BoundingBox]:
+    """
+    Bounding boxes which together contain the circle around a point. There are two if it crosses the antimeridian
+    """
+    d_lat = radius_m / _METRES_PER_DEGREE
+    min_lat, max_lat = max(-90.0, lat - d_lat), min(90.0, lat + d_lat)
+    cos_lat = min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat)))
+    if min_lat <= -90 or max_lat >= 90 or cos_lat <= 0 or radius_m / (_METRES_PER_DEGREE * cos_lat) >= 180:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    d_lon = radius_m / (_METRES_PER_DEGREE * cos_lat)
+    return split_box((min_lat, lon - d_lon, max_lat, lon + d_lon))
+
+
+def split_box(box: BoundingBox) -> list[BoundingBox]:
+    """
+    Split a box whose longitudes run past ±180 (or whose min longitude is greater than its max, ie crosses the
+    antimeridian) into boxes within [-180, 180]
+    """
+    min_lat, min_lon, max_lat, max_lon = box
+    if min_lon > max_lon:
+        return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+    if min_lon < -180:
+        return [(min_lat, min_lon + 360, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon - 360)]
+    return [box]
+
+
+def covering_prefixes(boxes: list[BoundingBox], max_cells: int = 32) -> list[str]:
+    """
+    Geohash prefixes of the cells covering the boxes, at the finest precision which needs at most `max_cells` cells
+    (or a single character precision, whatever it takes). Candidates for a spatial query are the points whose geohash
+    starts with one of them
+    """
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        ranges = [(_cells(b[0], b[2], height, -90), _cells(b[1], b[3], width, -180)) for b in boxes]
+        if sum(len(lats) * len(lons) for lats, lons in ranges) <= max_cells or precision == 1:
+            return sorted({
+                encode(-90 + (i + 0.5) * height, -180 + (j + 0.5) * width, precision)
+                for lats, lons in ranges for i in lats for j in lons
+            })
+    return []
+
+
+def _cells(low: float, high: float, size: float, origin: float) -> range:
+    """
+    Indexes of the cells of `size` (counted from `origin`) which overlap [low, high]
+    """
+    first, last = math.floor((low - origin) / size), math.floor((high - origin) / size)
+    limit = round((-2 * origin) / size) - 1  # the last cell, `high` may be exactly on the edge
+    return range(max(0, first), min(last, limit) + 1)
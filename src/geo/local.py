@@ -0,0 +1,132 @@
+import csv
+import re
+import unicodedata
+from pathlib import Path
+
+from src.util.logging import Logger
+from src.web.model import Address
+
+# Expanded wherever they appear as a whole token
+_ABBREVIATIONS: dict[str, str] = {
+    "str": "street",
+    "ave": "avenue",
+    "av": "avenue",
+    "rd": "road",
+    "blvd": "boulevard",
+    "bul": "boulevard",
+    "ln": "lane",
+    "dr": "drive",
+    "ct": "court",
+    "pl": "place",
+    "sq": "square",
+    "hwy": "highway",
+    "pkwy": "parkway",
+    "ter": "terrace",
+    "apt": "apartment",
+    "bldg": "building",
+    "fl": "floor",
+}
+
+# Only expanded before a street name, so that eg `Block E` is left alone
+_DIRECTIONS: dict[str, str] = {
+    "n": "north",
+    "s": "south",
+    "e": "east",
+    "w": "west",
+    "ne": "northeast",
+    "nw": "northwest",
+    "se": "southeast",
+    "sw": "southwest",
+}
+
+_TOKEN = re.compile(r"\w+")
+_HOUSE_NUMBER = re.compile(r"\d+[a-z]?")
+
+
+def _fold(text: str) -> str:
+    """
+    Case-fold and strip accents, so that eg `Straße`, `STRASSE` and `strasse` or `Café` and `Cafe` compare equal
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def _names_follow(tokens: list[str], i: int) -> bool:
+    """
+    Whether a name (rather than a house number, a unit like `Apt` or nothing) follows the token at `i`
+    """
+    return i + 1 < len(tokens) and not _HOUSE_NUMBER.fullmatch(tokens[i + 1]) and tokens[i + 1] not in _ABBREVIATIONS
+
+
+def _expand(tokens: list[str]) -> list[str]:
+    expanded = []
+    for i, token in enumerate(tokens):
+        if token == "st":
+            # `St Mary Rd` is Saint Mary Road, `Mary St` and `Mary St Apt 4` are Mary Street
+            expanded.append("saint" if _names_follow(tokens, i) else "street")
+        elif token in _DIRECTIONS and _names_follow(tokens, i) and (i == 0 or _HOUSE_NUMBER.fullmatch(tokens[i - 1])):
+            expanded.append(_DIRECTIONS[token])
+        else:
+            expanded.append(_ABBREVIATIONS.get(token, token))
+    return expanded
+
+
+def canonical_address(raw_address: str) -> str:
+    """
+    Rule-based canonical form of an address: accents and case folded, punctuation dropped, common abbreviations
+    expanded and a trailing house number moved to the front (`Main Str. 12` -> `12 main street`). Comma separated
+    components are kept. Inputs which only differ in these respects have the same canonical form
+    """
+    components = []
+    for part in _fold(raw_address).split(","):
+        if not (tokens := _TOKEN.findall(part)):
+            continue
+        # the house number is moved before the abbreviations are expanded, which depend on what follows them
+        if not components and len(tokens) > 1 and _HOUSE_NUMBER.fullmatch(tokens[-1]) \
+                and not _HOUSE_NUMBER.fullmatch(tokens[0]):
+            tokens.insert(0, tokens.pop())
+        components.append(_expand(tokens))
+    return ", ".join(" ".join(tokens) for tokens in components)
+
+
+def display_address(canonical: str) -> str:
+    """
+    Human readable form of a canonical address (`12 main street, springfield` -> `12 Main Street, Springfield`)
+    """
+    return " ".join(word[:1].upper() + word[1:] for word in canonical.split(" "))
+
+
+class Gazetteer:
+    """
+    Local list of known addresses, looked up by `canonical_address`. Loaded from a CSV file with an `address,lat,lon`
+    header (coordinates may be empty), where `address` is the form returned to users
+    """
+
+    def __init__(self, addresses: dict[str, Address] | None = None):
+        self._addresses: dict[str, Address] = addresses or {}
+
+    @classmethod
+    def from_file(cls, path: Path, logger: Logger) -> 'Gazetteer':
+        addresses: dict[str, Address] = {}
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for i, row in enumerate(csv.DictReader(f), start=2):
+                try:
+                    address = Address(
+                        full_address=row["address"].strip(),
+                        lat=float(row["lat"]) if row.get("lat") else None,
+                        lon=float(row["lon"]) if row.get("lon") else None,
+                    )
+                except (KeyError, ValueError) as e:
+                    logger.warning("Skipping gazetteer line %d of %s: `%s`", i, path, e)
+                    continue
+                addresses[canonical_address(address.full_address)] = address
+        logger.info("Loaded %d addresses from gazetteer %s", len(addresses), path)
+        return cls(addresses)
+
+    def __len__(self) -> int:
+        return len(self._addresses)
+
+    def get(self, canonical: str) -> Address | None:
+        if (address := self._addresses.get(canonical)) is None:
+            return None
+        return Address(full_address=address.full_address, lat=address.lat, lon=address.lon)
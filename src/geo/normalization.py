@@ -1,13 +1,41 @@
 import abc
-from datetime import datetime
+import collections
+import dataclasses
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any, Callable
 
 from googlemaps import Client as GoogleMapsClient
 from googlemaps.geocoding import geocode as googlemaps_geocode
 from geopy import Nominatim
 
+from src.geo.breaker import CircuitBreaker, FailoverPolicy
+from src.geo.local import Gazetteer, canonical_address, display_address
+from src.geo.ratelimit import TokenBucket, named_bucket
+from src.util import metrics
 from src.util.logging import Logger
 from src.web.model import Address
 
+if TYPE_CHECKING:
+    from src.db.conn import Database
+
+
+class GeocoderUnavailableError(ValueError):
+    """
+    Raised when the geocoding provider could not be reached or returned an error. Unlike a `None` result from
+    `normalize` (the provider does not know the address), this is transient and must not be cached as a negative result
+    """
+
+
+def raw_address_key(raw_address: str) -> str:
+    """
+    Canonical form of raw user input (trimmed, case-folded, whitespace-collapsed) so that trivially different spellings
+    of the same input share one cache entry
+    """
+    return " ".join(raw_address.split()).casefold()
+
 
 class AddressParser(metaclass=abc.ABCMeta):
 
@@ -19,64 +47,509 @@ class AddressParser(metaclass=abc.ABCMeta):
 
     NOMINATIM: str = "nominatim"
     GOOGLE_MAPS: str = "googlemaps"
+    LOCAL: str = "local"
+    # `local+<engine>` canonicalizes inputs locally before they reach `<engine>` (see `_LocalFirstAddressParser`)
+    LOCAL_PREFIX: str = "local+"
+    # `<engine>,<engine>,...` spreads calls over several backends (see `_FailoverAddressParser`)
+    ENGINE_SEPARATOR: str = ","
 
-    def __init__(self, logger: Logger):
+    # Default provider quota. Backends which call out to a provider share one limiter between all threads using them
+    max_qps: float | None = None
+    # Parsers of the same provider share its limiter (see `ratelimit.named_bucket`)
+    provider: str | None = None
+
+    def __init__(self, logger: Logger, max_qps: float | None = None):
         self._logger: Logger = logger
+        qps = max_qps or self.max_qps
+        self._rate_limiter: TokenBucket | None = None
+        if qps:
+            self._rate_limiter = named_bucket(self.provider, qps) if self.provider else TokenBucket(rate=qps)
 
     @abc.abstractmethod
     def normalize(self, address: str) -> Address | None:
+        """
+        Normalize a raw address. Returns None if the backend could not resolve it
+        and raises `GeocoderUnavailableError` if the backend itself failed
+        """
         raise NotImplementedError
 
+    def stats(self) -> dict[str, Any]:
+        """
+        Runtime counters for this parser (and any parser it wraps), used by the status endpoint
+        """
+        return {}
+
 
 class _AddressParserNominatim(AddressParser):
 
-    def __init__(self, logger: Logger):
-        AddressParser.__init__(self, logger)
+    # Nominatim's usage policy allows at most 1 request per second
+    max_qps: float = 1
+    provider = AddressParser.NOMINATIM
+
+    def __init__(self, logger: Logger, max_qps: float | None = None):
+        AddressParser.__init__(self, logger, max_qps=max_qps)
         self._geolocator: Nominatim = Nominatim(user_agent="normalize_addresses")
-        self._last_request: datetime | None = None
 
     def normalize(self, address: str) -> Address | None:
-        if self._last_request:
-            while (datetime.now() - self._last_request).total_seconds() < 1:
-                pass
-        location = self._geolocator.geocode(address)
-        self._last_request = datetime.now()
+        self._rate_limiter.acquire()
+        try:
+            with metrics.GEOCODER_CALL_SECONDS.labels(self.NOMINATIM).time():
+                location = self._geolocator.geocode(address)
+        except Exception as e:
+            metrics.GEOCODER_ERRORS.labels(self.NOMINATIM).inc()
+            self._logger.error(f"An error occurred while normalizing address with Nominatim: `{e}`")
+            raise GeocoderUnavailableError(f"Nominatim error: `{e}`") from e
         if not location:
             return
-        return Address(full_address=location.address)
+        return Address(full_address=location.address, lat=location.latitude, lon=location.longitude)
 
 
 class _AddressParserGoogleMaps(AddressParser):
 
-    def __init__(self, api_key: str, logger: Logger = None):
-        AddressParser.__init__(self, logger)
+    # Google's limit is 50 QPS, so 5 QPS is a safe default
+    max_qps: float = 5
+    provider = AddressParser.GOOGLE_MAPS
+
+    def __init__(self, api_key: str, logger: Logger = None, max_qps: float | None = None):
+        AddressParser.__init__(self, logger, max_qps=max_qps)
         self._client = GoogleMapsClient(key=api_key)
-        self._last_request: datetime | None = None
 
     def normalize(self, address: str) -> Address | None:
-        if self._last_request:
-            # Google's limit is 50 QPS, so 0.2 seconds is a safe delay
-            while (datetime.now() - self._last_request).total_seconds() < 0.2:
-                pass
+        self._rate_limiter.acquire()
         try:
-            geocode_result = googlemaps_geocode(self._client, address, language="en-us")
-            self._last_request = datetime.now()
+            with metrics.GEOCODER_CALL_SECONDS.labels(self.GOOGLE_MAPS).time():
+                geocode_result = googlemaps_geocode(self._client, address, language="en-us")
             if not geocode_result:
                 return
             # TODO: See why some Eastern EU addresses do not return the bloc number even when specified
             return Address.from_google_maps_result(geocode_result[0])
         except Exception as e:
+            metrics.GEOCODER_ERRORS.labels(self.GOOGLE_MAPS).inc()
             self._logger.error(f"An error occurred while normalizing address with Google Maps API: `{e}`")
-            return
+            raise GeocoderUnavailableError(f"Google Maps API error: `{e}`") from e
+
+
+class _AddressParserLocal(AddressParser):
+    """
+    Offline, rule-based normalization (see `local.canonical_address`). Addresses found in the gazetteer get its form
+    and coordinates, anything else is returned in canonical form without coordinates
+    """
+
+    def __init__(self, logger: Logger, gazetteer: Gazetteer | None = None, **_kwargs):
+        AddressParser.__init__(self, logger)
+        self._gazetteer: Gazetteer = gazetteer or Gazetteer()
+        self._lock: threading.Lock = threading.Lock()
+        self._gazetteer_hits: int = 0
+        self._gazetteer_misses: int = 0
+
+    def canonicalize(self, address: str) -> str:
+        return canonical_address(address)
+
+    def lookup(self, canonical: str) -> Address | None:
+        """
+        :return: the gazetteer entry for an already canonical address
+        """
+        address = self._gazetteer.get(canonical)
+        with self._lock:
+            if address is None:
+                self._gazetteer_misses += 1
+            else:
+                self._gazetteer_hits += 1
+        return address
+
+    def normalize(self, address: str) -> Address | None:
+        if not (canonical := self.canonicalize(address)):
+            return None
+        return self.lookup(canonical) or Address(full_address=display_address(canonical))
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {"local": {"gazetteer_size": len(self._gazetteer), "gazetteer_hits": self._gazetteer_hits,
+                              "gazetteer_misses": self._gazetteer_misses}}
+
+
+class _LocalFirstAddressParser(AddressParser):
+    """
+    Pre-pass in front of a remote parser: inputs are canonicalized locally and answered from the gazetteer if
+    possible. Anything else is passed on as the user wrote it, since the canonical form drops accents the provider
+    can use; the cache and single-flight wrappers behind this key by the canonical form (see `new_parser`), so
+    equivalent spellings still share one provider call
+    """
+
+    def __init__(self, local: _AddressParserLocal, parser: AddressParser, logger: Logger):
+        AddressParser.__init__(self, logger)
+        self._local: _AddressParserLocal = local
+        self._parser: AddressParser = parser
+
+    def normalize(self, address: str) -> Address | None:
+        if not (canonical := self._local.canonicalize(address)):
+            return None
+        if (known := self._local.lookup(canonical)) is not None:
+            return known
+        return self._parser.normalize(address)
+
+    def stats(self) -> dict[str, Any]:
+        return {**self._parser.stats(), **self._local.stats()}
+
+
+@dataclasses.dataclass
+class GeocodeCacheStats:
+
+    hits: int = 0
+    negative_hits: int = 0
+    persistent_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+    def to_dict(self) -> dict[str, int]:
+        return dataclasses.asdict(self)
+
+
+class GeocodeCache:
+    """
+    Two-tier cache for normalized addresses, keyed by `raw_address_key`.
+    The first tier is an in-process LRU bounded by size and TTL. The second (optional) tier is the `geocode_cache`
+    table in the app database, so results survive restarts. Failed normalizations (`None`) are cached as well, but
+    with a shorter TTL so that addresses the provider learns about later are eventually retried
+    """
+
+    def __init__(self, logger: Logger, max_size: int = 10_000, ttl: timedelta = timedelta(days=30),
+                 negative_ttl: timedelta = timedelta(hours=1), db: 'Database | None' = None):
+        self._logger: Logger = logger
+        self._max_size: int = max_size
+        self._ttl: timedelta = ttl
+        self._negative_ttl: timedelta = negative_ttl
+        self._db: 'Database | None' = db
+        self._entries: collections.OrderedDict[str, tuple[Address | None, float]] = collections.OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self._stats: GeocodeCacheStats = GeocodeCacheStats()
+
+    def get(self, key: str) -> tuple[bool, Address | None]:
+        """
+        Look up a key in memory first, then in the database
+        :return: a pair of (found, address). `(True, None)` is a cached negative result
+        """
+        with self._lock:
+            if (entry := self._entries.get(key)) is not None:
+                address, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    if address is None:
+                        self._stats.negative_hits += 1
+                    else:
+                        self._stats.hits += 1
+                    return True, self._copy(address)
+                del self._entries[key]
+                self._stats.expirations += 1
+
+        if self._db is not None and (persisted := self._db.get_cached_geocode(key)) is not None:
+            address, expires_at = persisted
+            remaining = (expires_at - datetime.utcnow()).total_seconds()
+            if remaining > 0:
+                with self._lock:
+                    self._stats.persistent_hits += 1
+                    if address is None:
+                        self._stats.negative_hits += 1
+                    else:
+                        self._stats.hits += 1
+                    self._remember(key, address, time.monotonic() + remaining)
+                return True, self._copy(address)
+
+        with self._lock:
+            self._stats.misses += 1
+        return False, None
+
+    @property
+    def persistent(self) -> bool:
+        """
+        Whether lookups may go to the database (and therefore block)
+        """
+        return self._db is not None
+
+    def put(self, key: str, address: Address | None) -> None:
+        ttl = self._ttl if address is not None else self._negative_ttl
+        with self._lock:
+            self._remember(key, self._copy(address), time.monotonic() + ttl.total_seconds())
+        if self._db is not None:
+            self._db.save_cached_geocode(key, address, datetime.utcnow() + ttl)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            d = self._stats.to_dict()
+            d['size'] = len(self._entries)
+            d['max_size'] = self._max_size
+            return d
+
+    def _remember(self, key: str, address: Address | None, expires_at: float) -> None:
+        """
+        Must be called with the lock held
+        """
+        self._entries[key] = (address, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self._stats.evictions += 1
+
+    @staticmethod
+    def _copy(address: Address | None) -> Address | None:
+        # Callers set the ID on the address they get back, so never hand out the cached instance itself
+        return dataclasses.replace(address) if address is not None else None
 
 
-def new_parser(engine: str, *, logger: Logger, **kwargs) -> AddressParser:
+class _CachingAddressParser(AddressParser):
+    """
+    Wraps another parser and serves repeated raw inputs from a `GeocodeCache`
+    """
+
+    def __init__(self, parser: AddressParser, cache: GeocodeCache, logger: Logger,
+                 key: Callable[[str], str] = raw_address_key):
+        """
+        :param key: cache key of an input
+        """
+        AddressParser.__init__(self, logger)
+        self._parser: AddressParser = parser
+        self._cache: GeocodeCache = cache
+        self._key: Callable[[str], str] = key
+
+    def normalize(self, address: str) -> Address | None:
+        key = self._key(address)
+        found, result = self._cache.get(key)
+        if found:
+            self._logger.debug("Geocode cache hit for `%s`", key)
+            return result
+        # GeocoderUnavailableError propagates without being cached
+        result = self._parser.normalize(address)
+        self._cache.put(key, result)
+        return result
+
+    def stats(self) -> dict[str, Any]:
+        return {**self._parser.stats(), "cache": self._cache.stats()}
+
+
+class _InFlightCall:
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done: threading.Event = threading.Event()
+        self.result: Address | None = None
+        self.error: BaseException | None = None
+        self.waiters: int = 0
+
+
+class _CoalescingAddressParser(AddressParser):
+    """
+    Single-flight wrapper: concurrent callers asking for the same raw address (by `raw_address_key`) wait for one
+    outstanding call to the wrapped parser and share its result, instead of each sending their own request
+    """
+
+    def __init__(self, parser: AddressParser, logger: Logger, key: Callable[[str], str] = raw_address_key):
+        """
+        :param key: inputs with the same key share a call
+        """
+        AddressParser.__init__(self, logger)
+        self._parser: AddressParser = parser
+        self._key: Callable[[str], str] = key
+        self._lock: threading.Lock = threading.Lock()
+        self._in_flight: dict[str, _InFlightCall] = {}
+        self._calls: int = 0
+        self._coalesced: int = 0
+
+    def normalize(self, address: str) -> Address | None:
+        key = self._key(address)
+        with self._lock:
+            if call := self._in_flight.get(key):
+                call.waiters += 1
+                self._coalesced += 1
+                leader = False
+            else:
+                call = self._in_flight[key] = _InFlightCall()
+                self._calls += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            # Callers set the ID on the address they get back, so each of them gets its own copy
+            return dataclasses.replace(call.result) if call.result is not None else None
+
+        try:
+            call.result = self._parser.normalize(address)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+            if call.waiters:
+                self._logger.debug("Shared geocode result for `%s` with %d waiting callers", key, call.waiters)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            coalescing = {"calls": self._calls, "coalesced": self._coalesced, "in_flight": len(self._in_flight)}
+        return {**self._parser.stats(), "coalescing": coalescing}
+
+
+class _FailoverAttempt:
+
+    __slots__ = ('backend', 'breaker', 'started', 'settled')
+
+    def __init__(self, backend: str, breaker: CircuitBreaker):
+        self.backend: str = backend
+        self.breaker: CircuitBreaker = breaker
+        self.started: float = time.monotonic()
+        self.settled: bool = False
+
+
+class _FailoverAddressParser(AddressParser):
+    """
+    Several backends in order of preference. A call goes to the first backend whose circuit (see `CircuitBreaker`) is
+    closed. If it has not answered within the policy's `hedge_after`, the next backend is asked as well and the first
+    answer wins; if it fails, the next backend is asked right away. Backends are called on a thread pool, so a caller
+    waits at most about `hedge_after` per backend for a slow one, and not at all for one whose circuit is open
+    """
+
+    _max_threads: int = 64
+
+    def __init__(self, backends: list[tuple[str, AddressParser]], policy: FailoverPolicy, logger: Logger):
+        AddressParser.__init__(self, logger)
+        self._backends: list[tuple[str, AddressParser, CircuitBreaker]] = [
+            (name, parser, CircuitBreaker(policy)) for name, parser in backends
+        ]
+        self._policy: FailoverPolicy = policy
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=self._max_threads,
+                                                                thread_name_prefix="geocode-failover")
+        self._lock: threading.Lock = threading.Lock()
+        self._counters: collections.Counter[str] = collections.Counter()
+
+    def normalize(self, address: str) -> Address | None:
+        candidates = iter(self._backends)
+        pending: dict[Future, _FailoverAttempt] = {}
+        errors: list[str] = []
+
+        def call_next() -> bool:
+            for name, parser, breaker in candidates:
+                if breaker.allow():
+                    attempt = _FailoverAttempt(name, breaker)
+                    future = self._executor.submit(parser.normalize, address)
+                    future.add_done_callback(lambda f, a=attempt: self._settle(a, failed=f.exception() is not None))
+                    pending[future] = attempt
+                    return True
+            return False
+
+        if not call_next():
+            self._count("rejected")
+            raise GeocoderUnavailableError("Every geocoding backend is unavailable")
+        while pending:
+            done, _ = wait(pending, timeout=self._policy.hedge_after, return_when=FIRST_COMPLETED)
+            if not done:
+                # the breakers learn about the slow calls now rather than whenever (if ever) they finish
+                for attempt in pending.values():
+                    if time.monotonic() - attempt.started > self._policy.hedge_after:
+                        self._settle(attempt, failed=False)
+                if call_next():
+                    self._count("hedged")
+                    metrics.GEOCODER_HEDGED_CALLS.labels(list(pending.values())[-1].backend).inc()
+                continue
+            for future in done:
+                attempt = pending.pop(future)
+                try:
+                    return future.result()
+                except GeocoderUnavailableError as e:
+                    errors.append(f"{attempt.backend}: {e}")
+            if not pending and call_next():
+                self._count("failed_over")
+        self._count("failed")
+        raise GeocoderUnavailableError(f"Every geocoding backend failed ({'; '.join(errors)})")
+
+    def _settle(self, attempt: '_FailoverAttempt', failed: bool) -> None:
+        """
+        Report the outcome of a call to its backend's breaker, once
+        """
+        with self._lock:
+            if attempt.settled:
+                return
+            attempt.settled = True
+        attempt.breaker.record(failed, time.monotonic() - attempt.started)
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def stats(self) -> dict[str, Any]:
+        stats: dict[str, Any] = {}
+        for _, parser, _ in self._backends:
+            stats.update(parser.stats())
+        with self._lock:
+            counters = dict(self._counters)
+        stats["failover"] = {**counters, "backends": {name: breaker.stats() for name, _, breaker in self._backends}}
+        return stats
+
+
+# engine name -> factory(logger=..., max_qps=..., **kwargs)
+_BACKENDS: dict[str, Callable[..., AddressParser]] = {
+    AddressParser.NOMINATIM: _AddressParserNominatim,
+    AddressParser.GOOGLE_MAPS: _AddressParserGoogleMaps,
+}
+
+
+def register_backend(engine: str, factory: Callable[..., AddressParser]) -> None:
+    """
+    Make another backend available to `new_parser` (eg a stand-in for benchmarks)
+    :param factory: called with `logger`, `max_qps` and the extra keyword arguments given to `new_parser`
+    """
+    _BACKENDS[engine] = factory
+
+
+def new_parser(engine: str, *, logger: Logger, cache: GeocodeCache | None = None, max_qps: float | None = None,
+               gazetteer: Gazetteer | None = None, failover: FailoverPolicy | None = None, **kwargs) -> AddressParser:
     """
     Factory method for creating a new AddressParser
-    :param engine: which backend to use for normalizing GeoLocations
+    :param engine: which backend to use for normalizing GeoLocations (see `register_backend`). `local` normalizes
+    offline, `local+<engine>` canonicalizes locally before calling `<engine>`. Several comma separated backends (eg
+    `googlemaps,nominatim`) are tried in that order (see `_FailoverAddressParser`)
+    :param cache: if given, the backend is wrapped so that repeated inputs are served from this cache
+    :param max_qps: overrides the backend's default request rate limit (of every backend)
+    :param gazetteer: known addresses for the local parser
+    :param failover: hedging and circuit breaker settings when there are several backends
+    Concurrent calls for the same raw address are always coalesced into one (see `_CoalescingAddressParser`)
+    """
+    if engine == AddressParser.LOCAL:
+        # Nothing to cache or coalesce, this is cheaper than either
+        return _AddressParserLocal(logger=logger.new_from("PARSER_LOCAL"), gazetteer=gazetteer)
+
+    local = None
+    if engine.startswith(AddressParser.LOCAL_PREFIX):
+        engine = engine.removeprefix(AddressParser.LOCAL_PREFIX)
+        local = _AddressParserLocal(logger=logger.new_from("PARSER_LOCAL"), gazetteer=gazetteer)
+    key = local.canonicalize if local is not None else raw_address_key
+    parser = _new_backend(engine, logger=logger, max_qps=max_qps, failover=failover, **kwargs)
+    if cache is not None:
+        parser = _CachingAddressParser(parser, cache, logger=logger.new_from("PARSER_CACHE"), key=key)
+    # Outermost, so that concurrent misses for the same input also share the (persistent) cache lookup
+    parser = _CoalescingAddressParser(parser, logger=logger.new_from("PARSER_SINGLE_FLIGHT"), key=key)
+    if local is not None:
+        parser = _LocalFirstAddressParser(local, parser, logger=logger.new_from("PARSER_LOCAL_FIRST"))
+    return parser
+
+
+def _new_backend(engine: str, *, logger: Logger, max_qps: float | None = None,
+                 failover: FailoverPolicy | None = None, **kwargs) -> AddressParser:
+    """
+    The backend(s) named by `engine`, without any of the wrappers
     """
+    if AddressParser.ENGINE_SEPARATOR in engine:
+        backends = [
+            (name, _new_backend(name, logger=logger, max_qps=max_qps, **kwargs))
+            for name in (e.strip() for e in engine.split(AddressParser.ENGINE_SEPARATOR)) if name
+        ]
+        return _FailoverAddressParser(backends, failover or FailoverPolicy(), logger=logger.new_from("PARSER_FAILOVER"))
+    if (factory := _BACKENDS.get(engine)) is None:
+        raise ValueError(f"Unknown engine {engine}")
     if engine == AddressParser.NOMINATIM:
-        return _AddressParserNominatim(logger=logger.new_from("PARSER_NOMINATIM"))
-    if engine == AddressParser.GOOGLE_MAPS:
-        return _AddressParserGoogleMaps(logger=logger.new_from("PARSER_GOOGLE_MAPS"), **kwargs)
-    raise ValueError(f"Unknown engine {engine}")
+        kwargs.pop("api_key", None)
+    return factory(logger=logger.new_from(f"PARSER_{engine.upper()}"), max_qps=max_qps, **kwargs)
@@ -0,0 +1,74 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter. Callers reserve a token under the lock and then sleep (outside of it) until
+    their reservation is due, so waiting never burns CPU and concurrent callers are served in arrival order.
+    The bucket lives in shared memory, so processes forked after it was created (see `web.prefork`) draw from the
+    same budget
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        """
+        :param rate: tokens added per second (ie the sustained QPS)
+        :param capacity: maximum burst size
+        """
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        self._rate: float = rate
+        self._capacity: float = capacity
+        # (tokens, updated at), the monotonic clock is the same for every process on the host
+        self._state = multiprocessing.RawArray("d", (capacity, time.monotonic()))
+        self._lock = multiprocessing.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def reserve(self) -> float:
+        """
+        Take one token without waiting for it
+        :return: the number of seconds until the token is due, which the caller must wait before using it
+        """
+        with self._lock:
+            tokens, updated = self._state
+            now = time.monotonic()
+            tokens = min(self._capacity, tokens + (now - updated) * self._rate) - 1
+            self._state[0], self._state[1] = tokens, now
+            return -tokens / self._rate if tokens < 0 else 0.0
+
+    def acquire(self) -> float:
+        """
+        Take one token, blocking until it is available
+        :return: the number of seconds spent waiting
+        """
+        if (wait := self.reserve()) > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        """
+        Same as `acquire`, but waits on the event loop instead of blocking the thread
+        """
+        if (wait := self.reserve()) > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+_named_buckets: dict[str, TokenBucket] = {}
+_named_buckets_lock: threading.Lock = threading.Lock()
+
+
+def named_bucket(name: str, rate: float) -> TokenBucket:
+    """
+    The bucket for `name` (eg a geocoding provider), created with `rate` on first use. Every parser calling the same
+    provider, blocking or async, draws from this one budget
+    """
+    with _named_buckets_lock:
+        if (bucket := _named_buckets.get(name)) is None:
+            bucket = _named_buckets[name] = TokenBucket(rate=rate)
+        return bucket
@@ -0,0 +1,4 @@
+from .pipeline import BatchImporter, ImportResult
+from .jobs import ImportJobManager
+from .offline import OfflineImport
+from .upload import UploadOffsetError
@@ -0,0 +1,234 @@
+import contextlib
+import csv
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows, which has no prefork workers (see `PreforkServer`): one process writes the uploads
+    fcntl = None
+
+from src.db.conn import Database
+from src.ingest.pipeline import BatchImporter, ImportResult
+from src.ingest.upload import SpoolTail, UploadOffsetError, UploadStalledError
+from src.util.logging import Logger
+from src.web.model import ImportJob
+
+
+class ImportJobManager:
+    """
+    Runs CSV imports in the background. Uploads are spooled to disk and processed by a small in-process pool, while
+    the job row in the database tracks progress. Every committed batch moves the job's checkpoint forward, so a job
+    which was interrupted (eg by a restart) resumes after its last committed batch instead of starting over.
+    Large files can be uploaded in chunks (see `create_upload`), their rows are imported while the upload goes on
+    """
+
+    _spool_chunk_size: int = 1024 * 1024
+    # chunk size advertised to clients, and the largest chunk accepted
+    upload_chunk_size: int = 4 * 1024 * 1024
+    max_upload_chunk_size: int = 16 * 1024 * 1024
+    # seconds without a new chunk after which the import of an unfinished upload pauses until the next chunk
+    _upload_idle_timeout: float = 60.0
+
+    def __init__(self, importer_factory: Callable[[], BatchImporter], db: Database, logger: Logger,
+                 spool_dir: Path, max_jobs: int = 2):
+        self._importer_factory: Callable[[], BatchImporter] = importer_factory
+        self._db: Database = db
+        self._logger: Logger = logger
+        self._spool_dir: Path = spool_dir
+        self._spool_dir.mkdir(parents=True, exist_ok=True)
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="import-job")
+        # stands in for the spool file locks where there is no `fcntl`
+        self._spool_lock: threading.Lock = threading.Lock()
+
+    def submit(self, stream: BinaryIO, filename: str) -> ImportJob:
+        """
+        Spool an uploaded CSV (with header) to disk and queue it for import
+        """
+        job_id = uuid.uuid4().hex
+        spool_path = self._spool_dir / f"{job_id}.csv"
+        lines, last = 0, b"\n"
+        with open(spool_path, "wb") as f:
+            while chunk := stream.read(self._spool_chunk_size):
+                f.write(chunk)
+                lines += chunk.count(b"\n")
+                last = chunk[-1:]
+        if last != b"\n":
+            lines += 1
+
+        job = ImportJob(
+            id=job_id, filename=filename, spool_path=str(spool_path), status=ImportJob.QUEUED,
+            created_at=datetime.utcnow(), rows_total=max(0, lines - 1),
+        )
+        self._db.create_import_job(job)
+        self._logger.info(f"Queued import job {job_id} for `{filename}` (~{job.rows_total} rows)")
+        self._executor.submit(self._run, job_id)
+        return job
+
+    def create_upload(self, filename: str, size: int) -> ImportJob:
+        """
+        Start a chunked upload of a CSV (with header) of `size` bytes. The job stays `UPLOADING` until its first chunk
+        """
+        if size <= 0:
+            raise ValueError("The upload size must be positive")
+        job_id = uuid.uuid4().hex
+        spool_path = self._spool_dir / f"{job_id}.csv"
+        spool_path.touch()
+        job = ImportJob(
+            id=job_id, filename=filename, spool_path=str(spool_path), status=ImportJob.UPLOADING,
+            created_at=datetime.utcnow(), rows_total=0, upload_size=size, uploaded_bytes=0,
+        )
+        self._db.create_import_job(job)
+        self._logger.info(f"Created chunked upload {job_id} for `{filename}` ({size} bytes)")
+        return job
+
+    def write_chunk(self, job: ImportJob, offset: int, data: bytes, sha256: str | None = None) -> int:
+        """
+        Store a chunk of a chunked upload and (re)start its import. Chunks must be sent in order, a chunk which was
+        already committed (eg resent because its response was lost) is acknowledged again without being rewritten
+        :param sha256: hex digest of the chunk, checked when given
+        :return: the committed offset, where the next chunk starts
+        :raises UploadOffsetError: the chunk does not start at the committed offset
+        :raises ValueError: the chunk is invalid
+        """
+        if not data:
+            raise ValueError("Empty chunk")
+        if len(data) > self.max_upload_chunk_size:
+            raise ValueError(f"Chunks must not be larger than {self.max_upload_chunk_size} bytes")
+        if sha256 is not None and hashlib.sha256(data).hexdigest() != sha256.lower():
+            raise ValueError("The chunk does not match its SHA-256")
+        if (end := offset + len(data)) > job.upload_size:
+            raise ValueError(f"The chunk ends past the upload size of {job.upload_size} bytes")
+        if offset != job.uploaded_bytes:
+            return self._committed_offset(job.uploaded_bytes, end)
+
+        with self._locked_spool(job.spool_path) as f:
+            # another request may have committed a chunk at this offset while we waited for the lock
+            current = self._db.get_import_job(job.id) or job
+            if offset != current.uploaded_bytes:
+                return self._committed_offset(current.uploaded_bytes, end)
+            f.seek(offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())  # acknowledged chunks survive a crash
+            if not self._db.advance_upload(job.id, offset, len(data), lines=data.count(b"\n")):
+                current = self._db.get_import_job(job.id)
+                return self._committed_offset(current.uploaded_bytes if current else offset, end)
+
+        if end == job.upload_size:
+            current = self._db.get_import_job(job.id)
+            # `rows_total` so far counts the newlines, which include the header's, and miss a last line without one
+            rows_total = current.rows_total - 1 + (0 if data.endswith(b"\n") else 1)
+            self._db.update_import_job(job.id, rows_total=max(0, rows_total))
+            self._logger.info(f"Upload {job.id} is complete")
+        if self._db.update_import_job_if(job.id, {"status": ImportJob.UPLOADING}, status=ImportJob.QUEUED):
+            self._executor.submit(self._run, job.id)
+        return end
+
+    @contextlib.contextmanager
+    def _locked_spool(self, spool_path: str) -> Iterator[BinaryIO]:
+        """
+        The spool file of a chunked upload, open for writing. Only one request at a time, in any worker process, holds
+        it, so a chunk is claimed (its offset checked) and written before any other chunk can be
+        """
+        with open(spool_path, "r+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)  # released when the file is closed
+                yield f
+            else:
+                with self._spool_lock:
+                    yield f
+
+    @staticmethod
+    def _committed_offset(committed: int, end: int) -> int:
+        if end <= committed:
+            return committed
+        raise UploadOffsetError(committed)
+
+    def resume_unfinished(self) -> None:
+        """
+        Requeue the jobs which were queued or running when the application last stopped
+        """
+        for job in self._db.get_unfinished_import_jobs():
+            self._logger.info(f"Resuming import job {job.id} after row {job.checkpoint_row}")
+            self._executor.submit(self._run, job.id)
+
+    def get(self, job_id: str) -> ImportJob | None:
+        return self._db.get_import_job(job_id)
+
+    def failures(self, job_id: str, offset: int = 0, limit: int = 100) -> list[tuple[int, str]]:
+        return self._db.get_import_failures(job_id, offset=offset, limit=limit)
+
+    def _run(self, job_id: str) -> None:
+        if not (job := self._db.get_import_job(job_id)):
+            self._logger.error(f"Import job {job_id} does not exist")
+            return
+        self._db.update_import_job(
+            job_id, status=ImportJob.RUNNING, started_at=datetime.utcnow(), resumed_from_row=job.checkpoint_row
+        )
+
+        try:
+            if job.chunked:
+                self._run_chunked(job)
+                return
+            with open(job.spool_path, "r", encoding="utf-8", newline="") as f:
+                self._import(f, job)
+        except Exception as e:
+            self._logger.error(f"Import job {job_id} failed\nError: `{e}`")
+            self._db.update_import_job(job_id, status=ImportJob.FAILED, error=str(e), finished_at=datetime.utcnow())
+            return
+
+        self._complete(job)
+
+    def _run_chunked(self, job: ImportJob) -> None:
+        """
+        Import the rows of a chunked upload as its chunks are committed. If the upload stops before it is complete,
+        the job goes back to `UPLOADING` (keeping its checkpoint) and the next chunk starts it again
+        """
+        while True:
+            tail = SpoolTail(job.spool_path, job.upload_size, lambda: self._uploaded_bytes(job.id),
+                             idle_timeout=self._upload_idle_timeout)
+            try:
+                self._import(tail, job)
+            except UploadStalledError as e:
+                self._logger.info(f"Import job {job.id} stopped, {e}")
+            if tail.committed == job.upload_size:
+                self._complete(job)
+                return
+            # only pause if no chunk was committed meanwhile, else that chunk's request would not restart the job
+            if self._db.update_import_job_if(job.id, {"status": ImportJob.RUNNING, "uploaded_bytes": tail.committed},
+                                             status=ImportJob.UPLOADING):
+                self._logger.info(f"Import job {job.id} paused at {tail.committed}/{job.upload_size} bytes uploaded")
+                return
+            if not (job := self._db.get_import_job(job.id)):
+                return
+
+    def _import(self, lines: Iterable[str], job: ImportJob) -> None:
+        """
+        Import the rows after the job's checkpoint
+        """
+        def on_commit(checkpoint: int, result: ImportResult, failures: list[tuple[int, str]]) -> None:
+            self._db.record_import_progress(
+                job.id, checkpoint, job.success + result.success, job.failed + result.failed, failures
+            )
+
+        csv_reader = csv.reader(lines)
+        next(csv_reader, None)  # header
+        self._importer_factory().run(csv_reader, start_row=job.checkpoint_row, on_commit=on_commit)
+
+    def _uploaded_bytes(self, job_id: str) -> int | None:
+        job = self._db.get_import_job(job_id)
+        return job.uploaded_bytes if job else None
+
+    def _complete(self, job: ImportJob) -> None:
+        self._db.update_import_job(job.id, status=ImportJob.COMPLETED, finished_at=datetime.utcnow())
+        try:
+            os.remove(job.spool_path)
+        except OSError as e:
+            self._logger.warning(f"Could not remove spool file {job.spool_path}: `{e}`")
@@ -0,0 +1,126 @@
+import csv
+import dataclasses
+import json
+import mmap
+import os
+import time
+from pathlib import Path
+from typing import Iterator, TextIO
+
+from src.ingest.pipeline import BatchImporter, ImportResult
+from src.util.logging import Logger
+
+
+def mmap_lines(path: Path) -> Iterator[str]:
+    """
+    The lines of a file, each with its line ending as the CSV reader expects, read through a memory map: the pages are
+    mapped straight from the page cache, with no read buffer copies, and the OS reads ahead of the sequential scan
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return  # an empty file cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            start, size = 0, len(mm)
+            while start < size:
+                end = mm.find(b"\n", start) + 1 or size
+                yield mm[start:end].decode("utf-8")
+                start = end
+
+
+@dataclasses.dataclass
+class ImportCheckpoint:
+    """
+    Progress of an offline import, stored next to the CSV. The file's size and modification time identify the
+    input, so a checkpoint is never applied to a different file (eg the next night's dump under the same name)
+    """
+
+    size: int
+    mtime_ns: int
+    checkpoint_row: int = 0
+    success: int = 0
+    failed: int = 0
+    completed: bool = False
+
+    @classmethod
+    def from_file(cls, path: Path) -> 'ImportCheckpoint | None':
+        if not path.exists():
+            return None
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(**{f.name: data[f.name] for f in dataclasses.fields(cls) if f.name in data})
+
+    def save(self, path: Path) -> None:
+        # written next to the checkpoint and renamed over it, so a crash never leaves a truncated checkpoint
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(dataclasses.asdict(self), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def matches(self, stat: os.stat_result) -> bool:
+        return self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns
+
+
+class OfflineImport:
+    """
+    Imports a CSV (with header) straight into the database, without the HTTP server: the same pipeline as the import
+    jobs (see `BatchImporter`), reading the file through `mmap_lines`. Every committed batch is recorded in a
+    checkpoint file, a restarted import skips the rows up to it
+    """
+
+    def __init__(self, importer: BatchImporter, logger: Logger, out: TextIO):
+        """
+        :param out: where the progress lines are printed
+        """
+        self._importer: BatchImporter = importer
+        self._logger: Logger = logger
+        self._out: TextIO = out
+
+    def run(self, csv_path: Path, checkpoint_path: Path, restart: bool = False) -> ImportResult:
+        """
+        :param restart: ignore an existing checkpoint and import the whole file
+        :return: the totals of the whole import, including the rows of previous runs
+        """
+        stat = csv_path.stat()
+        checkpoint = None if restart else ImportCheckpoint.from_file(checkpoint_path)
+        if checkpoint is not None and not checkpoint.matches(stat):
+            self._logger.warning(f"Checkpoint {checkpoint_path} belongs to another version of {csv_path}, ignoring it")
+            checkpoint = None
+        if checkpoint is None:
+            checkpoint = ImportCheckpoint(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        elif checkpoint.completed:
+            self._print(f"{csv_path} was already imported ({checkpoint.success} succeeded, {checkpoint.failed} failed)")
+            return ImportResult(success=checkpoint.success, failed=checkpoint.failed)
+        else:
+            self._print(f"Resuming {csv_path} after row {checkpoint.checkpoint_row}")
+
+        resumed_from = checkpoint.checkpoint_row
+        base = ImportResult(success=checkpoint.success, failed=checkpoint.failed)
+        started = time.monotonic()
+
+        def on_commit(row: int, result: ImportResult, failures: list[tuple[int, str]]) -> None:
+            checkpoint.checkpoint_row = row
+            checkpoint.success, checkpoint.failed = base.success + result.success, base.failed + result.failed
+            checkpoint.save(checkpoint_path)
+            elapsed = time.monotonic() - started
+            self._print(f"row {row}: {checkpoint.success} succeeded, {checkpoint.failed} failed, "
+                        f"{(row - resumed_from) / elapsed if elapsed else 0:.1f} rows/s")
+
+        csv_reader = csv.reader(mmap_lines(csv_path))
+        next(csv_reader, None)  # header
+        try:
+            self._importer.run(csv_reader, start_row=resumed_from, on_commit=on_commit)
+        except KeyboardInterrupt:
+            self._print(f"Interrupted after row {checkpoint.checkpoint_row}, run the import again to resume")
+            raise
+        checkpoint.completed = True
+        checkpoint.save(checkpoint_path)
+        self._print(f"Imported {csv_path} in {time.monotonic() - started:.1f}s: "
+                    f"{checkpoint.success} succeeded, {checkpoint.failed} failed")
+        return ImportResult(success=checkpoint.success, failed=checkpoint.failed)
+
+    def _print(self, line: str) -> None:
+        print(line, file=self._out, flush=True)
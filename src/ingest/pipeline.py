@@ -0,0 +1,218 @@
+import dataclasses
+import heapq
+import itertools
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable
+
+from src.db.conn import Database
+from src.util import metrics
+from src.util.logging import Logger
+from src.web.model import Address
+
+
+@dataclasses.dataclass
+class ImportResult:
+
+    success: int = 0
+    failed: int = 0
+
+    def to_dict(self) -> dict[str, int]:
+        return dataclasses.asdict(self)
+
+
+# Called after every committed batch with (checkpoint row, running totals, failures since the previous call).
+# Every row up to and including the checkpoint has been committed or has failed
+CommitCallback = Callable[[int, ImportResult, list[tuple[int, str]]], None]
+
+
+class BatchImporter:
+    """
+    Pipelined tenant importer. One thread parses the input rows into a bounded work queue, a pool of workers normalizes
+    the addresses (the parser's rate limiter is shared between them, so together they run at the provider's quota) and
+    the calling thread writes the normalized rows to the database in chunks of `batch_size`.
+    Results are written in input order, so every committed batch ends at a well-defined row which an interrupted import
+    can resume after. The reader never gets more than `window` rows ahead of the writer, which keeps memory flat
+    however large the input is.
+    """
+
+    _DONE = object()
+
+    def __init__(self, normalize: Callable[[str], Address], db: Database, logger: Logger,
+                 workers: int = 8, batch_size: int = 1024):
+        """
+        :param normalize: turns a raw address into an `Address`, raising `ValueError` if it cannot be normalized
+        """
+        self._normalize: Callable[[str], Address] = normalize
+        self._db: Database = db
+        self._logger: Logger = logger
+        self._workers: int = max(1, workers)
+        self._batch_size: int = batch_size
+        self._window: int = max(64, self._workers * 16)
+
+    def run(self, rows: Iterable[list[str]], start_row: int = 0, on_commit: CommitCallback | None = None) -> ImportResult:
+        """
+        Import (tenant name, raw address) rows. The header, if any, must already be consumed
+        :param start_row: skip the rows up to and including this one (a checkpoint passed to `on_commit`)
+        :param on_commit: see `CommitCallback`
+        :return: the totals for the rows processed by this call
+        """
+        result = ImportResult()
+        stop = threading.Event()
+        errors: list[BaseException] = []
+        window = threading.Semaphore(self._window)
+        work_q: queue.Queue = queue.Queue(maxsize=self._workers * 4)
+        result_q: queue.Queue = queue.Queue()  # bounded by `window`
+
+        threads = [threading.Thread(target=self._read, args=(rows, start_row, window, work_q, result_q, stop, errors),
+                                    name="import-reader", daemon=True)]
+        threads += [threading.Thread(target=self._geocode, args=(work_q, result_q, stop, errors),
+                                     name=f"import-geocoder-{i}", daemon=True) for i in range(self._workers)]
+        started = time.monotonic()
+        for t in threads:
+            t.start()
+
+        batch: list[tuple[str, Address, str]] = []
+        batch_rows: list[int] = []
+        failures: list[tuple[int, str]] = []
+        pending: list[tuple[int, Any]] = []  # results which arrived ahead of `next_row`
+        next_row = start_row + 1
+        pending_workers = self._workers
+        try:
+            while pending_workers:
+                item = self._get(result_q, stop)
+                if item is self._DONE:
+                    pending_workers -= 1
+                    continue
+                heapq.heappush(pending, item)
+                while pending and pending[0][0] == next_row:
+                    i, outcome = heapq.heappop(pending)
+                    window.release()
+                    next_row += 1
+                    if isinstance(outcome, str):
+                        result.failed += 1
+                        metrics.IMPORT_ROWS.labels("failed").inc()
+                        failures.append((i, outcome))
+                        continue
+                    batch.append(outcome)
+                    batch_rows.append(i)
+                    if len(batch) >= self._batch_size:
+                        self._flush(batch, batch_rows, result, failures)
+                        self._commit(on_commit, next_row - 1, result, failures)
+            if not errors:
+                self._flush(batch, batch_rows, result, failures)
+                self._commit(on_commit, next_row - 1, result, failures)
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+
+        if errors:
+            raise errors[0]
+        elapsed = time.monotonic() - started
+        total = result.success + result.failed
+        if elapsed:
+            metrics.IMPORT_ROWS_PER_SECOND.set(total / elapsed)
+        self._logger.info(f"Imported {total} rows in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} rows/s), "
+                          f"{result.success} succeeded, {result.failed} failed")
+        return result
+
+    def _flush(self, batch: list[tuple[str, Address, str]], batch_rows: list[int], result: ImportResult,
+               failures: list[tuple[int, str]]) -> None:
+        if not batch:
+            return
+        pending = len(batch)
+        started = time.perf_counter()
+        successful = self._db.batch_insert_tenants(
+            batch, on_failure=lambda index, reason: failures.append((batch_rows[index], reason))
+        )
+        metrics.IMPORT_STAGE_SECONDS.labels("write").inc(time.perf_counter() - started)
+        metrics.IMPORT_ROWS.labels("success").inc(successful)
+        metrics.IMPORT_ROWS.labels("failed").inc(pending - successful)
+        result.success += successful
+        result.failed += pending - successful
+        batch.clear()
+        batch_rows.clear()
+
+    @staticmethod
+    def _commit(on_commit: CommitCallback | None, checkpoint: int, result: ImportResult,
+                failures: list[tuple[int, str]]) -> None:
+        if on_commit is not None:
+            on_commit(checkpoint, dataclasses.replace(result), list(failures))
+        failures.clear()
+
+    def _read(self, rows: Iterable[list[str]], start_row: int, window: threading.Semaphore, work_q: queue.Queue,
+              result_q: queue.Queue, stop: threading.Event, errors: list[BaseException]) -> None:
+        read_seconds = metrics.IMPORT_STAGE_SECONDS.labels("read")
+        parsing = 0.0  # accumulated locally so the counter is not touched for every row
+        rows = iter(rows)
+        try:
+            for i in itertools.count(start=1):
+                started = time.perf_counter()
+                if (row := next(rows, None)) is None:
+                    break
+                parsing += time.perf_counter() - started
+                if i % 1024 == 0:
+                    read_seconds.inc(parsing)
+                    parsing = 0.0
+                if i <= start_row:
+                    continue
+                while not window.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if len(row) != 2:
+                    self._logger.warning("Skipping row %d because it does not have exactly 2 columns", i)
+                    result_q.put((i, "Row does not have exactly 2 columns"))
+                    continue
+                self._put(work_q, (i, *row), stop)
+        except Exception as e:
+            self._logger.error(f"Could not read import rows: `{e}`")
+            errors.append(e)
+            stop.set()
+        finally:
+            read_seconds.inc(parsing)
+            for _ in range(self._workers):
+                self._put(work_q, self._DONE, stop)
+
+    def _geocode(self, work_q: queue.Queue, result_q: queue.Queue,
+                 stop: threading.Event, errors: list[BaseException]) -> None:
+        geocode_seconds = metrics.IMPORT_STAGE_SECONDS.labels("geocode")
+        try:
+            while (item := self._get(work_q, stop)) is not self._DONE:
+                i, tenant_name, raw_address = item
+                started = time.perf_counter()
+                try:
+                    address = self._normalize(raw_address)
+                except ValueError as e:
+                    geocode_seconds.inc(time.perf_counter() - started)
+                    self._logger.warning("Skipping row %d because could not normalize address `%s`", i, raw_address)
+                    result_q.put((i, f"Could not normalize address `{raw_address}`: {e}"))
+                    continue
+                geocode_seconds.inc(time.perf_counter() - started)
+                result_q.put((i, (tenant_name, address, raw_address)))
+        except Exception as e:
+            self._logger.error(f"Geocoding worker failed: `{e}`")
+            errors.append(e)
+            stop.set()
+        finally:
+            result_q.put(self._DONE)
+
+    @classmethod
+    def _put(cls, q: queue.Queue, item: Any, stop: threading.Event) -> None:
+        # Blocks while the queue is full, but gives up once the consumer has gone away
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    @classmethod
+    def _get(cls, q: queue.Queue, stop: threading.Event) -> Any:
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return cls._DONE
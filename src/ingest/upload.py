@@ -0,0 +1,72 @@
+import io
+import time
+from typing import Callable, Iterator
+
+
+class UploadOffsetError(ValueError):
+    """
+    A chunk does not start at the committed offset of its upload
+    """
+
+    def __init__(self, offset: int):
+        super().__init__(f"Expected the chunk at offset {offset}")
+        self.offset: int = offset
+
+
+class UploadStalledError(RuntimeError):
+    """
+    No chunk arrived for a while and the data read so far ends inside a quoted (multi-line) CSV field
+    """
+
+
+class SpoolTail:
+    """
+    The lines of a chunked upload's spool file, read while the upload goes on. Only bytes up to the committed offset
+    (as stored in the database, so chunks received by any worker process count) are read, and only complete lines are
+    returned, so the CSV reader never sees a partial row.
+    When no chunk arrives for `idle_timeout` seconds the lines end, so the import can pause (see `committed`) rather
+    than hold a job thread for an abandoned upload
+    """
+
+    def __init__(self, path: str, size: int, committed: Callable[[], int | None], poll_interval: float = 0.5,
+                 idle_timeout: float = 60.0, read_size: int = 1024 * 1024):
+        """
+        :param size: declared size of the upload, the lines end once it is read
+        :param committed: current committed offset of the upload
+        """
+        self._path: str = path
+        self._size: int = size
+        self._committed: Callable[[], int | None] = committed
+        self._poll_interval: float = poll_interval
+        self._idle_timeout: float = idle_timeout
+        self._read_size: int = read_size
+        # the committed offset last seen, everything before it was read
+        self.committed: int = 0
+
+    def __iter__(self) -> Iterator[str]:
+        rest = b""
+        quotes = 0  # an odd count means the last complete line ends inside a quoted field
+        idle_since = time.monotonic()
+        with open(self._path, "rb") as f:
+            while True:
+                if f.tell() < self.committed:
+                    data = rest + f.read(min(self._read_size, self.committed - f.tell()))
+                    if (end := data.rfind(b"\n") + 1) > 0:
+                        quotes += data.count(b'"', 0, end)
+                        # newline="" splits like the `open(..., newline="")` used for single request uploads
+                        yield from io.StringIO(data[:end].decode("utf-8"), newline="")
+                    rest = data[end:]
+                    idle_since = time.monotonic()
+                    continue
+                if self.committed == self._size:
+                    if rest:
+                        yield rest.decode("utf-8")
+                    return
+                if (committed := self._committed()) is not None and committed > self.committed:
+                    self.committed = committed
+                    continue
+                if time.monotonic() - idle_since >= self._idle_timeout:
+                    if quotes % 2:
+                        raise UploadStalledError("The upload stalled in the middle of a row")
+                    return
+                time.sleep(self._poll_interval)
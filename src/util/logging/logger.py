@@ -1,24 +1,116 @@
+import atexit
 import logging
 import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 import datetime
 from termcolor import colored
 from typing import Any
 
 
+class _ColoredFormatter(logging.Formatter):
+    """
+    Colors the message by level (or by the `color` attribute of the record). Only used for the console, the log
+    files get the plain message
+    """
+
+    _colors: dict[int, str] = {
+        logging.DEBUG: "white",
+        logging.INFO: "cyan",
+        logging.WARNING: "yellow",
+        logging.ERROR: "red",
+        logging.CRITICAL: "red",
+    }
+
+    def format(self, record: logging.LogRecord) -> str:
+        record = logging.makeLogRecord(record.__dict__)  # the other handlers see the same record
+        color = getattr(record, "color", None) or self._colors.get(record.levelno, "white")
+        record.msg, record.args = colored(record.getMessage(), color), None
+        return logging.Formatter.format(self, record)
+
+
+class _QueueBackend:
+    """
+    The handlers which do the actual I/O, shared by every `Logger` in the process. Loggers only put records on a
+    queue, which a background listener thread drains into the log files and the console, so logging never waits
+    for a write on the thread that logs
+    """
+
+    _lock: threading.Lock = threading.Lock()
+    _handler: QueueHandler | None = None
+    _listener: QueueListener | None = None
+
+    @classmethod
+    def handler(cls, log_directory: Path, format_string: str) -> QueueHandler:
+        with cls._lock:
+            if cls._handler is None:
+                cls._start(log_directory, format_string)
+            return cls._handler
+
+    @classmethod
+    def _start(cls, log_directory: Path, format_string: str) -> None:
+        log_directory.mkdir(parents=True, exist_ok=True)
+        date = datetime.datetime.now().strftime("%Y%m%d")
+        formatter = logging.Formatter(format_string)
+
+        # Levels are filtered by each logger, so apart from the error file these take everything they are given
+        file_handler = logging.FileHandler(log_directory / f"{date}.log", encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        error_file_handler = logging.FileHandler(log_directory / f"{date}-error.log", encoding='utf-8')
+        error_file_handler.setLevel(logging.ERROR)
+        error_file_handler.setFormatter(formatter)
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(_ColoredFormatter(format_string))
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        cls._handler = QueueHandler(log_queue)
+        cls._listener = QueueListener(
+            log_queue, file_handler, error_file_handler, console_handler, respect_handler_level=True
+        )
+        cls._listener.start()
+        atexit.register(cls.stop)
+
+    @classmethod
+    def stop(cls) -> None:
+        """
+        Flush the queued records and stop the listener thread
+        """
+        with cls._lock:
+            if cls._listener is not None:
+                cls._listener.stop()
+                cls._listener = None
+
+    @classmethod
+    def _after_fork(cls) -> None:
+        """
+        The listener thread does not survive a fork, so a forked child gets its own queue and listener over the same
+        handlers (whose locks `logging` itself resets)
+        """
+        cls._lock = threading.Lock()
+        if cls._listener is None:
+            return
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        cls._handler.queue = log_queue
+        cls._listener = QueueListener(log_queue, *cls._listener.handlers, respect_handler_level=True)
+        cls._listener.start()
+
+
+if hasattr(os, "register_at_fork"):  # not on Windows, which cannot fork anyway
+    os.register_at_fork(after_in_child=_QueueBackend._after_fork)
+
+
 class Logger:
     """
     Wrapper around the standard logging module with the boilerplate abstracted away.
+    Messages may be %-style format strings with their arguments passed separately (eg `logger.debug("Got %s", x)`),
+    in which case nothing is formatted unless the level is enabled. Prefer that over f-strings on hot paths
     """
     def __init__(self, name: str, level: int = logging.INFO) -> None:
-        log_directory = self._log_dir()
-        log_directory.mkdir(parents=True, exist_ok=True)
         self._level: int = level
 
         self._setup_logger(name, level)
-        self._setup_file_handlers(log_directory, level)
-        self._setup_console_handler(level)
-
 
     @staticmethod
     def _log_dir() -> Path:
@@ -27,58 +119,42 @@ class Logger:
         else:
             return Path("/var/log/resonanz/")
 
+    @staticmethod
+    def flush() -> None:
+        """
+        Write out the queued records and stop the listener thread, for a process which exits without running its
+        `atexit` handlers (eg a forked worker through `os._exit`)
+        """
+        _QueueBackend.stop()
+
     def new_from(self, name: str) -> 'Logger':
         """
         Create a new logger with the same configuration as this one, but with a different name. Useful for creating
-        child loggers for downstream components.
+        child loggers for downstream components. This is cheap, all loggers share the same handlers
         """
-        new_logger = Logger(name, level=self._level)
-        new_logger.logger.handlers = []  # Clear existing handlers
-        new_logger._setup_file_handlers(self._log_dir(), self._level)
-        new_logger._setup_console_handler(self._level)
-        return new_logger
+        return Logger(name, level=self._level)
 
     def _setup_logger(self, name: str, level: int) -> None:
         self.logger = logging.getLogger(name)
-        if not self.logger.hasHandlers():
-            self.logger.setLevel(level)
-
-    def _setup_file_handlers(self, log_directory: Path, level: int) -> None:
-        date = datetime.datetime.now().strftime("%Y%m%d")
-        file_handler = self._create_file_handler(log_directory / f"{date}.log", level)
-        error_file_handler = self._create_file_handler(log_directory / f"{date}-error.log", logging.ERROR)
-
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(error_file_handler)
+        self.logger.setLevel(level)
+        self.logger.propagate = False
+        self.logger.handlers = [_QueueBackend.handler(self._log_dir(), self._format_string())]
 
     @staticmethod
     def _format_string() -> str:
         return "%(asctime)s [%(levelname)s] [%(name)s] - %(message)s"
 
-    @classmethod
-    def _create_file_handler(cls, file_path: Path, level: int) -> logging.FileHandler:
-        file_handler = logging.FileHandler(file_path, encoding='utf-8')
-        file_handler.setLevel(level)
-        file_handler.setFormatter(logging.Formatter(cls._format_string()))
-        return file_handler
-
-    def _setup_console_handler(self, level: int) -> None:
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(level)
-        console_handler.setFormatter(logging.Formatter(self._format_string()))
-        self.logger.addHandler(console_handler)
-
-    def debug(self, message: Any) -> None:
-        self.logger.debug(colored(str(message), "white"))
+    def debug(self, message: Any, *args: Any) -> None:
+        self.logger.debug(message, *args)
 
-    def info(self, message: Any) -> None:
-        self.logger.info(colored(str(message), "cyan"))
+    def info(self, message: Any, *args: Any) -> None:
+        self.logger.info(message, *args)
 
-    def success(self, message: Any) -> None:
-        self.logger.info(colored(str(message), "green"))
+    def success(self, message: Any, *args: Any) -> None:
+        self.logger.info(message, *args, extra={"color": "green"})
 
-    def warning(self, message: Any) -> None:
-        self.logger.warning(colored(str(message), "yellow"))
+    def warning(self, message: Any, *args: Any) -> None:
+        self.logger.warning(message, *args)
 
-    def error(self, message: Any) -> None:
-        self.logger.error(colored(str(message), "red"))
+    def error(self, message: Any, *args: Any) -> None:
+        self.logger.error(message, *args)
@@ -0,0 +1,348 @@
+import bisect
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """
+    Base for a metric family: a name, help text, label names and one child per combination of label values
+    """
+
+    type_name: str = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name: str = name
+        self.help: str = help_text
+        self.label_names: tuple[str, ...] = labels
+        self._lock: threading.Lock = threading.Lock()
+        self._children: dict[tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+        values = tuple(str(v) for v in values)
+        if (child := self._children.get(values)) is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def snapshot(self) -> list[tuple[tuple[str, ...], Any]]:
+        """
+        :return: (label values, data) of every child, data being JSON serializable (see `_data`)
+        """
+        with self._lock:
+            children = list(self._children.items())
+        return [(values, self._data(child)) for values, child in children]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._children.clear()
+
+    def render(self, others: list[list[tuple[list[str], Any]]] = ()) -> Iterator[str]:
+        """
+        :param others: snapshots of this metric taken in other processes, added to this one's values
+        """
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type_name}"
+        merged = dict(self.snapshot())
+        for snapshot in others:
+            for values, data in snapshot:
+                values = tuple(values)
+                merged[values] = self._merge(merged[values], data) if values in merged else data
+        for values, data in sorted(merged.items()):
+            yield from self._render_data(values, data)
+
+    def _data(self, child: object) -> Any:
+        raise NotImplementedError
+
+    def _merge(self, data: Any, other: Any) -> Any:
+        raise NotImplementedError
+
+    def _render_data(self, values: tuple[str, ...], data: Any) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class _Value:
+
+    __slots__ = ('_lock', 'value', 'updated')
+
+    def __init__(self):
+        self._lock: threading.Lock = threading.Lock()
+        self.value: float = 0.0
+        self.updated: float = 0.0  # wall clock time of the last `set`, so gauges of several processes can be merged
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value, self.updated = value, time.time()
+
+
+class Counter(_Metric):
+
+    type_name = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def _data(self, child: _Value) -> float:
+        return child.value
+
+    def _merge(self, data: float, other: float) -> float:
+        return data + other
+
+    def _render_data(self, values: tuple[str, ...], data: float) -> Iterator[str]:
+        yield f"{self.name}{_format_labels(self.label_names, values)} {_format_value(data)}"
+
+
+class Gauge(Counter):
+    """
+    Across processes the most recently set value wins
+    """
+
+    type_name = "gauge"
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def _data(self, child: _Value) -> list[float]:
+        return [child.value, child.updated]
+
+    def _merge(self, data: list[float], other: list[float]) -> list[float]:
+        return max(data, other, key=lambda d: d[1])
+
+    def _render_data(self, values: tuple[str, ...], data: list[float]) -> Iterator[str]:
+        yield from Counter._render_data(self, values, data[0])
+
+
+class _HistogramValue:
+
+    __slots__ = ('_lock', '_bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self._lock: threading.Lock = threading.Lock()
+        self._bounds: tuple[float, ...] = bounds
+        self.counts: list[int] = [0] * (len(bounds) + 1)
+        self.sum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextlib.contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+
+    type_name = "histogram"
+
+    # seconds, suited to request and query latencies
+    DEFAULT_BUCKETS: tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        _Metric.__init__(self, name, help_text, labels)
+        self._bounds: tuple[float, ...] = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self._bounds)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> contextlib.AbstractContextManager:
+        return self.labels().time()
+
+    def _data(self, child: _HistogramValue) -> list:
+        with child._lock:
+            return [list(child.counts), child.sum]
+
+    def _merge(self, data: list, other: list) -> list:
+        return [[a + b for a, b in zip(data[0], other[0])], data[1] + other[1]]
+
+    def _render_data(self, values: tuple[str, ...], data: list) -> Iterator[str]:
+        counts, total = data
+        cumulative = 0
+        for bound, count in zip((*self._bounds, math.inf), counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            yield f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}"
+        yield f"{self.name}_sum{_format_labels(self.label_names, values)} {_format_value(total)}"
+        yield f"{self.name}_count{_format_labels(self.label_names, values)} {cumulative}"
+
+
+class MetricsRegistry:
+    """
+    Process-wide collection of metrics, rendered in the Prometheus text exposition format.
+    Metrics are created once (usually at import time) and updated with a lock per labelled child, so recording is
+    cheap enough to leave on in production.
+    Forked worker processes add up their metrics through a directory of snapshot files (see `share`)
+    """
+
+    CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._lock: threading.Lock = threading.Lock()
+        self._metrics: dict[str, _Metric] = {}
+        self._shared_dir: Path | None = None
+        self._snapshot_path: Path | None = None
+
+    def share(self, directory: Path, interval: float = 5.0) -> None:
+        """
+        Called in each forked worker process before it serves. The values inherited from the parent are dropped (every
+        worker would count them again), then a snapshot of this process' metrics is written to `directory` every
+        `interval` seconds and by `flush`, which the worker calls before it exits. `render` adds the snapshots of the
+        other processes to its own values, so they may be up to `interval` seconds behind. The snapshots of exited
+        processes are kept, so counters never go back
+        """
+        for metric in self._all():
+            metric.reset()
+        self._shared_dir = directory
+        self._snapshot_path = directory / f"{os.getpid()}.json"
+        self._write_snapshot()
+        threading.Thread(target=self._write_snapshots, args=(interval,), name="metrics-snapshots", daemon=True).start()
+
+    def flush(self) -> None:
+        """
+        Write the final snapshot of a worker sharing its metrics (see `share`)
+        """
+        if self._snapshot_path is not None:
+            self._write_snapshot()
+
+    def counter(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets=buckets))
+
+    def render(self) -> str:
+        others = self._read_snapshots()
+        lines = [
+            line for metric in self._all()
+            for line in metric.render([snapshot[metric.name] for snapshot in others if metric.name in snapshot])
+        ]
+        return "\n".join(lines) + "\n"
+
+    def _all(self) -> list[_Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def _write_snapshots(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            self._write_snapshot()
+
+    def _write_snapshot(self) -> None:
+        snapshot = {metric.name: metric.snapshot() for metric in self._all()}
+        # written next to the snapshot and renamed over it, so a reader never sees half of it
+        tmp_path = self._snapshot_path.with_name(f"{self._snapshot_path.name}.tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self._snapshot_path)
+        except OSError:
+            pass  # the directory is gone, the server is shutting down
+
+    def _read_snapshots(self) -> list[dict[str, list]]:
+        """
+        :return: the latest snapshots of the other processes sharing the metrics directory
+        """
+        if self._shared_dir is None:
+            return []
+        snapshots = []
+        for path in self._shared_dir.glob("*.json"):
+            if path == self._snapshot_path:
+                continue
+            try:
+                with open(path, "r") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # removed while listing
+        return snapshots
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            # Registering twice (eg a module imported again) returns the existing metric
+            if (existing := self._metrics.get(metric.name)) is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError(f"Metric {metric.name} is already registered as a {existing.type_name}")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+
+REGISTRY: MetricsRegistry = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "resonanz_http_requests_total", "HTTP requests handled, by route, method and status", ("route", "method", "status")
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "resonanz_http_request_duration_seconds", "Time spent in the view function, by route", ("route", "method")
+)
+DB_STATEMENT_SECONDS = REGISTRY.histogram(
+    "resonanz_db_statement_duration_seconds", "Database statement execution time, by statement type", ("operation",)
+)
+GEOCODER_CALL_SECONDS = REGISTRY.histogram(
+    "resonanz_geocoder_call_duration_seconds", "Latency of calls to the geocoding provider, excluding rate limiting",
+    ("backend",)
+)
+GEOCODER_ERRORS = REGISTRY.counter(
+    "resonanz_geocoder_errors_total", "Failed calls to the geocoding provider", ("backend",)
+)
+GEOCODER_HEDGED_CALLS = REGISTRY.counter(
+    "resonanz_geocoder_hedged_calls_total",
+    "Calls sent to a further geocoding backend because the previous one did not answer in time", ("backend",)
+)
+IMPORT_ROWS = REGISTRY.counter(
+    "resonanz_import_rows_total", "Imported CSV rows, by outcome", ("outcome",)
+)
+IMPORT_STAGE_SECONDS = REGISTRY.counter(
+    "resonanz_import_stage_seconds_total",
+    "Time spent by CSV imports in each stage (read: CSV parsing, geocode: address normalization summed over all "
+    "workers, write: database inserts)", ("stage",)
+)
+IMPORT_ROWS_PER_SECOND = REGISTRY.gauge(
+    "resonanz_import_rows_per_second", "Throughput of the most recently finished CSV import"
+)
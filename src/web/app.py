@@ -1,42 +1,116 @@
-import csv
+import contextvars
+import functools
 import json
-from datetime import timedelta
+import math
+import os
+import shutil
+import socket
+import tempfile
+import time
+import uuid
+from datetime import datetime
 from http import HTTPStatus
-from io import TextIOWrapper
-from typing import Callable
+from pathlib import Path
+from typing import Callable, Iterable
 
-from flask import Flask, render_template, request, Response, jsonify
+from flask import Flask, has_request_context, render_template, request, Response, jsonify
 
-from src.db.conn import Database
+from src.db.conn import Database, DatabaseReadError
 from src.db.model import AddressModel
-from src.geo.normalization import AddressParser, new_parser
+from src.geo.breaker import FailoverPolicy
+from src.geo.local import Gazetteer
+from src.geo.normalization import AddressParser, GeocodeCache, new_parser, raw_address_key
+from src.ingest import BatchImporter, ImportJobManager, UploadOffsetError
+from src.util import metrics
 from src.util.logging import Logger
 from src.util.meta import SingletonMeta
-from src.web.model import Address
+from src.web import compact, compression, export
+from src.web.assets import StaticAssets
+from src.web.cache import CachedResponse, QueryResultCache
+from src.web.prefork import PreforkServer
+from src.web.model import Address, ImportJob, Tenant
+
+# WSGI environ key under which the ASGI front end (see `asgi.AsgiApplication`) passes the addresses it already resolved
+# for a request: raw address -> `Address`, `None` or the `GeocoderUnavailableError` the geocoder raised
+PREFETCHED_ADDRESSES: str = "resonanz.prefetched_addresses"
 
 
 class Application(metaclass=SingletonMeta):
 
+    SERVER_WAITRESS = "waitress"
+    SERVER_ASGI = "asgi"
+    SERVERS = (SERVER_WAITRESS, SERVER_ASGI)
+
     _batch_size: int = 1024
 
+    # tenant search result formats besides `compact.FORMAT`
+    _JSON: str = "json"
+    _NDJSON: str = "ndjson"
+
+    # `/search/_nearby` defaults and limits: radius in metres, number of tenants returned
+    _nearby_radius: float = 1000
+    _nearby_max_radius: float = 100_000
+    _nearby_limit: int = 100
+    _nearby_max_limit: int = 1000
+
+    # seconds a versioned static URL (see `_static`) may be cached
+    _static_max_age: int = 60 * 60 * 24 * 365
+
+    # set on a client which has just written: until the time it holds, its reads go to the primary database rather
+    # than the replicas, which may not have the write yet
+    _READ_PRIMARY_COOKIE: str = "resonanz_read_primary_until"
+
     def __init__(self, logger: Logger, db: Database, port: int = 0,
-                 parser_engine: str = AddressParser.GOOGLE_MAPS, parser_api_key: str = None
-                 ):
-        self._app: Flask = Flask(__name__)
+                 parser_engine: str = AddressParser.GOOGLE_MAPS, parser_api_key: str = None,
+                 geocode_cache: GeocodeCache | None = None, parser_max_qps: float | None = None,
+                 import_workers: int = 8, import_jobs: int = 2, import_spool_dir: Path = Path("spool"),
+                 result_cache_size: int = 1024, threads: int = 8, parser_gazetteer: Gazetteer | None = None,
+                 workers: int = 1, compression_min_size: int = 1024, compression_level: int = 6,
+                 parser_failover: FailoverPolicy | None = None):
+        # static files are served from memory, see `_static`
+        self._app: Flask = Flask(__name__, static_folder=None)
         self._port: int = port
         self._db: Database = db
         self._address_parser: AddressParser = new_parser(
-            parser_engine, logger=logger.new_from("ADDRESS_PARSER"), api_key=parser_api_key
+            parser_engine, logger=logger.new_from("ADDRESS_PARSER"), cache=geocode_cache, max_qps=parser_max_qps,
+            api_key=parser_api_key, gazetteer=parser_gazetteer, failover=parser_failover
         )
         self._logger: Logger = logger
+        self._geocode_cache: GeocodeCache | None = geocode_cache
+        # the ASGI server mode builds an async parser with the same settings
+        self._parser_options: dict = dict(engine=parser_engine, api_key=parser_api_key, max_qps=parser_max_qps,
+                                          gazetteer=parser_gazetteer, failover=parser_failover)
+        self._import_workers: int = import_workers
+        self._threads: int = threads
+        self._workers: int = workers
+        # where the forked workers add up their metrics (see `metrics.MetricsRegistry.share`)
+        self._metrics_dir: Path | None = None
+        self._compression_min_size: int = compression_min_size
+        self._compression_level: int = compression_level
+        self._static_assets: StaticAssets = StaticAssets.from_directory(
+            Path(__file__).parent / "static", logger.new_from("STATIC_ASSETS")
+        )
+        self._result_cache: QueryResultCache = QueryResultCache(max_size=result_cache_size)
+        # part of every ETag, so tags handed out before a restart never match (the database may have been replaced
+        # meanwhile, and its generation started over)
+        self._instance_id: str = uuid.uuid4().hex[:8]
+        self._import_jobs: ImportJobManager = ImportJobManager(
+            self._new_importer, db, logger.new_from("IMPORT_JOBS"), spool_dir=import_spool_dir, max_jobs=import_jobs
+        )
+        self._views: dict[Callable, Callable] = {}
         self._configure()
         self._route_all()
+        if self._workers <= 1:
+            # with several workers the first one does this, the parent must not have threads running when it forks
+            self._import_jobs.resume_unfinished()
 
     def _configure(self):
-        # avoid reading the file from disk each time
-        self._app.config['SEND_FILE_MAX_AGE_DEFAULT'] = timedelta(seconds=60 * 60 * 24 * 365)
+        self._app.url_defaults(self._static_url_defaults)
+        if self._compression_level > 0:
+            self._app.after_request(self._compress)
 
     def _route_all(self):
+        self._route("/static/<path:filename>", self._static, endpoint="static")
         self._route("/", self.search)
         self._route("/search", self.search, endpoint="search")
         self._route("/insert", self.insert, endpoint="insert")
@@ -44,16 +118,26 @@ class Application(metaclass=SingletonMeta):
         # these are named a bit weird because basically you search addresses to find tenants and vice-versa
         self._route("/search/_addresses", self._search_addresses_by_tenant)
         self._route("/search/_tenants", self._search_tenants_by_address)
+        self._route("/search/_export", self._export)
+        self._route("/search/_nearby", self._search_nearby)
 
         self._route("/insert/_tenant", self._add_entry, methods=["POST"])
         self._route("/insert/_batch", self._batch_insert, methods=["POST"])
+        self._route("/insert/_uploads", self._create_upload, methods=["POST"])
+        self._route("/insert/_uploads/<job_id>", self._upload, methods=["GET", "PUT"])
+        self._route("/insert/_jobs/<job_id>", self._import_job_status)
 
-    def run(self, port: int = 0, debug: bool = False):
+        self._route("/status/_geocoder", self._geocoder_status)
+        self._route("/status/_database", self._database_status)
+        self._route("/metrics", self._metrics)
+
+    def run(self, port: int = 0, debug: bool = False, server: str = SERVER_WAITRESS):
         """
         Run the application. If no port is specified, the port from the constructor is used. If no port is specified
         in the constructor, port 80 is used.
         If debug is True, the application is run in debug mode (raw flask). Otherwise, the application is run in
-        production mode (waitress WSGI server)
+        production mode, by waitress (WSGI, one thread per request) or by uvicorn (ASGI, see `asgi_app`), in `workers`
+        processes forked from this one (see `prefork.PreforkServer`)
         """
         if not port:
             if not self._port:
@@ -63,18 +147,111 @@ class Application(metaclass=SingletonMeta):
         if debug:
             self._logger.info(f"Running in debug mode (raw flask) on {port=}")
             return self._app.run(host="0.0.0.0", port=port, debug=False)
+        serve = self._serve_asgi if server == self.SERVER_ASGI else self._serve_waitress
+        self._logger.info(f"Running in production mode ({server}) on {port=} with {self._workers} worker(s) of "
+                          f"{self._threads} threads")
+        if self._workers <= 1:
+            return serve(port=port)
+        self._metrics_dir = Path(tempfile.mkdtemp(prefix="resonanz-metrics-"))
+        parent_pid = os.getpid()
+        try:
+            PreforkServer(lambda sock: serve(sock=sock), self._logger.new_from("PREFORK"), port=port,
+                          workers=self._workers, on_worker_start=self._on_worker_start,
+                          on_worker_exit=self._on_worker_exit).run()
+        finally:
+            # the workers never get here (see `PreforkServer._spawn`), the directory is theirs until they are all gone
+            if os.getpid() == parent_pid:
+                shutil.rmtree(self._metrics_dir, ignore_errors=True)
+
+    def _serve_waitress(self, port: int = 0, sock: socket.socket | None = None):
         import waitress
-        self._logger.info(f"Running in production mode (waitress) on {port=}")
-        waitress.serve(self._app, host="0.0.0.0", port=port)
+        listen = dict(sockets=[sock]) if sock else dict(host="0.0.0.0", port=port)
+        waitress.serve(self._app, threads=self._threads, **listen)
+
+    def _serve_asgi(self, port: int = 0, sock: socket.socket | None = None):
+        try:
+            import uvicorn
+        except ImportError:
+            self._logger.error("The ASGI server mode needs the `asgi` extra (uvicorn, httpx)")
+            raise
+        listen = {} if sock else dict(host="0.0.0.0", port=port)
+        uvicorn.Server(uvicorn.Config(self.asgi_app(), log_config=None, **listen)).run(sockets=[sock] if sock else None)
+
+    def _on_worker_start(self, worker: int, first_start: bool):
+        """
+        Runs in each forked worker before it serves. Pooled connections are the parent's, and imports which were
+        interrupted by the last shutdown are resumed by the first worker (once, a restarted worker must not pick up
+        the jobs the others are running)
+        """
+        self._db.dispose_after_fork()
+        metrics.REGISTRY.share(self._metrics_dir)
+        if worker == 0 and first_start:
+            self._import_jobs.resume_unfinished()
+
+    @staticmethod
+    def _on_worker_exit(_worker: int):
+        """
+        Runs in each forked worker once it stopped serving
+        """
+        metrics.REGISTRY.flush()
+
+    def asgi_app(self):
+        """
+        The application as an ASGI app: geocoding is done on the event loop with the async backends (sharing the
+        geocode cache with the blocking ones), everything else runs on `threads` worker threads
+        """
+        from src.geo.aio import new_async_parser
+        from src.web.asgi import AsgiApplication
+
+        options = dict(self._parser_options)
+        parser = new_async_parser(
+            options.pop("engine"), logger=self._logger.new_from("ASYNC_ADDRESS_PARSER"), cache=self._geocode_cache,
+            **options
+        )
+        return AsgiApplication(self._app, parser, self._needs_geocoding, logger=self._logger.new_from("ASGI"),
+                               threads=self._threads)
+
+    def _needs_geocoding(self, environ: dict) -> bool:
+        """
+        Whether the route of a request would geocode its raw address, which the ASGI front end then does ahead of it
+        on the event loop (see `PREFETCHED_ADDRESSES`). The searches do not if they are answered with a 304 or from
+        the result cache (see `_versioned`), or if the address is a known alias. Runs on a pool thread, with the reads
+        the route itself would make (replicas included)
+        """
+        with self._app.request_context(environ):
+            context = contextvars.copy_context()
+            if self._db.has_replicas and self._reads_from_primary():
+                context.run(Database.read_from_primary)
+            try:
+                return context.run(self._route_geocodes, request.args.get("address"))
+            except DatabaseReadError:
+                return False  # the route answers with the error
+
+    def _route_geocodes(self, raw_address: str | None) -> bool:
+        match request.path:
+            case "/search/_tenants":
+                return (not self._is_cached(self._tenants_query_key())
+                        and self._db.get_address_id(raw_address=raw_address) is None)
+            case "/search/_nearby":
+                return not request.args.get("bbox") and not self._is_cached(self._nearby_query_key())
+            case "/search/_export":
+                return self._db.get_address_id(raw_address=raw_address) is None
+        return True
 
     def _parse_address(self, raw_address: str) -> Address:
         if not raw_address:
             raise ValueError("No address specified")
 
-        self._logger.debug(f"Got request to normalize address: `{raw_address}`")
-        if not (address := self._address_parser.normalize(raw_address)):
+        self._logger.debug("Got request to normalize address: `%s`", raw_address)
+        prefetched = request.environ.get(PREFETCHED_ADDRESSES, {}) if has_request_context() else {}
+        if raw_address in prefetched:
+            if isinstance(address := prefetched[raw_address], Exception):
+                raise address
+        else:
+            address = self._address_parser.normalize(raw_address)
+        if not address:
             raise ValueError(f"Could not normalize address: `{address}`")
-        self._logger.debug(f"Normalized address `{raw_address}` to `{address}`")
+        self._logger.debug("Normalized address `%s` to `%s`", raw_address, address)
         return address
 
     def _add_entry(self):
@@ -85,9 +262,25 @@ class Application(metaclass=SingletonMeta):
             address = self._parse_address(raw_address)
         except ValueError as e:
             return self._err_json_response(HTTPStatus.BAD_REQUEST, f"Could not normalize address {raw_address}: `{e}`")
-        if not (result := self._db.new_tenant(address=address, tenant_name=tenant_name)):
+        if not (result := self._db.new_tenant(address=address, tenant_name=tenant_name, raw_address=raw_address)):
             return self._err_json_response(HTTPStatus.INTERNAL_SERVER_ERROR, f"Could not insert tenant `{tenant_name}` into database")
-        return jsonify(result), HTTPStatus.CREATED
+        return self._read_your_writes(jsonify(result)), HTTPStatus.CREATED
+
+    def _read_your_writes(self, response: Response) -> Response:
+        """
+        Send the following reads of this client to the primary database for as long as the replicas may lag behind
+        """
+        if self._db.has_replicas:
+            lag = self._db.replica_lag_seconds
+            response.set_cookie(self._READ_PRIMARY_COOKIE, str(time.time() + lag), max_age=math.ceil(lag),
+                                httponly=True, samesite="Lax")
+        return response
+
+    def _reads_from_primary(self) -> bool:
+        try:
+            return float(request.cookies.get(self._READ_PRIMARY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
 
     def _batch_insert(self):
         if 'file' not in request.files:
@@ -97,66 +290,380 @@ class Application(metaclass=SingletonMeta):
         if file.filename == '':
             return self._err_json_response(HTTPStatus.BAD_REQUEST, "No selected file")
 
-        batch = []
-        success_count = 0
-        failure_count = 0
-
-        # Process the file line by line
-        text_stream = TextIOWrapper(file.stream, encoding='utf-8')
-        csv_reader = csv.reader(text_stream)
-        for i, row in enumerate(csv_reader):
-            if i == 0:
-                continue
-            if len(row) != 2:
-                failure_count += 1
-                self._logger.warning(f"Skipping row {i} because it does not have exactly 2 columns")
-                continue
-
-            tenant_name, raw_address = row
-            try:
-                address = self._parse_address(raw_address)
-                batch.append((tenant_name, address))
-            except ValueError:
-                self._logger.warning(f"Skipping row {i} because could not normalize address `{raw_address}`")
-                failure_count += 1
-
-            if len(batch) >= self._batch_size:
-                pending = len(batch)
-                successful = self._db.batch_insert_tenants(batch)
-                success_count += successful
-                failure_count += pending - successful
-                batch.clear()
-
-        if batch:
-            pending = len(batch)
-            successful = self._db.batch_insert_tenants(batch)
-            success_count += successful
-            failure_count += pending - successful
-        text_stream.close()
-        status = HTTPStatus.CREATED if failure_count == 0 else HTTPStatus.PARTIAL_CONTENT
-        return jsonify({"success": success_count, "failed": failure_count}), status
+        # The file is spooled to disk and imported in the background, the client polls the job for progress
+        job = self._import_jobs.submit(file.stream, file.filename)
+        status_url = f"/insert/_jobs/{job.id}"
+        return jsonify({"job_id": job.id, "status_url": status_url}), HTTPStatus.ACCEPTED, {"Location": status_url}
+
+    def _create_upload(self):
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not (filename := data.get("filename")) or not isinstance(filename, str):
+            return self._err_json_response(HTTPStatus.BAD_REQUEST, "Missing `filename`")
+        if not isinstance(size := data.get("size"), int) or isinstance(size, bool) or size <= 0:
+            return self._err_json_response(HTTPStatus.BAD_REQUEST, "`size` must be a positive integer")
+        job = self._import_jobs.create_upload(filename, size)
+        upload_url = f"/insert/_uploads/{job.id}"
+        return jsonify(self._upload_state(job)), HTTPStatus.CREATED, {"Location": upload_url}
+
+    def _upload(self, job_id: str):
+        """
+        GET: where to resume the upload. PUT: a chunk, with its `offset` as query parameter and optionally its SHA-256
+        (hex) in the `X-Chunk-Sha256` header
+        """
+        if not (job := self._import_jobs.get(job_id)) or not job.chunked:
+            return self._err_json_response(HTTPStatus.NOT_FOUND, f"No upload with ID `{job_id}`")
+        if request.method == "GET":
+            return jsonify(self._upload_state(job))
+
+        try:
+            if (offset := self._int_arg("offset")) is None:
+                raise ValueError("Missing `offset`")
+        except ValueError as e:
+            return self._err_json_response(HTTPStatus.BAD_REQUEST, str(e))
+        if (request.content_length or 0) > (max_size := self._import_jobs.max_upload_chunk_size):
+            return self._err_json_response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                           f"Chunks must not be larger than {max_size} bytes")
+        if job.finished:
+            return self._err_json_response(HTTPStatus.CONFLICT, f"Import job `{job_id}` is {job.status}")
+        try:
+            job.uploaded_bytes = self._import_jobs.write_chunk(
+                job, offset, request.get_data(cache=False), sha256=request.headers.get("X-Chunk-Sha256")
+            )
+        except UploadOffsetError as e:
+            job.uploaded_bytes = e.offset
+            return jsonify({"error": str(e), **self._upload_state(job)}), HTTPStatus.CONFLICT
+        except ValueError as e:
+            return self._err_json_response(HTTPStatus.BAD_REQUEST, str(e))
+        response = jsonify(self._upload_state(job))
+        # the last rows are imported from here on, the client is likely to search for them next
+        return self._read_your_writes(response) if job.uploaded_bytes == job.upload_size else response
+
+    def _upload_state(self, job: ImportJob) -> dict:
+        return {
+            "job_id": job.id,
+            "upload_url": f"/insert/_uploads/{job.id}",
+            "status_url": f"/insert/_jobs/{job.id}",
+            "offset": job.uploaded_bytes,
+            "size": job.upload_size,
+            "chunk_size": self._import_jobs.upload_chunk_size,
+        }
+
+    def _import_job_status(self, job_id: str) -> Response:
+        if not (job := self._import_jobs.get(job_id)):
+            return self._err_json_response(HTTPStatus.NOT_FOUND, f"No import job with ID `{job_id}`")
+        try:
+            offset = self._int_arg("failures_offset") or 0
+            limit = self._int_arg("failures_limit")
+        except ValueError as e:
+            return self._err_json_response(HTTPStatus.BAD_REQUEST, str(e))
+        result = job.to_dict(now=datetime.utcnow())
+        result["failures"] = [
+            {"row": row, "reason": reason}
+            for row, reason in self._import_jobs.failures(job_id, offset=offset, limit=100 if limit is None else limit)
+        ]
+        # imports (including the ones of `/insert/_batch`) write in the background, their client sees the rows
+        # once it polls here
+        response = jsonify(result)
+        return self._read_your_writes(response) if job.success else response
+
+    def _new_importer(self) -> BatchImporter:
+        return BatchImporter(
+            self._parse_address, self._db, self._logger.new_from("IMPORTER"),
+            workers=self._import_workers, batch_size=self._batch_size
+        )
 
     def _search_tenants_by_address(self) -> Response:
-        if not (raw_address := request.args.get("address")):
-            result = self._db.get_all_tenants()
-        else:
+        raw_address = request.args.get("address")
+        return self._versioned(self._tenants_query_key(), lambda: self._find_tenants_by_address(raw_address))
+
+    @staticmethod
+    def _tenants_query_key() -> tuple:
+        raw_address = request.args.get("address")
+        return "tenants", raw_address_key(raw_address) if raw_address else None
+
+    def _find_tenants_by_address(self, raw_address: str | None) -> Response:
+        if not raw_address:
+            return self._all_tenants_response()
+        if (result := self._db.get_tenants_by_alias(raw_address)) is None:
+            # only geocode inputs we have never seen before
             try:
                 address = self._parse_address(raw_address)
             except ValueError as e:
                 return self._err_json_response(HTTPStatus.BAD_REQUEST, f"Could not normalize address {raw_address}: `{e}`")
 
-            result = self._db.get_tenants_at_address(address=address)
+            result = self._db.get_tenants_at_address(address=address, raw_address=raw_address)
 
-        return jsonify([tenant.to_dict() for tenant in result])
+        return self._tenants_response(result)
 
     def _search_addresses_by_tenant(self) -> Response:
-        if not (tenant_name := request.args.get("name")):
-            result = self._db.get_all_tenants()
+        if (mode := request.args.get("mode", Database.SEARCH_EXACT)) not in Database.SEARCH_MODES:
+            return self._err_json_response(HTTPStatus.BAD_REQUEST, f"Unknown search mode `{mode}`")
+        tenant_name = request.args.get("name")
+        query_key = ("addresses", tenant_name.lower() if tenant_name else None, mode)
+        return self._versioned(query_key, lambda: self._find_addresses_by_tenant(tenant_name, mode))
+
+    def _find_addresses_by_tenant(self, tenant_name: str | None, mode: str) -> Response:
+        if not tenant_name:
+            return self._all_tenants_response()
+        result = self._db.get_addresses_for_tenant_name(tenant_name=tenant_name, mode=mode)
+
+        self._logger.debug("Got addresses for tenant `%s`: %s", tenant_name, result)
+        return self._tenants_response(result)
+
+    def _search_nearby(self) -> Response:
+        """
+        Tenants around a point (`lat` & `lon`, or an `address`) within `radius` metres, or inside a `bbox` of
+        `min_lat,min_lon,max_lat,max_lon`, nearest first
+        """
+        return self._versioned(self._nearby_query_key(), self._find_nearby)
+
+    @staticmethod
+    def _nearby_query_key() -> tuple:
+        return ("nearby", *(request.args.get(arg) for arg in ("lat", "lon", "radius", "bbox")),
+                raw_address_key(request.args.get("address", "")))
+
+    def _find_nearby(self) -> Response:
+        try:
+            limit = min(self._int_arg("limit") or self._nearby_limit, self._nearby_max_limit)
+            if bbox := request.args.get("bbox"):
+                try:
+                    min_lat, min_lon, max_lat, max_lon = (float(v) for v in bbox.split(","))
+                except ValueError:
+                    raise ValueError("`bbox` must be `min_lat,min_lon,max_lat,max_lon`")
+                if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+                    raise ValueError("`bbox` is out of range")
+                return self._nearby_response(self._db.get_tenants_in_box((min_lat, min_lon, max_lat, max_lon), limit))
+
+            radius = self._float_arg("radius") or self._nearby_radius
+            if not 0 < radius <= self._nearby_max_radius:
+                raise ValueError(f"`radius` must be between 0 and {self._nearby_max_radius} metres")
+            if raw_address := request.args.get("address"):
+                location = self._locate(raw_address)
+            else:
+                location = self._float_arg("lat"), self._float_arg("lon")
+                if None in location or not (-90 <= location[0] <= 90 and -180 <= location[1] <= 180):
+                    raise ValueError("Either `address`, `lat` and `lon` or `bbox` is required")
+        except ValueError as e:
+            return self._err_json_response(HTTPStatus.BAD_REQUEST, str(e))
+        return self._nearby_response(self._db.get_tenants_near(*location, radius_m=radius, limit=limit))
+
+    def _locate(self, raw_address: str) -> tuple[float, float]:
+        address = self._parse_address(raw_address)
+        if address.lat is not None and address.lon is not None:
+            return address.lat, address.lon
+        if (location := self._db.get_address_location(address)) is None:
+            raise ValueError(f"No coordinates are known for address `{address.full_address}`")
+        return location
+
+    @staticmethod
+    def _nearby_response(result: list[tuple[Tenant, float]]) -> Response:
+        return jsonify([{**tenant.to_dict(), "distance_m": round(distance, 1)} for tenant, distance in result])
+
+    def _export(self) -> Response:
+        """
+        Stream the results of either search (same query params) grouped by address, see `export.FORMATS`
+        """
+        if (fmt := request.args.get("format", export.TEXT)) not in export.FORMATS:
+            return self._err_json_response(HTTPStatus.BAD_REQUEST, f"Unknown export format `{fmt}`")
+        if (mode := request.args.get("mode", Database.SEARCH_EXACT)) not in Database.SEARCH_MODES:
+            return self._err_json_response(HTTPStatus.BAD_REQUEST, f"Unknown search mode `{mode}`")
+
+        address_id = None
+        if raw_address := request.args.get("address"):
+            if (address_id := self._db.get_address_id(raw_address=raw_address)) is None:
+                try:
+                    address = self._parse_address(raw_address)
+                except ValueError as e:
+                    return self._err_json_response(HTTPStatus.BAD_REQUEST, f"Could not normalize address {raw_address}: `{e}`")
+                address_id = self._db.get_address_id(address=address, raw_address=raw_address)
+
+        if raw_address and address_id is None:
+            tenants = iter(())
         else:
-            result = self._db.get_addresses_for_tenant_name(tenant_name=tenant_name)
+            tenants = self._db.iter_tenants_by_address(address_id=address_id, tenant_name=request.args.get("name"), mode=mode)
+        mimetype, extension = export.FORMATS[fmt]
+        return Response(
+            export.export(tenants, fmt), mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment; filename=search_results.{extension}"}
+        )
+
+    def _versioned(self, query_key: tuple, build: Callable[[], Response]) -> Response:
+        """
+        Serve a search through the result cache. Successful responses carry an ETag derived from the database
+        generation, so a client (or proxy) revalidating with `If-None-Match` gets a 304 without the query, or any
+        geocoding, being run again. A failed database read is answered with a 503, which is neither cached nor tagged
+        """
+        try:
+            return self._versioned_response(query_key, build)
+        except DatabaseReadError as e:
+            return self._err_json_response(HTTPStatus.SERVICE_UNAVAILABLE, str(e))
+
+    def _versioned_response(self, query_key: tuple, build: Callable[[], Response]) -> Response:
+        if self._db.reads_may_lag:
+            # a replica may answer without the latest writes, which must not be cached under the current generation
+            response = build()
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        generation, etag, key = self._version(query_key)
+        # weak comparison, compressed responses carry the weak form of the tag (see `_compress`)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=HTTPStatus.NOT_MODIFIED)
+        elif cached := self._result_cache.get(key, generation):
+            response = Response(cached.body, mimetype=cached.mimetype, headers=list(cached.headers))
+        else:
+            response = build()
+            if response.status_code != HTTPStatus.OK:
+                return response
+            if not response.is_streamed:
+                extra_headers = tuple((k, v) for k, v in response.headers.items() if k.startswith("X-"))
+                self._result_cache.put(key, generation, CachedResponse(
+                    body=response.get_data(), mimetype=response.mimetype, headers=extra_headers
+                ))
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept")
+        return response
+
+    def _version(self, query_key: tuple) -> tuple[int, str, tuple]:
+        """
+        :return: the database generation, the ETag of the search response and its result cache key
+        """
+        generation = self._db.generation
+        fmt = self._response_format()
+        key = (*query_key, fmt, request.args.get("limit"), request.args.get("after_id"))
+        return generation, f"{self._instance_id}-{generation}-{fmt}", key
+
+    def _is_cached(self, query_key: tuple) -> bool:
+        """
+        Whether `_versioned` answers a search without running it: with a 304 or from the result cache
+        """
+        if self._db.reads_may_lag:
+            return False
+        generation, etag, key = self._version(query_key)
+        return request.if_none_match.contains_weak(etag) or self._result_cache.contains(key, generation)
+
+    def _all_tenants_response(self) -> Response:
+        """
+        Empty searches list every tenant. The result can be paged with `?limit=N&after_id=M` (ordered by tenant ID,
+        the ID to continue from is sent back in the `X-Next-After-Id` header) and/or streamed as NDJSON
+        """
+        try:
+            limit = self._int_arg("limit")
+            after_id = self._int_arg("after_id")
+        except ValueError as e:
+            return self._err_json_response(HTTPStatus.BAD_REQUEST, str(e))
 
-        self._logger.debug(f"Got addresses for tenant `{tenant_name}`: {result}")
-        return jsonify([tenant.to_dict() for tenant in result])
+        if self._response_format() == self._NDJSON:
+            return self._ndjson_response(self._db.iter_all_tenants(limit=limit, after_id=after_id))
+        result = self._db.get_all_tenants(limit=limit, after_id=after_id)
+        response = self._tenants_response(result)
+        if limit and len(result) == limit:
+            response.headers["X-Next-After-Id"] = str(result[-1].id)
+        return response
+
+    def _tenants_response(self, tenants: list[Tenant]) -> Response:
+        match self._response_format():
+            case self._NDJSON:
+                return self._ndjson_response(tenants)
+            case compact.FORMAT:
+                return Response(compact.encode_tenants(tenants), mimetype=compact.MIMETYPE)
+        return jsonify([tenant.to_dict() for tenant in tenants])
+
+    @classmethod
+    def _response_format(cls) -> str:
+        """
+        Format of tenant search results: `json` (default), `ndjson` (streamed) or `compact` (see `compact`), chosen
+        with `?format=` or the `Accept` header
+        """
+        if (fmt := request.args.get("format")) in (cls._NDJSON, compact.FORMAT):
+            return fmt
+        if not fmt:
+            match request.accept_mimetypes.best:
+                case "application/x-ndjson":
+                    return cls._NDJSON
+                case compact.MIMETYPE:
+                    return compact.FORMAT
+        return cls._JSON
+
+    @staticmethod
+    def _ndjson_response(tenants: Iterable[Tenant]) -> Response:
+        return Response((json.dumps(tenant.to_dict()) + "\n" for tenant in tenants), mimetype="application/x-ndjson")
+
+    @staticmethod
+    def _float_arg(name: str) -> float | None:
+        if (value := request.args.get(name)) is None or value == "":
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            raise ValueError(f"`{name}` must be a number, got `{value}`")
+
+    @staticmethod
+    def _int_arg(name: str) -> int | None:
+        if (value := request.args.get(name)) is None or value == "":
+            return None
+        if not value.isdigit():
+            raise ValueError(f"`{name}` must be a non-negative integer, got `{value}`")
+        return int(value)
+
+    def _geocoder_status(self) -> Response:
+        return jsonify(self._address_parser.stats())
+
+    def _metrics(self) -> Response:
+        return Response(metrics.REGISTRY.render(), content_type=metrics.REGISTRY.CONTENT_TYPE)
+
+    def _database_status(self) -> Response:
+        return jsonify({"pool": self._db.pool_stats(), "replicas": self._db.replica_stats(),
+                        "result_cache": self._result_cache.stats()})
+
+    def _static(self, filename: str) -> Response:
+        """
+        Serve a static file from memory, gzipped if the client accepts it. URLs built with `url_for` carry the
+        content hash (`?v=`), which makes them safe to cache for good, anything else is revalidated by ETag
+        """
+        if (asset := self._static_assets.get(filename)) is None:
+            return self._err_json_response(HTTPStatus.NOT_FOUND, f"No static file `{filename}`")
+        if request.if_none_match.contains(asset.version):
+            response = Response(status=HTTPStatus.NOT_MODIFIED)
+        elif asset.gzip_body is not None and request.accept_encodings[compression.GZIP]:
+            response = Response(asset.gzip_body, mimetype=asset.mimetype, headers={"Content-Encoding": compression.GZIP})
+        else:
+            response = Response(asset.body, mimetype=asset.mimetype)
+        response.set_etag(asset.version)
+        if request.args.get("v") == asset.version:
+            response.headers["Cache-Control"] = f"public, max-age={self._static_max_age}, immutable"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def _static_url_defaults(self, endpoint: str, values: dict) -> None:
+        if endpoint == "static" and (asset := self._static_assets.get(values.get("filename", ""))) is not None:
+            values.setdefault("v", asset.version)
+
+    def _compress(self, response: Response) -> Response:
+        """
+        gzip responses of compressible types when the client accepts it. Bodies below the size threshold are sent
+        as they are, streamed responses (whose size is unknown) are compressed as they are produced
+        """
+        if (response.status_code != HTTPStatus.OK or "Content-Encoding" in response.headers
+                or not compression.compressible(response.mimetype)):
+            return response
+        response.vary.add("Accept-Encoding")
+        if not request.accept_encodings[compression.GZIP]:
+            return response
+        if response.is_streamed:
+            response.response = compression.compress_stream(response.response, self._compression_level)
+            response.headers.pop("Content-Length", None)
+        elif response.content_length is not None and response.content_length < self._compression_min_size:
+            return response
+        else:
+            response.set_data(compression.compress(response.get_data(), self._compression_level))
+        response.headers["Content-Encoding"] = compression.GZIP
+        # the bytes differ from the uncompressed representation, but not what they mean
+        if (etag := response.get_etag()[0]) is not None:
+            response.set_etag(etag, weak=True)
+        return response
 
     def search(self) -> Response:
         return Response(render_template("search.html"))
@@ -165,11 +672,61 @@ class Application(metaclass=SingletonMeta):
         return Response(render_template("insert.html"))
 
     def _route(self, path: str, view_function: Callable, methods: list[str] = None, endpoint: str = None):
+        if view_function not in self._views:
+            # One wrapper per view, Flask refuses to map an endpoint to a second function
+            self._views[view_function] = self._instrumented(view_function)
         self._app.add_url_rule(
             path,
-            view_func=view_function, methods=methods or ["GET"], endpoint=endpoint
+            view_func=self._views[view_function], methods=methods or ["GET"], endpoint=endpoint
         )
 
+    def _instrumented(self, view_function: Callable) -> Callable:
+        """
+        Count requests and time the view function (for streamed responses, until the response starts) per route
+        """
+        @functools.wraps(view_function)
+        def view(*args, **kwargs):
+            started = time.perf_counter()
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            try:
+                if self._db.has_replicas and self._reads_from_primary():
+                    response = self._in_primary_reads_context(view_function, *args, **kwargs)
+                else:
+                    response = self._app.make_response(view_function(*args, **kwargs))
+                status = response.status_code
+                return response
+            finally:
+                route = request.url_rule.rule
+                metrics.HTTP_REQUEST_SECONDS.labels(route, request.method).observe(time.perf_counter() - started)
+                metrics.HTTP_REQUESTS.labels(route, request.method, int(status)).inc()
+        return view
+
+    def _in_primary_reads_context(self, view_function: Callable, *args, **kwargs) -> Response:
+        """
+        Run a view with its reads sent to the primary database (see `Database.read_from_primary`), including the reads
+        of a streamed response, which happen after the view returned
+        """
+        context = contextvars.copy_context()
+        context.run(Database.read_from_primary)
+        response = context.run(lambda: self._app.make_response(view_function(*args, **kwargs)))
+        if response.is_streamed:
+            response.response = self._iter_in_context(context, response.response)
+        return response
+
+    @staticmethod
+    def _iter_in_context(context: contextvars.Context, chunks: Iterable) -> Iterable:
+        chunks = iter(chunks)
+        try:
+            while True:
+                try:
+                    chunk = context.run(next, chunks)
+                except StopIteration:
+                    return
+                yield chunk
+        finally:
+            if hasattr(chunks, "close"):
+                context.run(chunks.close)
+
     def _err_json_response(self, status: int, message: str) -> Response:
-        self._logger.debug(f"sending back error response ({status}): {message}")
+        self._logger.debug("sending back error response (%s): %s", status, message)
         return Response(json.dumps({"error": message}), status=status, mimetype="application/json")
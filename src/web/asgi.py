@@ -0,0 +1,205 @@
+import asyncio
+import io
+import json
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, IO
+from urllib.parse import parse_qs
+
+from flask import Flask
+
+from src.geo.aio import AsyncAddressParser
+from src.geo.normalization import GeocoderUnavailableError
+from src.util.logging import Logger
+from src.web.app import PREFETCHED_ADDRESSES
+from src.web.model import Address
+
+Scope = dict[str, Any]
+Message = dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+
+class AsgiApplication:
+    """
+    ASGI front end of the Flask application. Requests which carry a raw address are geocoded on the event loop
+    first (unless `needs_geocoding` tells that the route would not, eg for a known alias), and the result is handed to
+    the route through the WSGI environ (see `PREFETCHED_ADDRESSES`), so a request waiting on the provider holds no
+    thread. The routes themselves then run unchanged on a small thread pool, where they only wait for the database
+    """
+
+    # path -> where the raw address is: a query parameter or a field of the JSON body
+    _geocoded_paths: dict[str, str] = {
+        "/search/_tenants": "query",
+        "/search/_export": "query",
+        "/search/_nearby": "query",
+        "/insert/_tenant": "json",
+    }
+    # request bodies larger than this are spooled to disk (CSV uploads)
+    _max_body_in_memory: int = 1024 * 1024
+
+    def __init__(self, app: Flask, parser: AsyncAddressParser, needs_geocoding: Callable[[dict[str, Any]], bool],
+                 logger: Logger, threads: int = 8):
+        """
+        :param needs_geocoding: called on a pool thread with the WSGI environ of a request carrying a raw address
+        """
+        self._app: Flask = app
+        self._parser: AsyncAddressParser = parser
+        self._needs_geocoding: Callable[[dict[str, Any]], bool] = needs_geocoding
+        self._logger: Logger = logger
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        match scope["type"]:
+            case "http":
+                await self._http(scope, receive, send)
+            case "lifespan":
+                await self._lifespan(receive, send)
+            case other:
+                raise NotImplementedError(f"Unsupported ASGI scope type `{other}`")
+
+    async def _lifespan(self, receive: Receive, send: Send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self._parser.aclose()
+                self._executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope: Scope, receive: Receive, send: Send):
+        body = await self._read_body(receive)
+        try:
+            environ = self._environ(scope, body)
+            if (raw_address := self._raw_address(scope, body)) and await self._prefetch_needed(environ, raw_address):
+                environ[PREFETCHED_ADDRESSES] = await self._prefetch(raw_address)
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._run_wsgi, environ, send, asyncio.get_running_loop()
+            )
+        finally:
+            body.close()
+
+    async def _read_body(self, receive: Receive) -> IO[bytes]:
+        body = tempfile.SpooledTemporaryFile(max_size=self._max_body_in_memory)
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            body.write(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body.seek(0)
+        return body
+
+    def _raw_address(self, scope: Scope, body: IO[bytes]) -> str | None:
+        match self._geocoded_paths.get(scope["path"]):
+            case "query":
+                values = parse_qs(scope["query_string"].decode("latin-1")).get("address")
+                return values[0] if values else None
+            case "json" if scope["method"] == "POST":
+                try:
+                    data = json.load(body)
+                except ValueError:
+                    return None  # the route answers with the error
+                finally:
+                    body.seek(0)
+                return data.get("address") if isinstance(data, dict) and isinstance(data.get("address"), str) else None
+        return None
+
+    async def _prefetch_needed(self, environ: dict[str, Any], raw_address: str) -> bool:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._needs_geocoding, environ)
+        except Exception as e:
+            self._logger.error(f"Could not check address `{raw_address}`, leaving it to the route\nError: `{e}`")
+            return False
+
+    async def _prefetch(self, raw_address: str) -> dict[str, Address | None | Exception]:
+        """
+        :return: the `PREFETCHED_ADDRESSES` of the request, empty if the route should resolve the address itself
+        """
+        try:
+            return {raw_address: await self._parser.normalize(raw_address)}
+        except GeocoderUnavailableError as e:
+            return {raw_address: e}
+        except Exception as e:
+            self._logger.error(f"Could not prefetch address `{raw_address}`, leaving it to the route\nError: `{e}`")
+            return {}
+
+    def _run_wsgi(self, environ: dict[str, Any], send: Send, loop: asyncio.AbstractEventLoop):
+        """
+        Runs on a pool thread, the response is sent on the event loop chunk by chunk
+        """
+        def send_sync(message: Message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response_start: list[Message] = []
+        started = False
+
+        def start_response(status: str, headers: list[tuple[str, str]], exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response_start[:] = [{
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+            }]
+            return write
+
+        def write(data: bytes):
+            nonlocal started
+            if not started:
+                send_sync(response_start[0])
+                started = True
+            if data:
+                send_sync({"type": "http.response.body", "body": data, "more_body": True})
+
+        result = self._app.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    write(chunk)
+            write(b"")
+            send_sync({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    @staticmethod
+    def _environ(scope: Scope, body: IO[bytes]) -> dict[str, Any]:
+        """
+        WSGI environ of an ASGI HTTP scope, see PEP 3333
+        """
+        server_name, server_port = scope.get("server") or ("localhost", 80)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope["query_string"].decode("latin-1"),
+            "SERVER_NAME": server_name,
+            "SERVER_PORT": str(server_port),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        if client := scope.get("client"):
+            environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = client[0], str(client[1])
+        for name, value in scope["headers"]:
+            name, value = name.decode("latin-1").upper().replace("-", "_"), value.decode("latin-1")
+            if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[name] = value
+            elif (key := f"HTTP_{name}") in environ:
+                environ[key] += f",{value}"
+            else:
+                environ[key] = value
+        # the body is fully buffered, so its length is known even if the client sent it chunked
+        environ["CONTENT_LENGTH"] = str(body.seek(0, io.SEEK_END))
+        body.seek(0)
+        return environ
@@ -0,0 +1,47 @@
+import dataclasses
+import hashlib
+import mimetypes
+from pathlib import Path
+
+from src.util.logging import Logger
+from src.web import compression
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class StaticAsset:
+
+    body: bytes
+    mimetype: str
+    # content hash, used as the ETag and as the `?v=` of versioned URLs
+    version: str
+    gzip_body: bytes | None = None
+
+
+class StaticAssets:
+    """
+    The files under the static folder, read and gzipped once at startup and served from memory. Assets are small and
+    few, and only change with a deploy (which restarts the application)
+    """
+
+    def __init__(self, assets: dict[str, StaticAsset] | None = None):
+        self._assets: dict[str, StaticAsset] = assets or {}
+
+    @classmethod
+    def from_directory(cls, root: Path, logger: Logger, level: int = 9) -> 'StaticAssets':
+        assets: dict[str, StaticAsset] = {}
+        for path in sorted(p for p in root.rglob("*") if p.is_file()):
+            body = path.read_bytes()
+            mimetype = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            gzip_body = None
+            if compression.compressible(mimetype) and len(gzipped := compression.compress(body, level)) < len(body):
+                gzip_body = gzipped
+            assets[path.relative_to(root).as_posix()] = StaticAsset(
+                body=body, mimetype=mimetype, version=hashlib.sha1(body).hexdigest()[:12], gzip_body=gzip_body
+            )
+        logger.info("Loaded %d static assets from %s (%d bytes, %d gzipped)", len(assets), root,
+                    sum(len(a.body) for a in assets.values()),
+                    sum(len(a.gzip_body or a.body) for a in assets.values()))
+        return cls(assets)
+
+    def get(self, filename: str) -> StaticAsset | None:
+        return self._assets.get(filename)
@@ -0,0 +1,60 @@
+import collections
+import dataclasses
+import threading
+from typing import Hashable
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class CachedResponse:
+
+    body: bytes
+    mimetype: str
+    headers: tuple[tuple[str, str], ...] = ()
+
+
+class QueryResultCache:
+    """
+    LRU cache of serialized search responses, keyed by endpoint and normalized query. Each entry remembers the
+    database generation (see `Database.generation`) it was computed at and is treated as a miss once the generation
+    has moved on, so writes never have to find and evict the entries they affect
+    """
+
+    def __init__(self, max_size: int = 1024, max_entry_bytes: int = 1024 * 1024):
+        self._max_size: int = max_size
+        self._max_entry_bytes: int = max_entry_bytes
+        self._entries: collections.OrderedDict[Hashable, tuple[int, CachedResponse]] = collections.OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key: Hashable, generation: int) -> 'CachedResponse | None':
+        """
+        :return: the response cached for the key at this generation
+        """
+        with self._lock:
+            if (entry := self._entries.get(key)) is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def contains(self, key: Hashable, generation: int) -> bool:
+        """
+        Whether `get` would hit, without counting it or refreshing the entry
+        """
+        with self._lock:
+            return (entry := self._entries.get(key)) is not None and entry[0] == generation
+
+    def put(self, key: Hashable, generation: int, response: 'CachedResponse') -> None:
+        if self._max_size <= 0 or len(response.body) > self._max_entry_bytes:
+            return
+        with self._lock:
+            self._entries[key] = (generation, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "max_size": self._max_size}
@@ -0,0 +1,36 @@
+import json
+from typing import Any, Iterable
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder produces the same output (slower)
+    orjson = None
+
+from src.web.model import Tenant
+
+FORMAT: str = "compact"
+MIMETYPE: str = "application/vnd.resonanz.compact+json"
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_tenants(tenants: Iterable[Tenant]) -> bytes:
+    """
+    Search results with every address listed once:
+    `{"addresses": {"<id>": {"address": ..., "lat": ..., "lon": ...}}, "tenants": [{"id": ..., "name": ...,
+    "address_id": ...}]}`. Tenants of the same building share one entry, so the (long) address strings are not
+    repeated per tenant. Built straight from the tenants' fields, without the `to_dict` layer
+    """
+    addresses: dict[str, dict[str, Any]] = {}
+    rows: list[dict[str, Any]] = []
+    for tenant in tenants:
+        address = tenant.address
+        address_id = address.id if address is not None else None
+        if address_id is not None and (key := str(address_id)) not in addresses:
+            addresses[key] = {"address": address.full_address, "lat": address.lat, "lon": address.lon}
+        rows.append({"id": tenant.id, "name": tenant.name, "address_id": address_id})
+    return dumps({"addresses": addresses, "tenants": rows})
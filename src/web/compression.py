@@ -0,0 +1,48 @@
+import gzip
+import zlib
+from typing import Iterable, Iterator
+
+GZIP: str = "gzip"
+
+# Everything else (images, archives) is already compressed
+_COMPRESSIBLE_PREFIXES: tuple[str, ...] = ("text/",)
+_COMPRESSIBLE_TYPES: frozenset[str] = frozenset((
+    "application/json",
+    "application/javascript",
+    "application/x-ndjson",
+    "application/vnd.resonanz.compact+json",
+    "image/svg+xml",
+))
+
+
+def compressible(mimetype: str | None) -> bool:
+    return bool(mimetype) and (mimetype.startswith(_COMPRESSIBLE_PREFIXES) or mimetype in _COMPRESSIBLE_TYPES)
+
+
+def compress(data: bytes, level: int) -> bytes:
+    # mtime=0 so that the same input always compresses to the same bytes
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_stream(chunks: Iterable[bytes | str], level: int, flush_bytes: int = 16 * 1024) -> Iterator[bytes]:
+    """
+    gzip a streamed response on the fly. The compressor is flushed whenever `flush_bytes` of input have accumulated,
+    so the client keeps receiving data while the stream is produced, without paying the flush overhead per chunk
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16+: gzip header and trailer
+    pending = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compressor.compress(chunk)
+            pending += len(chunk)
+            if pending >= flush_bytes:
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+                pending = 0
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
@@ -0,0 +1,79 @@
+import csv
+import io
+import json
+from typing import Callable, Iterable, Iterator
+
+from src.web.model import Tenant
+
+TEXT = "text"
+CSV = "csv"
+NDJSON = "ndjson"
+
+# format -> (mimetype, file extension)
+FORMATS: dict[str, tuple[str, str]] = {
+    TEXT: ("text/plain", "txt"),
+    CSV: ("text/csv", "csv"),
+    NDJSON: ("application/x-ndjson", "ndjson"),
+}
+
+_CHUNK_SIZE: int = 64 * 1024
+
+
+def export(tenants: Iterable[Tenant], fmt: str) -> Iterator[str]:
+    """
+    Serialize tenants (which must be ordered by address) into one of `FORMATS`, lazily and in chunks of roughly
+    `_CHUNK_SIZE` characters so that it can be sent as a chunked response
+    """
+    serializers: dict[str, Callable[[Iterable[Tenant]], Iterator[str]]] = {
+        TEXT: _grouped_text,
+        CSV: _csv,
+        NDJSON: _ndjson,
+    }
+    return _buffered(serializers[fmt](tenants))
+
+
+def _grouped_text(tenants: Iterable[Tenant]) -> Iterator[str]:
+    """
+    The format the search page has always downloaded: `[address]` followed by a comma separated line of the tenants
+    living there, with groups separated by a blank line
+    """
+    current = None
+    for tenant in tenants:
+        address = tenant.address.full_address
+        if address == current:
+            yield "," + tenant.name
+            continue
+        yield ("\n\n" if current is not None else "") + f"[{address}]\n{tenant.name}"
+        current = address
+
+
+def _csv(tenants: Iterable[Tenant]) -> Iterator[str]:
+    """
+    Same layout as the CSV upload, so an export can be imported again
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["name", "address"])
+    for tenant in tenants:
+        writer.writerow([tenant.name, tenant.address.full_address])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson(tenants: Iterable[Tenant]) -> Iterator[str]:
+    for tenant in tenants:
+        yield json.dumps(tenant.to_dict()) + "\n"
+
+
+def _buffered(parts: Iterable[str]) -> Iterator[str]:
+    chunk, size = [], 0
+    for part in parts:
+        chunk.append(part)
+        size += len(part)
+        if size >= _CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield "".join(chunk)
@@ -1,10 +1,12 @@
 import dataclasses
+from datetime import datetime
 from typing import Any
 
-from src.db.model import AddressModel, TenantModel
+from src.db.model import AddressModel, TenantModel, ImportJobModel
+from src.geo import geohash
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Address:
 
     full_address: str
@@ -45,11 +47,12 @@ class Address:
         return AddressModel(
             full_address=self.full_address,
             lat=self.lat,
-            lon=self.lon
+            lon=self.lon,
+            geohash=geohash.encode_or_none(self.lat, self.lon)
         )
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Tenant:
 
     name: str
@@ -66,6 +69,18 @@ class Tenant:
             d['address'] = self.address.to_dict()
         return d
 
+    @classmethod
+    def from_row(cls, row: tuple[int, str, int, str, float | None, float | None]) -> 'Tenant':
+        """
+        Build a tenant from a (tenant id, name, address id, full address, lat, lon) row, see `Session._tenant_rows`
+        """
+        tenant_id, name, address_id, full_address, lat, lon = row
+        return Tenant(
+            name=name,
+            id=tenant_id,
+            address=Address(full_address=full_address, id=address_id, lat=lat, lon=lon)
+        )
+
     @classmethod
     def from_tenant_model(cls, tenant_model: TenantModel) -> 'Tenant':
         return Tenant(
@@ -80,3 +95,101 @@ class Tenant:
             name_lower=self.name.lower(),
             address_id=self.address.id if self.address else None,
         )
+
+
+@dataclasses.dataclass(slots=True)
+class ImportJob:
+
+    # a chunked upload which is not complete yet and whose rows are all processed, see `ImportJobManager`
+    UPLOADING = "uploading"
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+    id: str
+    filename: str
+    spool_path: str
+    status: str
+    created_at: datetime
+    rows_total: int | None = None
+    checkpoint_row: int = 0
+    resumed_from_row: int = 0
+    success: int = 0
+    failed: int = 0
+    error: str | None = None
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    upload_size: int | None = None
+    uploaded_bytes: int | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (ImportJob.COMPLETED, ImportJob.FAILED)
+
+    @property
+    def chunked(self) -> bool:
+        return self.upload_size is not None
+
+    @property
+    def upload_complete(self) -> bool:
+        return not self.chunked or self.uploaded_bytes == self.upload_size
+
+    def rows_per_sec(self, now: datetime) -> float | None:
+        """
+        Throughput of the current (or last) run, which may have resumed from a checkpoint
+        """
+        if not self.started_at:
+            return None
+        elapsed = ((self.finished_at or now) - self.started_at).total_seconds()
+        return (self.checkpoint_row - self.resumed_from_row) / elapsed if elapsed > 0 else None
+
+    def to_dict(self, now: datetime) -> dict[str, Any]:
+        d = {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'rows_done': self.checkpoint_row,
+            'success': self.success,
+            'failed': self.failed,
+            'created_at': self.created_at.isoformat(),
+        }
+        if self.rows_total is not None:
+            d['rows_total'] = self.rows_total
+        if self.started_at:
+            d['started_at'] = self.started_at.isoformat()
+        if self.finished_at:
+            d['finished_at'] = self.finished_at.isoformat()
+        if self.error:
+            d['error'] = self.error
+        if self.chunked:
+            d['upload_size'] = self.upload_size
+            d['uploaded_bytes'] = self.uploaded_bytes
+        if (rate := self.rows_per_sec(now)) is not None:
+            d['rows_per_sec'] = round(rate, 2)
+            if not self.finished and rate > 0 and self.rows_total is not None:
+                d['eta_seconds'] = round(max(0, self.rows_total - self.checkpoint_row) / rate, 1)
+        return d
+
+    @classmethod
+    def from_import_job_model(cls, model: ImportJobModel) -> 'ImportJob':
+        return ImportJob(
+            id=model.id,
+            filename=model.filename,
+            spool_path=model.spool_path,
+            status=model.status,
+            created_at=model.created_at,
+            rows_total=model.rows_total,
+            checkpoint_row=model.checkpoint_row,
+            resumed_from_row=model.resumed_from_row,
+            success=model.success,
+            failed=model.failed,
+            error=model.error,
+            started_at=model.started_at,
+            finished_at=model.finished_at,
+            upload_size=model.upload_size,
+            uploaded_bytes=model.uploaded_bytes,
+        )
+
+    def to_import_job_model(self) -> ImportJobModel:
+        return ImportJobModel(**{f.name: getattr(self, f.name) for f in dataclasses.fields(self)})
@@ -0,0 +1,108 @@
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Callable
+
+from src.util.logging import Logger
+
+
+class PreforkServer:
+    """
+    Serves the application from several processes. The parent binds the listening socket, forks `workers` children
+    which all accept on it, and restarts any child which dies until it is asked to stop (SIGTERM or SIGINT, which it
+    forwards to the children).
+    Everything built before `run` (the app, the database engine, the address parser) is inherited by the children.
+    State which must stay common to all of them lives in shared memory (the rate limiter budget) or in the database
+    (its generation), anything bound to the parent process is reset by `on_worker_start` in each child
+    """
+
+    _backlog: int = 1024
+    # seconds to wait before restarting a worker which died, so a worker failing at startup doesn't spin
+    _restart_delay: float = 1.0
+
+    def __init__(self, serve: Callable[[socket.socket], None], logger: Logger, port: int, workers: int,
+                 on_worker_start: Callable[[int, bool], None] | None = None,
+                 on_worker_exit: Callable[[int], None] | None = None):
+        """
+        :param serve: serves requests on the listening socket until the process is asked to stop
+        :param on_worker_start: called in each child with the worker index and whether this is its first start
+        :param on_worker_exit: called in each child with the worker index when it stops serving, the child then exits
+        without unwinding into the parent's code or running its `atexit` handlers
+        """
+        self._serve: Callable[[socket.socket], None] = serve
+        self._logger: Logger = logger
+        self._port: int = port
+        self._workers: int = workers
+        self._on_worker_start: Callable[[int, bool], None] | None = on_worker_start
+        self._on_worker_exit: Callable[[int], None] | None = on_worker_exit
+        self._children: dict[int, int] = {}  # pid -> worker index
+        self._stopping: bool = False
+
+    def run(self) -> None:
+        sock = socket.create_server(("0.0.0.0", self._port), backlog=self._backlog)
+        previous = {sig: signal.signal(sig, self._stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            for worker in range(self._workers):
+                self._spawn(sock, worker, first_start=True)
+            while self._children:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                if (worker := self._children.pop(pid, None)) is None or self._stopping:
+                    continue
+                self._logger.warning("Worker %d (pid %d) exited with status %d, restarting it", worker, pid,
+                                     os.waitstatus_to_exitcode(status))
+                time.sleep(self._restart_delay)
+                if not self._stopping:
+                    self._spawn(sock, worker, first_start=False)
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+            sock.close()
+        self._logger.info("All workers stopped")
+
+    def _spawn(self, sock: socket.socket, worker: int, first_start: bool) -> None:
+        if pid := os.fork():
+            self._children[pid] = worker
+            self._logger.info("Started worker %d (pid %d)", worker, pid)
+            return
+
+        # In the child: never return into the parent's loop, nor unwind through the `finally` blocks of the code which
+        # called `run` (they clean up after the parent), hence `os._exit`
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        code = 0
+        try:
+            if self._on_worker_start is not None:
+                self._on_worker_start(worker, first_start)
+            self._serve(sock)
+        except (SystemExit, KeyboardInterrupt):
+            pass
+        except BaseException as e:
+            self._logger.error(f"Worker {worker} failed\nError: `{e}`")
+            code = 1
+        try:
+            if self._on_worker_exit is not None:
+                self._on_worker_exit(worker)
+        except BaseException as e:
+            self._logger.error(f"Worker {worker} failed to shut down cleanly\nError: `{e}`")
+            code = code or 1
+        finally:
+            Logger.flush()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _stop(self, signum: int, _frame) -> None:
+        if self._stopping:
+            return
+        self._stopping = True
+        self._logger.info("Got signal %d, stopping %d workers", signum, len(self._children))
+        for pid in self._children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
@@ -42,43 +42,110 @@ document.addEventListener("DOMContentLoaded", function() {
     tenantAddressInput.value = '';
   }
 
-  function uploadFile(file) {
-    const formData = new FormData();
-    formData.append('file', file);
+  const CHUNK_ATTEMPTS = 5;
 
-    const xhr = new XMLHttpRequest();
-    xhr.open('POST', '/insert/_batch', true);
-
-    xhr.upload.onprogress = updateProgressBar;
-    xhr.onload = () => handleFileUploadResponse(xhr);
+  // The file is sent in chunks (see /insert/_uploads), so a lost connection only costs the current chunk and the
+  // import starts while the rest is still uploading
+  async function uploadFile(file) {
+    progressBar.style.display = 'block';
+    try {
+      const upload = await startUpload(file);
+      let offset = upload.offset;
+      while (offset < file.size) {
+        offset = await sendChunk(upload.upload_url, file.slice(offset, offset + upload.chunk_size), offset);
+        progressBarStatus.style.width = (offset / file.size) * 100 + '%';
+      }
+      localStorage.removeItem(uploadKey(file));
+      // the upload is done, the bar now tracks the background import
+      progressBarStatus.style.width = '0%';
+      pollImportJob(upload.status_url);
+    } catch (error) {
+      displayToast(`Error - File upload failed: ${error.message}`, "#dc3545");
+      resetProgressBar();
+    }
+  }
 
-    xhr.send(formData);
+  function uploadKey(file) {
+    return `upload:${file.name}:${file.size}:${file.lastModified}`;
   }
 
-  function updateProgressBar(e) {
-    if (e.lengthComputable) {
-      const percentComplete = (e.loaded / e.total) * 100;
-      progressBar.style.display = 'block';
-      progressBarStatus.style.width = percentComplete + '%';
+  async function startUpload(file) {
+    // selecting the same file again resumes its interrupted upload
+    const previous = localStorage.getItem(uploadKey(file));
+    if (previous) {
+      const response = await fetch(previous);
+      if (response.ok) {
+        return response.json();
+      }
+    }
+    const response = await fetch('/insert/_uploads', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: file.name, size: file.size }),
+    });
+    const upload = await response.json();
+    if (!response.ok) {
+      throw new Error(upload.error);
     }
+    localStorage.setItem(uploadKey(file), upload.upload_url);
+    return upload;
   }
 
-  function handleFileUploadResponse(xhr) {
-    const response = JSON.parse(xhr.responseText);
-    const total = response.success + response.failed;
-    const successMessage = `Imported ${response.success}/${total} entries.`;
-    if (xhr.status === 201) {
-      displayToast(successMessage, "#5cb85c");
-    } else if (xhr.status === 206) {
-      displayToast(successMessage, "#ffc107");
-    } else {
-      displayToast("Error - File upload failed.", "#dc3545");
+  // Returns the offset of the next chunk
+  async function sendChunk(uploadUrl, chunk, offset) {
+    const data = await chunk.arrayBuffer();
+    const headers = {};
+    if (window.crypto && crypto.subtle) {  // only on secure origins (https, localhost)
+      const digest = new Uint8Array(await crypto.subtle.digest('SHA-256', data));
+      headers['X-Chunk-Sha256'] = Array.from(digest, b => b.toString(16).padStart(2, '0')).join('');
     }
+    for (let attempt = 1; ; attempt++) {
+      try {
+        const response = await fetch(`${uploadUrl}?offset=${offset}`, { method: 'PUT', headers, body: data });
+        const result = await response.json();
+        // a conflict tells where the server is, the next chunk starts there
+        if (response.ok || (response.status === 409 && result.offset !== undefined)) {
+          return result.offset;
+        }
+        throw new Error(result.error);
+      } catch (error) {
+        if (attempt >= CHUNK_ATTEMPTS) {
+          throw error;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+      }
+    }
+  }
+
+  function pollImportJob(statusUrl) {
+    fetch(statusUrl)
+      .then(response => response.json())
+      .then(job => {
+        if (job.rows_total) {
+          progressBarStatus.style.width = Math.min(100, (job.rows_done / job.rows_total) * 100) + '%';
+        }
+        if (job.status === 'completed') {
+          const total = job.success + job.failed;
+          displayToast(`Imported ${job.success}/${total} entries.`, job.failed === 0 ? "#5cb85c" : "#ffc107");
+          resetProgressBar();
+        } else if (job.status === 'failed') {
+          displayToast(`Error - Import failed: ${job.error}`, "#dc3545");
+          resetProgressBar();
+        } else {
+          setTimeout(() => pollImportJob(statusUrl), 1000);
+        }
+      })
+      .catch(error => {
+        displayToast('Error: ' + error, "#dc3545");
+        resetProgressBar();
+      });
+  }
+
+  function resetProgressBar() {
     progressBar.style.display = 'none';
     progressBarStatus.style.width = '0%';
   }
 
-
   function makeRequest(url, method, data, callback) {
     const xhr = new XMLHttpRequest();
     xhr.open(method, url, true);
@@ -4,10 +4,12 @@ import { displayToast } from './alert.js';
 document.addEventListener("DOMContentLoaded", function() {
   const searchForm = document.getElementById('searchForm');
   const searchTypeSelect = document.getElementById('searchType');
+  const searchModeSelect = document.getElementById('searchMode');
   const searchInput = document.getElementById('searchInput');
   const searchBtn = document.getElementById('searchBtn');
   const downloadBtn = document.getElementById('downloadBtn');
   const searchResults = document.getElementById('searchResults');
+  let lastQueryString = '';
 
   searchBtn.addEventListener('click', performSearch);
   downloadBtn.addEventListener('click', downloadResults);
@@ -16,56 +18,36 @@ document.addEventListener("DOMContentLoaded", function() {
     const searchType = searchTypeSelect.value;
     const query = searchInput.value.trim();
     const endpoint = searchType === 'tenant' ? '/search/_addresses' : '/search/_tenants';
-    const queryString = searchType === 'address' ? `?address=${encodeURIComponent(query)}` : `?name=${encodeURIComponent(query)}`;
+    const queryString = searchType === 'address'
+      ? `?address=${encodeURIComponent(query)}`
+      : `?name=${encodeURIComponent(query)}&mode=${encodeURIComponent(searchModeSelect.value)}`;
 
-    fetch(endpoint + queryString)
+    lastQueryString = queryString;
+    // the compact format lists each address once, tenants refer to it by ID
+    fetch(endpoint + queryString + '&format=compact')
       .then(response => response.json())
       .then(data => {
+        if (data.error) {
+          throw data.error;
+        }
         updateSearchResults(data);
-        downloadBtn.disabled = data.length === 0;
+        downloadBtn.disabled = data.tenants.length === 0;
       })
       .catch(error => displayToast('Error: ' + error, 'red'));
   }
 
   function updateSearchResults(data) {
-    searchResults.innerHTML = '';
-    data.forEach(item => {
+    searchResults.innerHTML = data.tenants.map(item => {
       const tenantName = item.name || '';
-      const address = item.address.address || '';
-      const row = `<tr><td>${tenantName}</td><td>${address}</td></tr>`;
-      searchResults.innerHTML += row;
-    });
+      const address = (data.addresses[item.address_id] || {}).address || '';
+      return `<tr><td>${tenantName}</td><td>${address}</td></tr>`;
+    }).join('');
   }
 
   function downloadResults() {
-    const data = Array.from(searchResults.querySelectorAll('tr'))
-      .map(row => ({
-        name: row.cells[0].textContent,
-        address: row.cells[1].textContent
-      }));
-
-    const formattedData = formatDataForDownload(data);
-    const filename = 'search_results.txt';
-    initiateDownload(filename, formattedData);
-  }
-
-  function formatDataForDownload(data) {
-    let tenantsByAddress = data.reduce((acc, { name, address }) => {
-      acc[address] = acc[address] || [];
-      acc[address].push(name);
-      return acc;
-    }, {});
-
-    return Object.entries(tenantsByAddress)
-      .sort(([a], [b]) => a.localeCompare(b))
-      .map(([address, tenants]) => `[${address}]\n${tenants.sort().join(',')}`)
-      .join('\n\n');
-  }
-
-  function initiateDownload(filename, text) {
+    // the server streams the export, so it is not limited to what has been rendered here
     const element = document.createElement('a');
-    element.setAttribute('href', 'data:text/plain;charset=utf-8,' + encodeURIComponent(text));
-    element.setAttribute('download', filename);
+    element.setAttribute('href', '/search/_export' + lastQueryString);
     element.style.display = 'none';
     document.body.appendChild(element);
     element.click();
@@ -0,0 +1,13 @@
+import pytest
+
+from src.util.meta import SingletonMeta
+
+
+@pytest.fixture(autouse=True)
+def fresh_application():
+    """
+    `Application` is a singleton, every test builds its own
+    """
+    SingletonMeta._instances.pop("Application", None)
+    yield
+    SingletonMeta._instances.pop("Application", None)
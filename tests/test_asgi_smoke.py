@@ -0,0 +1,28 @@
+import asyncio
+import logging
+
+import httpx
+
+from benchmarks import fake_geocoder
+from config import DatabaseConfig
+from src.db.conn import Database
+from src.util.logging import Logger
+from src.web.app import Application
+
+
+def test_asgi_search(tmp_path):
+    fake_geocoder.register()
+    logger = Logger("SMOKE", level=logging.ERROR)
+    db = Database(DatabaseConfig(db_type=Database.TYPE_SQLITE, db_name=str(tmp_path / "smoke")), logger=logger)
+    app = Application(logger, db, parser_engine=fake_geocoder.ENGINE, import_spool_dir=tmp_path / "spool")
+
+    async def run():
+        transport = httpx.ASGITransport(app=app.asgi_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://smoke") as client:
+            inserted = await client.post("/insert/_tenant", json={"name": "Smoke Tenant", "address": "1 smoke st"})
+            assert inserted.status_code == 201
+            found = await client.get("/search/_tenants", params={"address": "1 Smoke St"})
+            assert found.status_code == 200
+            assert [t["name"] for t in found.json()] == ["Smoke Tenant"]
+
+    asyncio.run(run())
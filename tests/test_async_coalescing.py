@@ -0,0 +1,67 @@
+import asyncio
+import logging
+
+from src.geo.aio import AsyncAddressParser, _AsyncCoalescingAddressParser
+from src.util.logging import Logger
+from src.web.model import Address
+
+
+class _SlowParser(AsyncAddressParser):
+
+    def __init__(self, logger: Logger):
+        AsyncAddressParser.__init__(self, logger)
+        self.release: asyncio.Event = asyncio.Event()
+        self.calls: int = 0
+        self.cancelled: int = 0
+
+    async def normalize(self, address: str) -> Address | None:
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return Address(full_address=address.title(), lat=1.0, lon=2.0)
+
+
+def _new_parser() -> tuple[_SlowParser, _AsyncCoalescingAddressParser]:
+    logger = Logger("TEST", level=logging.ERROR)
+    slow = _SlowParser(logger)
+    return slow, _AsyncCoalescingAddressParser(slow, logger)
+
+
+def test_cancelled_leader_leaves_the_waiters_their_result():
+    async def run():
+        slow, parser = _new_parser()
+        leader = asyncio.create_task(parser.normalize("1 main st"))
+        waiter = asyncio.create_task(parser.normalize("1 main st"))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        slow.release.set()
+        assert (await waiter).full_address == "1 Main St"
+        assert leader.cancelled()
+        assert (slow.calls, slow.cancelled) == (1, 0)
+        assert parser.stats()["coalescing"] == {"calls": 1, "coalesced": 1, "in_flight": 0}
+
+    asyncio.run(run())
+
+
+def test_call_is_cancelled_once_no_caller_is_left():
+    async def run():
+        slow, parser = _new_parser()
+        callers = [asyncio.create_task(parser.normalize("1 main st")) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert (slow.calls, slow.cancelled) == (1, 1)
+        assert parser.stats()["coalescing"]["in_flight"] == 0
+
+        # the next caller starts a call of its own
+        slow.release.set()
+        assert (await parser.normalize("1 main st")).full_address == "1 Main St"
+        assert slow.calls == 2
+
+    asyncio.run(run())
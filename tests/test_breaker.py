@@ -0,0 +1,113 @@
+import types
+
+import pytest
+
+from src.geo import breaker
+from src.geo.breaker import CircuitBreaker, FailoverPolicy
+
+
+@pytest.fixture
+def clock(monkeypatch) -> types.SimpleNamespace:
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(breaker, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def _breaker() -> CircuitBreaker:
+    return CircuitBreaker(FailoverPolicy(hedge_after=1.0, window=10, min_calls=4, max_error_rate=0.5,
+                                         max_slow_rate=0.5, cooldown=30.0))
+
+
+def _open(circuit: CircuitBreaker) -> None:
+    for _ in range(4):
+        circuit.record(failed=True, seconds=0.1)
+    assert circuit.state == CircuitBreaker.OPEN
+
+
+def test_stays_closed_until_it_has_seen_min_calls(clock):
+    circuit = _breaker()
+    for _ in range(3):
+        circuit.record(failed=True, seconds=0.1)
+    assert circuit.state == CircuitBreaker.CLOSED and circuit.allow()
+    circuit.record(failed=True, seconds=0.1)
+    assert circuit.state == CircuitBreaker.OPEN and not circuit.allow()
+    assert circuit.stats()["times_opened"] == 1
+
+
+def test_opens_on_the_error_rate_or_the_slow_rate(clock):
+    circuit = _breaker()
+    for failed in (False, True, False, True):
+        circuit.record(failed=failed, seconds=0.1)
+    assert circuit.state == CircuitBreaker.CLOSED  # 50% is not above the limit
+    circuit.record(failed=True, seconds=0.1)
+    assert circuit.state == CircuitBreaker.OPEN
+
+    slow = _breaker()
+    for seconds in (0.1, 1.5, 1.0, 2.0, 3.0):
+        slow.record(failed=False, seconds=seconds)
+    assert slow.state == CircuitBreaker.OPEN  # 1.0 is not slow, the other three of five are
+    assert slow.stats()["slow_rate"] == 0.6
+
+
+def test_old_calls_leave_the_window(clock):
+    circuit = _breaker()
+    for failed in (False, False, False, False, True, True, True, True):
+        circuit.record(failed=failed, seconds=0.1)
+    assert circuit.stats()["error_rate"] == 0.5
+    for _ in range(8):
+        circuit.record(failed=False, seconds=0.1)
+    # the window holds the last 10 calls, two of the failures are left
+    assert circuit.stats()["recent_calls"] == 10 and circuit.stats()["error_rate"] == 0.2
+    for _ in range(2):
+        circuit.record(failed=False, seconds=0.1)
+    assert circuit.stats()["error_rate"] == 0.0
+
+
+def test_half_open_lets_a_single_trial_through(clock):
+    circuit = _breaker()
+    _open(circuit)
+    clock.now += 29.9
+    assert circuit.state == CircuitBreaker.OPEN and not circuit.allow()
+    clock.now += 0.1
+    assert circuit.state == CircuitBreaker.HALF_OPEN
+    assert circuit.allow()
+    assert not circuit.allow()  # the trial is running
+
+
+def test_successful_trial_closes_the_circuit(clock):
+    circuit = _breaker()
+    _open(circuit)
+    clock.now += 30
+    assert circuit.allow()
+    circuit.record(failed=False, seconds=0.2)
+    assert circuit.state == CircuitBreaker.CLOSED
+    # the calls which opened it are forgotten
+    assert circuit.stats()["recent_calls"] == 0
+    circuit.record(failed=True, seconds=0.1)
+    assert circuit.allow()
+
+
+@pytest.mark.parametrize("failed, seconds", [(True, 0.1), (False, 1.5)])
+def test_failed_or_slow_trial_opens_the_circuit_again(clock, failed, seconds):
+    circuit = _breaker()
+    _open(circuit)
+    clock.now += 30
+    assert circuit.allow()
+    circuit.record(failed=failed, seconds=seconds)
+    assert circuit.state == CircuitBreaker.OPEN and not circuit.allow()
+    # for a whole cooldown from the trial
+    clock.now += 29.9
+    assert circuit.state == CircuitBreaker.OPEN
+    clock.now += 0.1
+    assert circuit.allow()
+
+
+def test_calls_from_before_the_circuit_opened_are_ignored(clock):
+    circuit = _breaker()
+    _open(circuit)
+    circuit.record(failed=False, seconds=0.1)
+    assert circuit.state == CircuitBreaker.OPEN
+    clock.now += 30
+    # not the trial either: it has not been claimed
+    circuit.record(failed=False, seconds=0.1)
+    assert circuit.state == CircuitBreaker.HALF_OPEN and circuit.allow()
@@ -0,0 +1,84 @@
+import logging
+import time
+
+import pytest
+
+from benchmarks import fake_geocoder
+from config import DatabaseConfig
+from src.db.conn import Database
+from src.ingest.upload import SpoolTail, UploadStalledError
+from src.util.logging import Logger
+from src.web.app import Application
+from src.web.model import ImportJob
+
+
+def _tail(path, data: bytes, committed: list[int], **kwargs) -> SpoolTail:
+    path.write_bytes(data)
+    return SpoolTail(str(path), len(data), lambda: committed[0], poll_interval=0.01, **kwargs)
+
+
+def test_spool_tail_returns_complete_lines_of_the_committed_bytes(tmp_path):
+    data = b'name,address\nA,1 a st\nB,"2 b\nst"\nC,3 c st'
+    committed = [len(b"name,address\nA,1 a")]
+    tail = _tail(tmp_path / "spool.csv", data, committed, idle_timeout=0.05)
+    assert list(tail) == ["name,address\n"]
+    assert tail.committed == committed[0]
+
+    # a new tail (the resumed import) reads from the start again, up to the offset committed since
+    committed[0] = len(data)
+    tail = _tail(tmp_path / "spool.csv", data, committed, idle_timeout=0.05)
+    assert list(tail) == ["name,address\n", "A,1 a st\n", 'B,"2 b\n', 'st"\n', "C,3 c st"]
+    assert tail.committed == len(data)
+
+
+def test_spool_tail_follows_chunks_committed_while_it_reads(tmp_path):
+    data = b"name,address\nA,1 a st\nB,2 b st\n"
+    committed = [len(b"name,address\nA,")]
+    tail = iter(_tail(tmp_path / "spool.csv", data, committed, idle_timeout=5.0))
+    assert next(tail) == "name,address\n"
+    committed[0] = len(data)
+    assert list(tail) == ["A,1 a st\n", "B,2 b st\n"]
+
+
+def test_spool_tail_stalled_inside_a_quoted_field(tmp_path):
+    data = b'name,address\nA,"1 a\nst"\n'
+    committed = [len(b'name,address\nA,"1 a\n')]
+    tail = _tail(tmp_path / "spool.csv", data, committed, idle_timeout=0.05)
+    lines = iter(tail)
+    assert next(lines) == "name,address\n"
+    assert next(lines) == 'A,"1 a\n'
+    with pytest.raises(UploadStalledError):
+        next(lines)
+
+
+def _wait_for(client, status_url: str, status: str) -> dict:
+    deadline = time.monotonic() + 10
+    while (job := client.get(status_url).json)["status"] != status:
+        assert time.monotonic() < deadline, job
+        time.sleep(0.02)
+    return job
+
+
+def test_paused_upload_resumes_after_its_checkpoint(tmp_path):
+    fake_geocoder.register()
+    logger = Logger("TEST", level=logging.ERROR)
+    db = Database(DatabaseConfig(db_type=Database.TYPE_SQLITE, db_name=str(tmp_path / "upload")), logger=logger)
+    app = Application(logger, db, parser_engine=fake_geocoder.ENGINE, import_spool_dir=tmp_path / "spool")
+    app._import_jobs._upload_idle_timeout = 0.1
+    client = app._app.test_client()
+
+    data = b"name,address\nA,1 a st\nB,2 b st\nC,3 c st\n"
+    upload = client.post("/insert/_uploads", json={"filename": "t.csv", "size": len(data)}).json
+    first = data.index(b"B,2 b") + len(b"B,2 b")
+    assert client.put(f"{upload['upload_url']}?offset=0", data=data[:first]).json["offset"] == first
+
+    # no chunk for a while: the import pauses after the complete rows
+    job = _wait_for(client, upload["status_url"], ImportJob.UPLOADING)
+    assert (job["success"], job["rows_done"], job["uploaded_bytes"]) == (1, 1, first)
+
+    assert client.put(f"{upload['upload_url']}?offset={first}", data=data[first:]).json["offset"] == len(data)
+    job = _wait_for(client, upload["status_url"], ImportJob.COMPLETED)
+    assert (job["success"], job["failed"], job["rows_done"]) == (3, 0, 3)
+    assert db.get_import_job(upload["job_id"]).resumed_from_row == 1
+    # the rows before the checkpoint were not imported again
+    assert sorted(t.name for t in db.get_all_tenants()) == ["A", "B", "C"]
@@ -0,0 +1,92 @@
+import logging
+import random
+
+import pytest
+
+from config import DatabaseConfig
+from src.db.conn import Database
+from src.geo import geohash
+from src.util.logging import Logger
+from src.web.model import Address
+
+
+@pytest.fixture
+def db(tmp_path) -> Database:
+    logger = Logger("TEST", level=logging.ERROR)
+    return Database(DatabaseConfig(db_type=Database.TYPE_SQLITE, db_name=str(tmp_path / "geo")), logger=logger)
+
+
+def _insert(db: Database, points: list[tuple[float, float]]) -> None:
+    tenants = [(f"T{i}", Address(full_address=f"{i} Geo St", lat=lat, lon=lon), None)
+               for i, (lat, lon) in enumerate(points)]
+    assert db.batch_insert_tenants(tenants) == len(points)
+
+
+def _near(db: Database, lat: float, lon: float, radius_m: float) -> list[str]:
+    return sorted(t.name for t, _ in db.get_tenants_near(lat, lon, radius_m=radius_m, limit=10_000))
+
+
+def _expected(points: list[tuple[float, float]], lat: float, lon: float, radius_m: float) -> list[str]:
+    return sorted(f"T{i}" for i, p in enumerate(points) if geohash.haversine_m(lat, lon, *p) <= radius_m)
+
+
+def test_radius_across_the_antimeridian(db):
+    points = [(10.0, 179.995), (10.0, -179.995), (10.0, -179.9), (10.0, 179.9), (10.0, 0.0)]
+    _insert(db, points)
+    assert len(geohash.radius_boxes(10.0, 179.999, 5_000)) == 2
+    assert _near(db, 10.0, 179.999, 5_000) == ["T0", "T1"]
+    assert _near(db, 10.0, -179.999, 15_000) == ["T0", "T1", "T2", "T3"]
+
+
+def test_radius_around_a_pole(db):
+    points = [(89.999, lon) for lon in range(-180, 180, 30)] + [(89.9, 0.0), (-89.999, 0.0)]
+    _insert(db, points)
+    # the circle contains the pole: every longitude is in it
+    [(min_lat, min_lon, max_lat, max_lon)] = geohash.radius_boxes(89.999, 45.0, 1_000)
+    assert (min_lon, max_lat, max_lon) == (-180.0, 90.0, 180.0) and min_lat < 89.999
+    assert _near(db, 89.999, 45.0, 1_000) == _expected(points, 89.999, 45.0, 1_000)
+    assert len(_near(db, 89.999, 45.0, 1_000)) == 12
+    assert _near(db, 90.0, 0.0, 12_000) == _expected(points, 90.0, 0.0, 12_000)
+    assert _near(db, -90.0, 0.0, 1_000) == ["T13"]
+
+
+def test_radius_larger_than_a_cell(db):
+    rng = random.Random(4)
+    points = [(rng.uniform(40, 60), rng.uniform(-10, 30)) for _ in range(500)]
+    _insert(db, points)
+    for radius_m in (50_000, 300_000, 1_000_000):
+        # far more cells of the finest precision than `covering_prefixes` allows, so it covers with coarser ones
+        prefixes = geohash.covering_prefixes(geohash.radius_boxes(50.0, 10.0, radius_m))
+        assert len(prefixes) <= 32 and len(prefixes[0]) < geohash.PRECISION
+        assert _near(db, 50.0, 10.0, radius_m) == _expected(points, 50.0, 10.0, radius_m)
+
+
+def test_random_circles_match_the_exact_distance(db):
+    rng = random.Random(4)
+    points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(2_000)]
+    points += [(rng.uniform(85, 90), rng.uniform(-180, 180)) for _ in range(200)]
+    points += [(rng.uniform(-10, 10), rng.choice((-1, 1)) * rng.uniform(178, 180)) for _ in range(200)]
+    _insert(db, points)
+    centres = [(0.0, 179.9), (0.0, -180.0), (88.0, 100.0), (-89.5, -20.0), (45.0, 7.0)]
+    for lat, lon in centres:
+        for radius_m in (10_000, 100_000, 500_000):
+            assert _near(db, lat, lon, radius_m) == _expected(points, lat, lon, radius_m), (lat, lon, radius_m)
+
+
+def test_exact_boundary_distances(db):
+    points = [(0.0, 0.0), (0.0, 0.01), (0.02, 0.0), (0.0, 0.02)]
+    _insert(db, points)
+    edge = geohash.haversine_m(0.0, 0.0, 0.0, 0.01)
+    # a point exactly on the circle is inside it
+    assert _near(db, 0.0, 0.0, edge) == ["T0", "T1"]
+    assert _near(db, 0.0, 0.0, edge * (1 - 1e-9)) == ["T0"]
+    # and a point exactly on the edge of a box is inside it
+    assert sorted(t.name for t, _ in db.get_tenants_in_box((0.0, 0.0, 0.02, 0.01))) == ["T0", "T1", "T2"]
+    assert sorted(t.name for t, _ in db.get_tenants_in_box((-1.0, 0.01, 1.0, 0.02))) == ["T1", "T3"]
+
+
+def test_box_across_the_antimeridian(db):
+    points = [(0.0, 179.5), (0.0, -179.5), (0.0, 0.0), (0.0, 180.0), (0.0, -180.0)]
+    _insert(db, points)
+    assert sorted(t.name for t, _ in db.get_tenants_in_box((-1.0, 179.0, 1.0, -179.0))) == ["T0", "T1", "T3", "T4"]
+    assert sorted(t.name for t, _ in db.get_tenants_in_box((-1.0, -179.0, 1.0, 179.0))) == ["T2"]
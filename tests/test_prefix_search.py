@@ -0,0 +1,42 @@
+import logging
+import sys
+
+import pytest
+
+from config import DatabaseConfig
+from src.db.conn import Database
+from src.db.session import Session
+from src.util.logging import Logger
+from src.web.model import Address
+
+_MAX = chr(sys.maxunicode)
+
+
+@pytest.mark.parametrize("prefix, expected", [
+    ("ab", "ac"),
+    ("a" + _MAX, "b"),
+    ("a" + _MAX * 2, "b"),
+    (_MAX, None),
+    (_MAX * 3, None),
+    # the surrogates which would come next are skipped
+    ("a\ud7ff", "a\ue000"),
+])
+def test_next_prefix(prefix, expected):
+    assert Session._next_prefix(prefix) == expected
+
+
+def test_prefix_search_with_the_last_code_point(tmp_path):
+    logger = Logger("TEST", level=logging.ERROR)
+    db = Database(DatabaseConfig(db_type=Database.TYPE_SQLITE, db_name=str(tmp_path / "prefix")), logger=logger)
+    names = ["a", "a" + _MAX, "a" + _MAX + "z", "b", _MAX, _MAX + "x", "\ud7ff", "\ue000"]
+    tenants = [(name, Address(full_address=f"{i} Prefix St", lat=1.0, lon=2.0), None) for i, name in enumerate(names)]
+    assert db.batch_insert_tenants(tenants) == len(names)
+
+    def search(prefix: str) -> list[str]:
+        return sorted(t.name for t in db.get_addresses_for_tenant_name(prefix, mode=Database.SEARCH_PREFIX))
+
+    assert search("a" + _MAX) == sorted(["a" + _MAX, "a" + _MAX + "z"])
+    assert search(_MAX) == sorted([_MAX, _MAX + "x"])
+    assert search("a") == sorted(["a", "a" + _MAX, "a" + _MAX + "z"])
+    assert search("\ud7ff") == ["\ud7ff"]
+    assert search("\ue000") == ["\ue000"]
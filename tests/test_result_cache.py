@@ -0,0 +1,32 @@
+import logging
+
+from benchmarks import fake_geocoder
+from config import DatabaseConfig
+from src.db.conn import Database
+from src.util.logging import Logger
+from src.web.app import Application
+from src.web.model import Address
+
+
+def test_write_from_another_process_invalidates_cached_searches(tmp_path):
+    fake_geocoder.register()
+    logger = Logger("TEST", level=logging.ERROR)
+    config = DatabaseConfig(db_type=Database.TYPE_SQLITE, db_name=str(tmp_path / "cache"))
+    db = Database(config, logger=logger)
+    app = Application(logger, db, parser_engine=fake_geocoder.ENGINE, import_spool_dir=tmp_path / "spool")
+    client = app._app.test_client()
+    assert client.post("/insert/_tenant", json={"name": "Alice", "address": "1 cache st"}).status_code == 201
+
+    first = client.get("/search/_addresses")
+    assert [t["name"] for t in first.json] == ["Alice"]
+    etag = first.headers["ETag"]
+    assert client.get("/search/_addresses", headers={"If-None-Match": etag}).status_code == 304
+
+    # what the command line import does: its own `Database` on the same file, outside the server's processes
+    other = Database(config, logger=logger)
+    assert other.batch_insert_tenants([("Bob", Address(full_address="2 Cache St", lat=1.0, lon=2.0), None)]) == 1
+
+    assert client.get("/search/_addresses", headers={"If-None-Match": etag}).status_code == 200
+    second = client.get("/search/_addresses")
+    assert second.headers["ETag"] != etag
+    assert sorted(t["name"] for t in second.json) == ["Alice", "Bob"]